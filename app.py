@@ -1,15 +1,12 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import time
-import json
 import os
 import yaml
-import psycopg2
+from psycopg2 import pool
 
 # IMPORTACIÓN DIRECTA (SOLUCIÓN DEFINITIVA)
 import main as script_etl
-import generar_datos as script_generador
+# ### NUEVO: pandas, plotly y generar_datos (Faker + requests) se importan donde se usan: la página abre más rápido ###
 
 # CONFIGURACIÓN
 st.set_page_config(page_title="Proyecto Final ETL - FES Acatlán", page_icon="🐾", layout="wide")
@@ -30,20 +27,52 @@ st.markdown("""
 
 # FUNCIONES
 def cargar_logs():
-    if os.path.exists("logs_historial.json"):
-        try:
-            with open("logs_historial.json", "r") as f: return json.load(f)
-        except: return []
-    return []
+    # Índice pequeño (totales + últimas ejecuciones): no parsea todo el historial en cada rerun
+    try: return script_etl.cargar_indice_logs()
+    except: return {"ejecuciones": 0, "total_registros_movidos": 0, "ultimas": []}
 
-def consultar_db(query, target="source"):
+def cargar_historial_completo():
+    try: return script_etl.leer_historial_logs()
+    except: return []
+
+# --- ACCESO A DATOS: POOL COMPARTIDO + CACHÉ CON TTL ---
+# Antes cada consulta releía config.yaml y abría una conexión nueva (handshake TLS con Supabase)
+# en cada rerun. Ahora hay un pool por base creado una sola vez por proceso, y los resultados
+# se cachean por (SQL parametrizado, parámetros, base, versión de datos) durante TTL_CONSULTAS.
+TTL_CONSULTAS = 30 # Segundos
+
+@st.cache_resource(show_spinner=False)
+def obtener_pools():
+    with open("config.yaml", "r") as f: config = yaml.safe_load(f)
+    return {
+        "source": pool.ThreadedConnectionPool(1, 4, config['database']['source_url']),
+        "target": pool.ThreadedConnectionPool(1, 4, config['database']['target_url']),
+    }
+
+@st.cache_resource(show_spinner=False)
+def versiones_datos():
+    # Un contador por base: al subirlo, las consultas cacheadas de esa base dejan de usarse
+    return {"source": 0, "target": 0}
+
+def invalidar_consultas(*targets):
+    for target in targets: versiones_datos()[target] += 1
+
+@st.cache_data(ttl=TTL_CONSULTAS, show_spinner=False)
+def _consultar_cacheado(query, params, target, version):
+    import pandas as pd
+    pool_db = obtener_pools()[target]
+    conn = pool_db.getconn()
     try:
-        with open("config.yaml", "r") as f: config = yaml.safe_load(f)
-        url = config['database']['source_url'] if target == "source" else config['database']['target_url']
-        conn = psycopg2.connect(url)
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.rollback() # Cierra la transacción de lectura antes de devolverla al pool
+        pool_db.putconn(conn)
         return df
+    except Exception:
+        pool_db.putconn(conn, close=True) # Conexión dudosa (p. ej. cortada por el pooler): no se reutiliza
+        raise
+
+def consultar_db(query, target="source", params=None):
+    try: return _consultar_cacheado(query, tuple(params or ()), target, versiones_datos()[target])
     except: return None
 
 # SIDEBAR
@@ -64,10 +93,11 @@ with st.sidebar:
 
 # CABECERA
 st.title("Proyecto Final ETL")
-logs = cargar_logs()
-total_movidos = sum([l.get('total_registros_movidos', 0) for l in logs])
+indice_logs = cargar_logs()
+logs = indice_logs.get("ultimas", [])
+total_movidos = indice_logs.get("total_registros_movidos", 0)
 k1, k2, k3 = st.columns(3)
-k1.metric("Ejecuciones", len(logs))
+k1.metric("Ejecuciones", indice_logs.get("ejecuciones", 0))
 k2.metric("Registros Migrados", f"{total_movidos:,}")
 k3.metric("Ambiente", "PRODUCCIÓN" if password_input == "ABD123" else "LECTURA")
 
@@ -78,7 +108,14 @@ tabs = st.tabs(["🚀 Ejecución", "🕵️ Inspector", "📊 Auditoría"])
 
 # TAB 1: EJECUCIÓN + MONITOR EN VIVO
 with tabs[0]:
-    c1, c2, c3 = st.columns(3)
+    motor = st.radio("Motor ETL:", ["sync", "async"], horizontal=True,
+                     help="async = asyncpg: tablas, cargas y auditoría concurrentes (útil con el pooler remoto)")
+    # ### NUEVO: Perfilado del camino crítico (equivale a --profile en la línea de comandos) ###
+    perfil = None
+    if st.checkbox("🔬 Perfilar ejecución", help="Reporte por tabla con las funciones más calientes; se ve en la pestaña Auditoría"):
+        perfil = st.radio("Modo de perfilado:", ["completo", "muestreo"], horizontal=True,
+                          help="completo = cProfile + tracemalloc (lento, detallado); muestreo = pilas cada 10 ms (casi sin costo)")
+    c1, c2, c3, c4, c5 = st.columns(5)
     
     # FULL LOAD
     with c1:
@@ -87,13 +124,14 @@ with tabs[0]:
         if st.button("🔴 EJECUTAR FULL LOAD", disabled=bloqueado, use_container_width=True):
             with st.status("Procesando...", expanded=True):
                 st.write("🌍 Generando Datos...")
+                import generar_datos as script_generador
                 log_gen = script_generador.generar_datos_inteligentes()
                 st.text(log_gen)
                 st.write("🔄 Migrando ETL...")
-                log_etl = script_etl.ejecutar_migracion(rol, 1)
+                log_etl = script_etl.ejecutar_migracion(rol, 1, motor, perfil)
                 st.code(log_etl)
                 time.sleep(1)
-                st.cache_data.clear()
+                invalidar_consultas("source", "target") # El generador escribe en origen y el ETL en destino
                 st.rerun()
 
     # DELTA LOAD
@@ -103,23 +141,49 @@ with tabs[0]:
         if st.button("🔄 EJECUTAR DELTA", disabled=bloqueado, use_container_width=True):
             with st.status("Procesando...", expanded=True):
                 st.write("🌍 Generando Datos...")
+                import generar_datos as script_generador
                 log_gen = script_generador.generar_datos_inteligentes()
                 st.text(log_gen)
                 st.write("🔍 Sincronizando...")
-                log_etl = script_etl.ejecutar_migracion(rol, 2)
+                log_etl = script_etl.ejecutar_migracion(rol, 2, motor, perfil)
                 st.code(log_etl)
                 time.sleep(1)
-                st.cache_data.clear()
+                invalidar_consultas("source", "target") # El generador escribe en origen y el ETL en destino
                 st.rerun()
 
     # ENSAYO
     with c3:
         st.markdown("### 3. Modo Ensayo")
+        exacto = st.checkbox("Conteo exacto (recorre las tablas)", value=False) # ### NUEVO: Por defecto solo estimaciones ###
         if st.button("🧪 EJECUTAR PRUEBA", use_container_width=True):
-            log = script_etl.ejecutar_migracion("dev", 3)
+            log = script_etl.ejecutar_migracion("dev", 3, conteo_exacto_web=exacto)
             st.code(log)
             st.balloons()
 
+    # ### NUEVO: CDC (solo lo que cambió en origen: altas, cambios y bajas) ###
+    with c4:
+        st.markdown("### 4. CDC")
+        bloqueado = not (rol in ["dev", "operador"] and password_input == "ABD123")
+        if st.button("🪝 APLICAR CAMBIOS", disabled=bloqueado, use_container_width=True):
+            with st.status("Aplicando cambios...", expanded=True):
+                log_etl = script_etl.ejecutar_migracion(rol, 4, motor, perfil)
+                st.code(log_etl)
+                time.sleep(1)
+                invalidar_consultas("target")
+                st.rerun()
+
+    # ### NUEVO: Diff por checksums (revisa origen vs QA por rangos y repara solo lo distinto) ###
+    with c5:
+        st.markdown("### 5. Diff")
+        bloqueado = not (rol in ["dev", "operador"] and password_input == "ABD123")
+        if st.button("🔍 COMPARAR Y REPARAR", disabled=bloqueado, use_container_width=True):
+            with st.status("Comparando...", expanded=True):
+                log_etl = script_etl.ejecutar_migracion(rol, 5, motor, perfil)
+                st.code(log_etl)
+                time.sleep(1)
+                invalidar_consultas("target")
+                st.rerun()
+
     # MONITOR EN VIVO DE ÚLTIMOS REGISTROS
     st.divider()
     st.subheader("📥 Monitor en Tiempo Real (QA)")
@@ -136,16 +200,41 @@ with tabs[1]:
     c1, c2 = st.columns(2)
     with c1:
         st.caption("FUENTE")
-        st.dataframe(consultar_db(f"SELECT * FROM clientes WHERE id={sid}", "source"), hide_index=True)
+        st.dataframe(consultar_db("SELECT * FROM clientes WHERE id = %s", "source", (int(sid),)), hide_index=True)
     with c2:
         st.caption("DESTINO")
-        st.dataframe(consultar_db(f"SELECT * FROM clientes_qa WHERE id={sid}", "target"), hide_index=True)
+        st.dataframe(consultar_db("SELECT * FROM clientes_qa WHERE id = %s", "target", (int(sid),)), hide_index=True)
+
+    # ### NUEVO: Reconciliación de todas las tablas en el servidor (conteos, sumas y hashes; no trae filas) ###
+    st.divider()
+    bloqueado = not (rol in ["dev", "operador"] and password_input == "ABD123") # Escribe en la auditoría, como las demás opciones
+    if st.button("🧮 VERIFICAR MIGRACIÓN COMPLETA", disabled=bloqueado):
+        with st.spinner("Calculando agregados en origen y QA..."):
+            st.code(script_etl.ejecutar_migracion(rol, 6))
 
 # TAB 3: AUDITORÍA
 with tabs[2]:
     st.subheader("Historial")
+    if st.checkbox("Cargar historial completo (incluye archivos rotados)"):
+        logs = cargar_historial_completo()
     if logs:
+        import pandas as pd
+        import plotly.express as px
         df = pd.DataFrame(logs)
         df['inicio'] = pd.to_datetime(df['inicio'])
         st.plotly_chart(px.bar(df, x='inicio', y='total_registros_movidos', color_discrete_sequence=['#D59F0F']))
-        st.dataframe(df.sort_index(ascending=False), use_container_width=True)
\ No newline at end of file
+        st.dataframe(df.sort_index(ascending=False), use_container_width=True)
+
+    # ### NUEVO: Reportes de --profile (perfiles/<execution_id>/) ###
+    if os.path.isdir(script_etl.DIR_PERFILES):
+        ejecuciones = sorted(os.listdir(script_etl.DIR_PERFILES),
+                             key=lambda d: os.path.getmtime(os.path.join(script_etl.DIR_PERFILES, d)), reverse=True)
+        if ejecuciones:
+            st.subheader("🔬 Perfiles")
+            ejecucion = st.selectbox("Ejecución:", ejecuciones)
+            carpeta = os.path.join(script_etl.DIR_PERFILES, ejecucion)
+            reportes = sorted(f for f in os.listdir(carpeta) if f.endswith(".txt"))
+            if reportes:
+                reporte = st.selectbox("Tabla:", reportes)
+                with open(os.path.join(carpeta, reporte), encoding="utf-8") as f:
+                    st.code(f.read())
\ No newline at end of file
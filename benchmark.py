@@ -0,0 +1,573 @@
+"""
+Benchmark de punta a punta del ETL (ejecutar_migracion) contra un PostgreSQL local.
+
+Por cada tamaño de dataset siembra el origen con el generador masivo (semilla fija),
+corre carga completa, incremental y ensayo en un proceso aparte y guarda:
+tiempo total, filas/seg por etapa, RSS pico y viajes a la base (round trips).
+
+Uso:
+  # Instancia temporal sin contenedor (initdb + pg_ctl; no corre como root)
+  python benchmark.py correr --pg-bin /usr/lib/postgresql/16/bin --tamanos 10k,100k
+
+  # Bases ya existentes (se VACÍAN las tablas de origen y destino)
+  python benchmark.py correr --source-url postgresql://... --target-url postgresql://... --borrar-datos
+
+  python benchmark.py guardar-baseline benchmark_resultados.json
+  python benchmark.py comparar benchmark_baseline.json benchmark_resultados.json --tolerancia 0.15
+
+  # Solo el bucle de transformación (sin base de datos): filas/seg y bytes por fila de cada ruta
+  python benchmark.py transformacion --tablas clientes,ordenes --filas 100k
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import datetime
+import decimal
+import tracemalloc
+
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVO_RESULTADOS = os.path.join(BASE_DIR, "benchmark_resultados.json")
+ARCHIVO_BASELINE = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+TAMANOS = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+MODOS = {"completa": "1", "incremental": "2", "ensayo": "3"}
+PROPORCION_DELTA = 0.01 # Clientes nuevos antes de la incremental (fracción del dataset)
+
+# Mismas tablas que documenta readme.md (IF NOT EXISTS: no toca esquemas existentes)
+DDL_ORIGEN = """
+CREATE TABLE IF NOT EXISTS clientes (id INT PRIMARY KEY, nombre_completo VARCHAR(150), email VARCHAR(150), telefono VARCHAR(100), tarjeta_credito VARCHAR(100));
+CREATE TABLE IF NOT EXISTS ordenes (id INT PRIMARY KEY, cliente_id INT REFERENCES clientes(id), fecha_orden DATE, total DECIMAL(10,2));
+CREATE TABLE IF NOT EXISTS detalle_ordenes (id INT PRIMARY KEY, orden_id INT REFERENCES ordenes(id), producto VARCHAR(100), cantidad INT);
+"""
+DDL_DESTINO = """
+CREATE TABLE IF NOT EXISTS clientes_qa (id INT PRIMARY KEY, nombre_completo VARCHAR(150), email VARCHAR(150), telefono VARCHAR(100), tarjeta_credito VARCHAR(100), etl_batch_id VARCHAR(100));
+CREATE TABLE IF NOT EXISTS ordenes_qa (id INT PRIMARY KEY, cliente_id INT, fecha_orden DATE, total DECIMAL(10,2), etl_batch_id VARCHAR(100));
+CREATE TABLE IF NOT EXISTS detalle_ordenes_qa (id INT PRIMARY KEY, orden_id INT, producto VARCHAR(100), cantidad INT, etl_batch_id VARCHAR(100));
+CREATE TABLE IF NOT EXISTS auditoria_logs (execution_id VARCHAR(100) PRIMARY KEY, fecha_inicio TIMESTAMP, fecha_fin TIMESTAMP, tablas_procesadas TEXT, total_registros INT, detalle_json TEXT);
+"""
+
+# Métricas que se comparan contra el baseline y si "más alto" es peor
+METRICAS_COMPARABLES = {
+    "segundos": True,
+    "filas_por_segundo": False,
+    "rss_pico_mb": True,
+    "viajes_total": True,
+}
+# ### NUEVO: Arranque en frío (proceso nuevo), también se compara contra el baseline ###
+METRICAS_ARRANQUE = {"import_main_s": True, "primera_mascara_s": True}
+
+def parsear_tamano(texto):
+    texto = texto.strip().lower()
+    if texto in TAMANOS:
+        return TAMANOS[texto]
+    return int(float(texto.rstrip("k")) * 1000) if texto.endswith("k") else int(texto)
+
+# --- INSTANCIA LOCAL (initdb + pg_ctl) ---
+
+class InstanciaLocal:
+    """PostgreSQL efímero en un directorio temporal, escuchando solo en socket Unix"""
+
+    def __init__(self, pg_bin):
+        self.pg_bin = pg_bin
+        self.directorio = tempfile.mkdtemp(prefix="etl_bench_pg_")
+        self.datos = os.path.join(self.directorio, "datos")
+
+    def _bin(self, nombre):
+        return os.path.join(self.pg_bin, nombre)
+
+    def iniciar(self):
+        subprocess.run([self._bin("initdb"), "-D", self.datos, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._bin("pg_ctl"), "-D", self.datos, "-l", os.path.join(self.directorio, "postgres.log"),
+                        "-o", f"-k {self.directorio} -c listen_addresses=''", "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        import psycopg2
+        conn = psycopg2.connect(self.url("postgres"))
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE DATABASE bench_origen")
+            cursor.execute("CREATE DATABASE bench_qa")
+        conn.close()
+        return self.url("bench_origen"), self.url("bench_qa")
+
+    def url(self, base):
+        return f"postgresql://postgres@/{base}?host={self.directorio}"
+
+    def detener(self):
+        subprocess.run([self._bin("pg_ctl"), "-D", self.datos, "-m", "fast", "stop"],
+                       check=False, stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+# --- PREPARACIÓN DE DATOS ---
+
+def preparar_esquemas(source_url, target_url):
+    import psycopg2
+    for url, ddl in ((source_url, DDL_ORIGEN), (target_url, DDL_DESTINO)):
+        conn = psycopg2.connect(url)
+        with conn, conn.cursor() as cursor:
+            cursor.execute(ddl)
+        conn.close()
+
+def filas_por_cliente(opciones):
+    """Filas esperadas por cliente (1 + órdenes * (1 + detalles)) según los rangos del generador"""
+    ordenes = sum(opciones["ordenes_por_cliente"]) / 2
+    detalles = sum(opciones["detalles_por_orden"]) / 2
+    return 1 + ordenes * (1 + detalles)
+
+def sembrar(config, filas, semilla, reiniciar=True):
+    import generar_datos
+    opciones = generar_datos.opciones_generador(config)
+    clientes = max(1, round(filas / filas_por_cliente(opciones)))
+    conteos = generar_datos.generar_datos_masivos(reiniciar=reiniciar, log=lambda *_: None, config=config,
+                                                  clientes=clientes, semilla=semilla)
+    return sum(conteos.values())
+
+# --- PROCESO HIJO: UNA EJECUCIÓN MEDIDA ---
+
+class ContadorViajes:
+    """Cuenta idas y vueltas a Postgres por tipo de llamada (thread-safe)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conteos = {}
+
+    def sumar(self, tipo):
+        with self.lock:
+            self.conteos[tipo] = self.conteos.get(tipo, 0) + 1
+
+def instalar_contadores(contador):
+    """
+    Envuelve psycopg2.connect y los métodos de asyncpg.Connection para contar viajes.
+    execute_values cuenta un viaje por página; executemany de asyncpg cuenta uno (va en pipeline).
+    """
+    import psycopg2
+    import psycopg2.extensions
+
+    class CursorContado(psycopg2.extensions.cursor):
+        def execute(self, *args, **kwargs):
+            contador.sumar("execute")
+            return super().execute(*args, **kwargs)
+
+        def executemany(self, consulta, parametros):
+            parametros = list(parametros)
+            for _ in parametros:
+                contador.sumar("executemany")
+            return super().executemany(consulta, parametros)
+
+        def copy_expert(self, *args, **kwargs):
+            contador.sumar("copy")
+            return super().copy_expert(*args, **kwargs)
+
+        def fetchmany(self, *args, **kwargs):
+            if self.name: # Solo el cursor del servidor va a la base en cada fetch
+                contador.sumar("fetch")
+            return super().fetchmany(*args, **kwargs)
+
+    class ConexionContada(psycopg2.extensions.connection):
+        def commit(self):
+            contador.sumar("commit")
+            return super().commit()
+
+        def rollback(self):
+            contador.sumar("rollback")
+            return super().rollback()
+
+    connect_original = psycopg2.connect
+
+    def connect_contado(*args, **kwargs):
+        contador.sumar("conexion")
+        kwargs.setdefault("connection_factory", ConexionContada)
+        kwargs.setdefault("cursor_factory", CursorContado)
+        return connect_original(*args, **kwargs)
+
+    psycopg2.connect = connect_contado
+
+    try:
+        import asyncpg
+        import asyncpg.cursor
+    except ImportError:
+        return
+
+    def envolver(clase, metodo, tipo):
+        original = getattr(clase, metodo)
+
+        async def contado(self, *args, **kwargs):
+            contador.sumar(tipo)
+            return await original(self, *args, **kwargs)
+        setattr(clase, metodo, contado)
+
+    for metodo in ("execute", "executemany", "fetch", "fetchrow", "fetchval", "prepare"):
+        envolver(asyncpg.connection.Connection, metodo, metodo)
+    envolver(asyncpg.connection.Connection, "copy_records_to_table", "copy")
+    envolver(asyncpg.cursor.Cursor, "fetch", "fetch")
+
+def ultimo_log(ruta, lineas_previas):
+    """Última ejecución agregada al historial JSONL (None si no escribió, p. ej. el ensayo)"""
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        lineas = [l for l in f if l.strip()]
+    return json.loads(lineas[-1]) if len(lineas) > lineas_previas else None
+
+def etapas_desde_log(log_final):
+    """Suma por etapa los segundos de cada tabla y calcula filas/seg (carga/commit = insertadas, resto = leídas)"""
+    etapas = {}
+    for detalle in (log_final or {}).get("detalles_por_tabla", []):
+        segundos = (detalle.get("metricas") or {}).get("segundos")
+        if segundos is None: # Logs sin métricas por etapa: solo hay segundos_carga
+            segundos = {"carga": detalle.get("segundos_carga", 0)}
+        for etapa, valor in segundos.items():
+            if etapa == "conexion":
+                continue
+            filas = detalle.get("registros_insertados" if etapa in ("carga", "commit") else "registros_leidos", 0)
+            acumulado = etapas.setdefault(etapa, {"segundos": 0.0, "filas": 0})
+            acumulado["segundos"] += valor
+            acumulado["filas"] += filas
+    for acumulado in etapas.values():
+        acumulado["segundos"] = round(acumulado["segundos"], 3)
+        acumulado["filas_por_segundo"] = round(acumulado["filas"] / acumulado["segundos"], 1) if acumulado["segundos"] > 0 else 0
+    return etapas
+
+def ejecutar_caso(ruta_resultado, opcion, motor):
+    """Corre ejecutar_migracion una vez (en este proceso) y escribe sus métricas en JSON"""
+    contador = ContadorViajes()
+    instalar_contadores(contador)
+    import main as etl
+
+    lineas_previas = 0
+    if os.path.exists(etl.ARCHIVO_LOGS):
+        with open(etl.ARCHIVO_LOGS, encoding="utf-8") as f:
+            lineas_previas = sum(1 for l in f if l.strip())
+
+    inicio = time.perf_counter()
+    salida = etl.ejecutar_migracion("dev", opcion, motor)
+    segundos = time.perf_counter() - inicio
+
+    log_final = ultimo_log(etl.ARCHIVO_LOGS, lineas_previas)
+    filas = (log_final or {}).get("total_registros_movidos", 0)
+    errores = [e for d in (log_final or {}).get("detalles_por_tabla", []) for e in d.get("errores", [])]
+    resultado = {
+        "segundos": round(segundos, 3),
+        "filas_movidas": filas,
+        "filas_por_segundo": round(filas / segundos, 1) if segundos > 0 and filas else 0,
+        "etapas": etapas_desde_log(log_final),
+        # ru_maxrss está en KB en Linux (en bytes en macOS)
+        "rss_pico_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "rss_pico_hijos_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "viajes": dict(sorted(contador.conteos.items())),
+        "viajes_total": sum(contador.conteos.values()),
+        "errores": errores[:5],
+        "salida": salida[-2000:] if isinstance(salida, str) else "",
+    }
+    with open(ruta_resultado, "w", encoding="utf-8") as f:
+        json.dump(resultado, f)
+
+def correr_caso(directorio, opcion, motor):
+    """Lanza un proceso hijo (RSS y contadores limpios) con ETL_DIR_DATOS apuntando al directorio del benchmark"""
+    ruta = os.path.join(directorio, "resultado_caso.json")
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    entorno = dict(os.environ, ETL_DIR_DATOS=directorio)
+    subprocess.run([sys.executable, os.path.abspath(__file__), "_caso", ruta, opcion, motor],
+                   cwd=BASE_DIR, env=entorno, stdout=subprocess.DEVNULL, check=True)
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+def medir_arranque(directorio, repeticiones=3):
+    """Mejor de N procesos nuevos: importar main.py y la primera máscara faker_name + preserve_format (con el pool)"""
+    codigo = ("import time; t0 = time.perf_counter(); import main; t1 = time.perf_counter(); "
+              "main.configurar_pool_mascaras({'activo': True}); main.enmascarar_columna('faker_name', ['x']); main.enmascarar_columna('preserve_format', ['5512345678']); "
+              "print(t1 - t0, time.perf_counter() - t1)")
+    entorno = dict(os.environ, ETL_DIR_DATOS=directorio)
+    mejores = None
+    for _ in range(repeticiones): # La primera vuelta también genera pool_mascaras.bin; cuenta el mejor caso
+        salida = subprocess.run([sys.executable, "-c", codigo], cwd=BASE_DIR, env=entorno,
+                                capture_output=True, text=True, check=True).stdout.split()
+        tiempos = [float(x) for x in salida[-2:]]
+        mejores = tiempos if mejores is None else [min(a, b) for a, b in zip(mejores, tiempos)]
+    return {"import_main_s": round(mejores[0], 4), "primera_mascara_s": round(mejores[1], 4)}
+
+# --- ORQUESTACIÓN ---
+
+def config_benchmark(args, source_url, target_url):
+    """config.yaml del repo con las URLs del benchmark y, opcionalmente, sin filtro_sql"""
+    with open(args.config, encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    config["database"] = {"source_url": source_url, "target_url": target_url}
+    if args.sin_filtros:
+        for tabla in config["tablas"]:
+            tabla.pop("filtro_sql", None)
+    config.setdefault("rendimiento", {})["motor"] = "sync" # El motor se elige por caso
+    return config
+
+def info_maquina(source_url):
+    import psycopg2
+    conn = psycopg2.connect(source_url)
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW server_version")
+        version_pg = cursor.fetchone()[0]
+    conn.close()
+    return {"plataforma": platform.platform(), "python": platform.python_version(),
+            "cpus": os.cpu_count(), "postgres": version_pg}
+
+def correr(args):
+    instancia = None
+    if args.pg_bin:
+        instancia = InstanciaLocal(args.pg_bin)
+        source_url, target_url = instancia.iniciar()
+    elif args.source_url and args.target_url:
+        if not args.borrar_datos:
+            sys.exit("❌ El benchmark vacía las tablas de origen y destino. Agregue --borrar-datos para confirmar.")
+        source_url, target_url = args.source_url, args.target_url
+    else:
+        sys.exit("❌ Indique --pg-bin (instancia temporal) o --source-url y --target-url.")
+
+    directorio = tempfile.mkdtemp(prefix="etl_bench_")
+    config = config_benchmark(args, source_url, target_url)
+    with open(os.path.join(directorio, "config.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+    modos = [m.strip() for m in args.modos.split(",")]
+    motores = [m.strip() for m in args.motores.split(",")]
+    casos = []
+    try:
+        preparar_esquemas(source_url, target_url)
+        maquina = info_maquina(source_url)
+        arranque = medir_arranque(directorio)
+        print(f"🚀 Arranque: import main {arranque['import_main_s']}s, primera máscara {arranque['primera_mascara_s']}s")
+        for etiqueta in [t.strip() for t in args.tamanos.split(",")]:
+            for motor in motores:
+                print(f"🌱 Sembrando {etiqueta} filas (semilla {args.semilla})...")
+                filas_origen = sembrar(config, parsear_tamano(etiqueta), args.semilla)
+                estado = os.path.join(directorio, "state.json")
+                for modo in modos:
+                    if modo == "completa" and os.path.exists(estado):
+                        os.remove(estado)
+                    if modo == "incremental":
+                        delta = max(1, round(filas_origen * PROPORCION_DELTA))
+                        filas_origen += sembrar(config, delta, args.semilla + 1, reiniciar=False)
+                    print(f"⏱️  {etiqueta} | {modo} | {motor} ...", end=" ", flush=True)
+                    resultado = correr_caso(directorio, MODOS[modo], motor)
+                    resultado.update({"tamano": etiqueta, "filas_origen": filas_origen, "modo": modo, "motor": motor})
+                    casos.append(resultado)
+                    print(f"{resultado['segundos']}s, {resultado['filas_por_segundo']:,} filas/s, "
+                          f"{resultado['rss_pico_mb']} MB, {resultado['viajes_total']} viajes")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+        if instancia:
+            instancia.detener()
+
+    salida = {
+        "version": 1,
+        "fecha": datetime.datetime.now().isoformat(),
+        "maquina": maquina,
+        "arranque": arranque,
+        "parametros": {"semilla": args.semilla, "sin_filtros": args.sin_filtros,
+                       "rendimiento": config.get("rendimiento", {})},
+        "casos": casos,
+    }
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(salida, f, indent=2, ensure_ascii=False)
+    print(f"💾 Resultados en {args.salida}")
+
+def llave_caso(caso):
+    return (caso["tamano"], caso["modo"], caso["motor"])
+
+def comparar_resultados(baseline, actual, tolerancia):
+    """Lista de (caso, métrica, antes, después, cambio, es_regresion) para los casos presentes en ambos"""
+    previos = {llave_caso(c): c for c in baseline["casos"]}
+    filas = []
+    for caso in actual["casos"]:
+        previo = previos.get(llave_caso(caso))
+        if not previo:
+            continue
+        for metrica, mayor_es_peor in METRICAS_COMPARABLES.items():
+            antes, despues = previo.get(metrica), caso.get(metrica)
+            if not antes or despues is None:
+                continue
+            cambio = (despues - antes) / antes
+            regresion = cambio > tolerancia if mayor_es_peor else cambio < -tolerancia
+            filas.append((llave_caso(caso), metrica, antes, despues, cambio, regresion))
+    for metrica, mayor_es_peor in METRICAS_ARRANQUE.items():
+        antes, despues = baseline.get("arranque", {}).get(metrica), actual.get("arranque", {}).get(metrica)
+        if not antes or despues is None:
+            continue
+        cambio = (despues - antes) / antes
+        regresion = cambio > tolerancia if mayor_es_peor else cambio < -tolerancia
+        filas.append((("-", "arranque", "-"), metrica, antes, despues, cambio, regresion))
+    return filas
+
+def comparar(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.resultados, encoding="utf-8") as f:
+        actual = json.load(f)
+    filas = comparar_resultados(baseline, actual, args.tolerancia)
+    if not filas:
+        sys.exit("⚠️ No hay casos en común entre el baseline y los resultados.")
+    for (tamano, modo, motor), metrica, antes, despues, cambio, regresion in filas:
+        marca = "❌ REGRESIÓN" if regresion else "✅"
+        print(f"{marca:13} {tamano:>5} {modo:12} {motor:6} {metrica:18} {antes:>12,} -> {despues:>12,} ({cambio:+.1%})")
+    regresiones = sum(1 for f in filas if f[-1])
+    print(f"\n{regresiones} regresión(es) con tolerancia {args.tolerancia:.0%}")
+    sys.exit(1 if regresiones else 0)
+
+def guardar_baseline(args):
+    shutil.copyfile(args.resultados, args.baseline)
+    print(f"📌 Baseline actualizado: {args.baseline}")
+
+# --- MICRO-BENCHMARK DEL BUCLE DE TRANSFORMACIÓN ---
+# Compara, con filas sintéticas y las reglas de config.yaml, tres formas de llevar un chunk
+# de origen a las tuplas que recibe el destino:
+#   dict     -> un dict por fila, máscara valor por valor (la ruta original, como referencia)
+#   columnas -> transformar_lote + proyección fila por fila en cargar_lote (ruta previa al plan de fila)
+#   plan     -> compilar_plan_fila una vez + aplicar_plan_fila (máscaras, marca y proyección en un paso)
+COLUMNAS_SINTETICAS = {
+    "clientes": ["id", "nombre_completo", "email", "telefono", "tarjeta_credito"],
+    "ordenes": ["id", "cliente_id", "fecha_orden", "total"],
+    "detalle_ordenes": ["id", "orden_id", "producto", "cantidad"],
+}
+
+def filas_sinteticas(tabla, n):
+    """Filas con la forma de las tablas del readme (sin tocar la base)"""
+    if tabla == "clientes":
+        return [(i, f"Cliente Numero {i}", f"cliente{i}@correo.com", f"+56 9 {i % 10**8:08d}",
+                 f"4111-1111-{i % 10000:04d}-{(i * 7) % 10000:04d}") for i in range(1, n + 1)]
+    if tabla == "ordenes":
+        inicio = datetime.date(2024, 1, 1)
+        return [(i, i % 1000 + 1, inicio + datetime.timedelta(days=i % 365), decimal.Decimal(f"{i % 5000}.50"))
+                for i in range(1, n + 1)]
+    return [(i, i, f"Producto {i % 50}", i % 7 + 1) for i in range(1, n + 1)]
+
+def _ruta_dict(etl, columnas, filas, reglas, col_inc, plan_carga):
+    max_id = 0
+    salida = []
+    for fila in filas:
+        registro = dict(zip(columnas, fila))
+        for columna, regla in reglas.items():
+            if columna in registro and regla in etl.MAPPING_FUNCIONES:
+                registro[columna] = etl.MAPPING_FUNCIONES[regla](registro[columna])
+        if registro[col_inc] is not None and registro[col_inc] > max_id:
+            max_id = registro[col_inc]
+        salida.append(tuple([registro[c] for c in columnas if c in plan_carga["columnas"]]) + plan_carga["extra"])
+    return salida, max_id
+
+def _ruta_columnas(etl, columnas, filas, reglas, col_inc, plan_carga):
+    enmascaradas, max_id = etl.transformar_lote(columnas, filas, reglas, col_inc, 0)
+    indices, extra = plan_carga["indices"], plan_carga["extra"]
+    return [tuple([f[i] for i in indices]) + extra for f in enmascaradas], max_id
+
+def _ruta_plan(etl, columnas, filas, reglas, col_inc, plan_carga):
+    plan_fila = etl.compilar_plan_fila(columnas, reglas, col_inc, plan_carga)
+    return etl.aplicar_plan_fila(plan_fila, filas, 0)
+
+RUTAS_TRANSFORMACION = {"dict": _ruta_dict, "columnas": _ruta_columnas, "plan": _ruta_plan}
+
+def medir_ruta(funcion, repeticiones):
+    """Mejor tiempo de `repeticiones` corridas y pico de memoria asignada (tracemalloc) de una corrida aparte"""
+    mejor = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    tracemalloc.start()
+    try:
+        resultado = funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return mejor, pico, resultado
+
+def transformacion(args):
+    import main as etl
+    with open(args.config, encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    reglas_por_tabla = {t["nombre"]: t for t in config.get("tablas", [])}
+    n = parsear_tamano(args.filas)
+    directorio = tempfile.mkdtemp(prefix="etl_bench_")
+    try:
+        arranque = medir_arranque(directorio)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    print(f"🚀 Arranque: import main {arranque['import_main_s']}s, primera máscara {arranque['primera_mascara_s']}s")
+    resultados = []
+    for tabla in [t.strip() for t in args.tablas.split(",") if t.strip()]:
+        if tabla not in COLUMNAS_SINTETICAS:
+            sys.exit(f"⚠️ Tabla sin datos sintéticos: {tabla} (use {', '.join(COLUMNAS_SINTETICAS)})")
+        tabla_info = reglas_por_tabla.get(tabla, {"nombre": tabla})
+        reglas = {} if args.sin_mascaras else tabla_info.get("columnas_enmascarar", {})
+        columnas = COLUMNAS_SINTETICAS[tabla]
+        plan_carga = etl.armar_plan_carga({"columnas": columnas + ["etl_batch_id"], "llave": ["id"]},
+                                          tabla_info, f"{tabla}_qa", columnas, "benchmark")
+        filas = filas_sinteticas(tabla, n)
+        referencia = None
+        for ruta, funcion in RUTAS_TRANSFORMACION.items():
+            segundos, pico, (salida, _) = medir_ruta(
+                lambda: funcion(etl, columnas, filas, reglas, "id", plan_carga), args.repeticiones)
+            if referencia is None:
+                referencia = salida
+            fila = {"tabla": tabla, "ruta": ruta, "filas": n, "segundos": round(segundos, 4),
+                    "filas_por_segundo": round(n / segundos, 1) if segundos > 0 else 0,
+                    "bytes_por_fila": round(pico / n, 1),
+                    # Faker avanza entre corridas: se compara la forma de la salida, no los valores
+                    "misma_forma": len(salida) == len(referencia) and all(len(a) == len(b) for a, b in zip(salida, referencia))}
+            resultados.append(fila)
+            print(f"{tabla:16} {ruta:9} {fila['filas_por_segundo']:>14,.0f} filas/s {fila['bytes_por_fila']:>10,.1f} B/fila"
+                  + ("" if fila["misma_forma"] else "  ⚠️ salida distinta"))
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"fecha": datetime.datetime.now().isoformat(), "arranque": arranque, "resultados": resultados}, f, indent=2)
+        print(f"💾 Resultados en {args.salida}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_caso": # Proceso hijo de correr_caso
+        ejecutar_caso(sys.argv[2], sys.argv[3], sys.argv[4])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta del ETL")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_correr = sub.add_parser("correr", help="Siembra datasets y mide cada modo")
+    p_correr.add_argument("--pg-bin", help="Directorio con initdb/pg_ctl para una instancia temporal")
+    p_correr.add_argument("--source-url")
+    p_correr.add_argument("--target-url")
+    p_correr.add_argument("--borrar-datos", action="store_true", help="Confirma que se pueden vaciar las tablas")
+    p_correr.add_argument("--tamanos", default="10k,100k", help="Filas de origen: 10k,100k,1m,10m o un número")
+    p_correr.add_argument("--modos", default="completa,incremental,ensayo")
+    p_correr.add_argument("--motores", default="sync", help="sync, async o ambos separados por coma")
+    p_correr.add_argument("--semilla", type=int, default=42)
+    p_correr.add_argument("--config", default=os.path.join(BASE_DIR, "config.yaml"))
+    p_correr.add_argument("--sin-filtros", action="store_true", help="Ignorar filtro_sql (mover todo el dataset)")
+    p_correr.add_argument("--salida", default=ARCHIVO_RESULTADOS)
+
+    p_comparar = sub.add_parser("comparar", help="Marca regresiones contra un baseline")
+    p_comparar.add_argument("baseline", nargs="?", default=ARCHIVO_BASELINE)
+    p_comparar.add_argument("resultados", nargs="?", default=ARCHIVO_RESULTADOS)
+    p_comparar.add_argument("--tolerancia", type=float, default=0.10, help="Cambio relativo permitido (0.10 = 10%%)")
+
+    p_baseline = sub.add_parser("guardar-baseline", help="Copia unos resultados como baseline")
+    p_baseline.add_argument("resultados", nargs="?", default=ARCHIVO_RESULTADOS)
+    p_baseline.add_argument("--baseline", default=ARCHIVO_BASELINE)
+
+    p_transf = sub.add_parser("transformacion", help="Micro-benchmark del bucle de transformación (sin base)")
+    p_transf.add_argument("--tablas", default="clientes,ordenes")
+    p_transf.add_argument("--filas", default="100k", help="Filas sintéticas por tabla: 10k,100k,1m o un número")
+    p_transf.add_argument("--repeticiones", type=int, default=3)
+    p_transf.add_argument("--sin-mascaras", action="store_true", help="Mide solo transposición, marca de agua y proyección")
+    p_transf.add_argument("--config", default=os.path.join(BASE_DIR, "config.yaml"))
+    p_transf.add_argument("--salida", help="Archivo JSON con los resultados")
+
+    args = parser.parse_args()
+    {"correr": correr, "comparar": comparar, "guardar-baseline": guardar_baseline,
+     "transformacion": transformacion}[args.comando](args)
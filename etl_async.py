@@ -0,0 +1,404 @@
+# ### NUEVO: MOTOR ASÍNCRONO (asyncpg) ###
+# Misma migración que main.ejecutar_migracion (mismo YAML, mismas reglas, mismo state.json y auditoría),
+# pero sin esperar cada viaje de red: mientras una tabla espera al pooler de Supabase,
+# otras extraen o cargan sobre un pool pequeño de conexiones asíncronas.
+# Se elige con `python main.py <rol> <opcion> async`, con `rendimiento.motor: async` o desde app.py.
+import asyncio
+import contextlib
+import datetime
+import json
+import time
+
+try:
+    import asyncpg
+except ImportError: # Dependencia opcional: solo hace falta para este motor
+    asyncpg = None
+
+import main as etl
+
+def _posicional(sql):
+    """Convierte los %s de psycopg2 en $1, $2, ... de asyncpg"""
+    partes = sql.split("%s")
+    return "".join(p + (f"${i}" if i < len(partes) else "") for i, p in enumerate(partes, 1))
+
+async def _con_reintentos(funcion, *args, operacion="async", reconectar=None):
+    """Igual que main.reintentar (solo errores transitorios, backoff exponencial), sin bloquear el loop mientras espera"""
+    maximo = int(etl.REINTENTOS["max_intentos"])
+    etiqueta = "Falló conexión" if operacion == "conexion" else "Error SQL"
+    intentos = 0
+    while True:
+        try:
+            return await funcion(*args)
+        except Exception as e:
+            intentos += 1
+            if not etl.es_error_transitorio(e):
+                etl.print_log(f"   ⚠️ {etiqueta} permanente (no se reintenta): {e}")
+                raise
+            if intentos >= maximo:
+                etl.print_log(f"   ⚠️ {etiqueta} (Intento {intentos}/{maximo}): {e}")
+                raise
+            espera = etl.espera_reintento(intentos)
+            etl.print_log(f"   ⚠️ {etiqueta} (Intento {intentos}/{maximo}): {e} -> reintento en {espera:.2f}s")
+            etl.contar_reintento(operacion)
+            await asyncio.sleep(espera)
+            if reconectar is not None:
+                await reconectar()
+
+async def crear_pool_async(url, max_conexiones):
+    """Pool asyncpg con reintentos. Sin caché de sentencias: el pooler de Supabase (transaction mode) no las soporta"""
+    return await _con_reintentos(lambda: asyncpg.create_pool(url, min_size=1, max_size=max_conexiones, statement_cache_size=0),
+                                 operacion="conexion")
+
+# ### NUEVO: Conexión al destino reemplazable ###
+# Se presta como {"conn", "pool"}: si se cae a mitad de una tabla, _reconectar_destino la cambia
+# por otra del pool y quien la usa sigue leyendo destino["conn"].
+@contextlib.asynccontextmanager
+async def _destino_reemplazable(pool_target):
+    destino = {"conn": await pool_target.acquire(), "pool": pool_target}
+    try:
+        yield destino
+    finally:
+        await pool_target.release(destino["conn"])
+
+async def _reconectar_destino(destino):
+    """Si la conexión del destino se cerró, la devuelve al pool y toma otra"""
+    try:
+        if not destino["conn"].is_closed(): return
+    except asyncpg.InterfaceError:
+        pass # El pool ya desligó el proxy de la conexión muerta: también hay que cambiarla
+    try: await destino["pool"].release(destino["conn"])
+    except Exception: pass
+    destino["conn"] = await _con_reintentos(destino["pool"].acquire, operacion="conexion")
+    etl.contar_reintento("reconexion")
+    etl.print_log("   🔌 Conexión al destino perdida: se continúa con una nueva")
+
+async def obtener_plan_carga_async(conn, tabla_qa, version_esquema):
+    """Como main.obtener_plan_carga (memoria -> disco -> information_schema) sobre asyncpg"""
+    clave = f"{tabla_qa}@{version_esquema}"
+    if clave in etl._PLANES_CARGA:
+        return etl._PLANES_CARGA[clave]
+    planes_disco = etl._cargar_planes_disco()
+    if clave in planes_disco:
+        etl._PLANES_CARGA[clave] = planes_disco[clave]
+        return planes_disco[clave]
+
+    etl.print_log(f"   🔎 Introspección de {tabla_qa} (versión de esquema {version_esquema})...")
+    columnas = [r[0] for r in await _con_reintentos(conn.fetch, _posicional(etl.SQL_COLUMNAS_DESTINO), *etl.partes_tabla(tabla_qa))]
+    if not columnas:
+        raise Exception(f"La tabla destino '{tabla_qa}' no existe")
+    llave = [r[0] for r in await _con_reintentos(conn.fetch, _posicional(etl.SQL_LLAVE_DESTINO), *etl.partes_tabla(tabla_qa))]
+
+    with etl._LOCK_PLANES:
+        return etl.registrar_plan_carga(clave, {"columnas": columnas, "llave": llave})
+
+async def cargar_lote_async(destino, plan, filas_enmascaradas, motor="values", metricas=None, proyectadas=False, filas_por_pagina=None):
+    """
+    Carga un chunk: executemany o COPY binario a temporal + INSERT ... SELECT. Con llave (ON CONFLICT) va por
+    páginas, una transacción cada una, y solo se reintenta la página que falló (en otra conexión si se cayó)
+    """
+    etl.print_log(f"   -> Preparando lote de {len(filas_enmascaradas)} registros para {plan['tabla_qa']}... ({'COPY' if motor == 'copy' else 'Batch'})")
+    if not filas_enmascaradas: return 0
+
+    if proyectadas: # Ya vienen de etl.aplicar_plan_fila en el orden del destino
+        datos_batch = filas_enmascaradas
+    else:
+        indices, extra = plan["indices"], plan["extra"]
+        datos_batch = [tuple([f[i] for i in indices]) + extra for f in filas_enmascaradas]
+    tabla_qa, columnas = plan["tabla_qa"], plan["columnas"]
+
+    commit = [0.0]
+
+    async def _cargar(pagina):
+        conn = destino["conn"]
+        async with conn.transaction():
+            if motor == "copy":
+                # Siempre en pg_temp: el DROP no alcanza tablas reales y acepta destinos esquema.tabla
+                staging = f"etl_stg_{tabla_qa.split('.')[-1]}"
+                temporal = 'pg_temp."' + staging.replace('"', '""') + '"'
+                await conn.execute(f"DROP TABLE IF EXISTS {temporal}; "
+                                   f"CREATE TEMP TABLE {temporal} (LIKE {tabla_qa} INCLUDING DEFAULTS) ON COMMIT DROP")
+                await conn.copy_records_to_table(staging, schema_name="pg_temp", records=pagina, columns=columnas)
+                lista = ", ".join(columnas)
+                await conn.execute(f"INSERT INTO {tabla_qa} ({lista}) SELECT {lista} FROM {temporal} {plan['conflicto']}")
+            else:
+                valores = ", ".join(f"${i}" for i in range(1, len(columnas) + 1))
+                await conn.executemany(f"INSERT INTO {tabla_qa} ({', '.join(columnas)}) VALUES ({valores}) {plan['conflicto']}",
+                                       pagina)
+            t_commit = time.perf_counter() # Al salir del bloque asyncpg hace el COMMIT
+        commit[0] += time.perf_counter() - t_commit
+
+    # Mismo criterio que main.cargar_lote: sin llave, el chunk completo es la unidad (reintentar no duplica)
+    t0 = time.perf_counter()
+    paso = len(datos_batch)
+    if plan["conflicto"]:
+        paso = int(filas_por_pagina or (etl.BATCH_SIZE if motor != "copy" else paso)) or paso
+    for inicio in range(0, len(datos_batch), paso):
+        # La transacción de la página se revierte completa antes de reintentar
+        await _con_reintentos(_cargar, datos_batch[inicio:inicio + paso], reconectar=lambda: _reconectar_destino(destino))
+    if metricas is not None:
+        etl.registrar_lote(metricas, t0, time.perf_counter() - commit[0], datos_batch)
+    return len(datos_batch)
+
+async def migrar_tabla_async(tabla_info, pool_source, pool_target, estado, contexto):
+    """Versión asíncrona de main.procesar_tabla: lee el chunk N+1 mientras carga el N"""
+    opciones = etl.opciones_tabla(tabla_info, contexto["rendimiento"])
+    stats_tabla = etl.nuevas_stats_tabla(tabla_info, dict(opciones, formato_copy="binary"), estado) # copy_records_to_table es binario
+    metricas = stats_tabla["metricas"]
+    etl._METRICAS_TABLA.set(metricas) # Cada tarea tiene su propio contexto: los reintentos quedan en su tabla
+    t_tabla = time.perf_counter()
+    try:
+        return await _migrar_tabla_async(tabla_info, pool_source, pool_target, estado, contexto, opciones, stats_tabla)
+    finally:
+        metricas["duracion_segundos"] = round(time.perf_counter() - t_tabla, 4)
+
+async def _migrar_tabla_async(tabla_info, pool_source, pool_target, estado, contexto, opciones, stats_tabla):
+    nombre_tabla = tabla_info['nombre']
+    reglas = tabla_info['columnas_enmascarar']
+    col_inc = tabla_info.get('columna_incremental', 'id')
+    metricas = stats_tabla["metricas"]
+
+    etl.print_log(f"\n🔄 Procesando tabla: {nombre_tabla.upper()}")
+    sql_final, _ = etl.construir_consulta(tabla_info, estado, contexto["es_incremental"], contexto["conn_consultas"])
+    max_id_lote = estado.get(nombre_tabla, 0)
+    plan_carga = None
+    plan_fila = None # ### NUEVO: Plan de fila, una vez por tabla ###
+    chunks_confirmados = 0
+
+    try:
+        async with pool_source.acquire() as conn_s, _destino_reemplazable(pool_target) as destino:
+            async with conn_s.transaction(readonly=True): # Los cursores de asyncpg viven dentro de una transacción
+                sentencia = await _con_reintentos(conn_s.prepare, sql_final)
+                columnas = [a.name for a in sentencia.get_attributes()]
+                cursor = await sentencia.cursor()
+                siguiente = asyncio.ensure_future(cursor.fetch(opciones["chunk_size"]))
+                try:
+                    while True:
+                        t0 = time.perf_counter() # Extracción = lo que de verdad esperamos al prefetch
+                        filas = [tuple(r) for r in await siguiente]
+                        metricas["segundos"]["extraccion"] += time.perf_counter() - t0
+                        if not filas: break
+                        siguiente = asyncio.ensure_future(cursor.fetch(opciones["chunk_size"])) # Prefetch del próximo chunk
+                        stats_tabla["registros_leidos"] += len(filas)
+                        metricas["bytes_leidos"] += etl.bytes_aprox(filas)
+
+                        if plan_fila is None:
+                            try:
+                                tabla_qa = tabla_info.get('tabla_destino', f"{nombre_tabla}_qa")
+                                plan = await obtener_plan_carga_async(destino["conn"], tabla_qa, contexto["version_esquema"])
+                            except Exception as e:
+                                etl.print_log(f"   ❌ Error insertando lote (Batch): {e}")
+                                stats_tabla["errores"].append(str(e))
+                                break
+                            plan_carga = etl.armar_plan_carga(plan, tabla_info, tabla_qa, columnas, contexto["execution_id"])
+                            plan_fila = etl.compilar_plan_fila(columnas, reglas, col_inc, plan_carga)
+
+                        # Enmascarar es CPU: lo mandamos a un hilo para no frenar las otras tablas
+                        # (con --profile, ese hilo suma al perfil "_ejecucion": todas las tablas comparten el loop)
+                        t0 = time.perf_counter()
+                        filas_enmascaradas, max_chunk = await asyncio.to_thread(
+                            etl.en_hilo_perfilado, etl.PERFIL_EJECUCION,
+                            etl.aplicar_plan_fila, plan_fila, filas, max_id_lote, stats_tabla.get("cache_mascaras"),
+                            metricas["segundos_por_regla"])
+                        metricas["segundos"]["transformacion"] += time.perf_counter() - t0
+
+                        try:
+                            t0 = time.perf_counter()
+                            stats_tabla["registros_insertados"] += await cargar_lote_async(destino, plan_carga, filas_enmascaradas,
+                                                                                           opciones["motor_carga"], metricas,
+                                                                                           proyectadas=True,
+                                                                                           filas_por_pagina=opciones["filas_por_pagina"])
+                            stats_tabla["segundos_carga"] += time.perf_counter() - t0
+                        except Exception as e:
+                            etl.print_log(f"   ❌ Error insertando lote (Batch): {e}")
+                            stats_tabla["errores"].append(str(e))
+                            break # No seguimos leyendo si el destino falló
+
+                        max_id_lote = max_chunk # Solo avanzamos la marca de agua con chunks ya confirmados
+                        chunks_confirmados += 1
+                        # json.dump + fsync + os.replace en un hilo: el loop sigue atendiendo a las otras tablas
+                        await asyncio.to_thread(etl.checkpoint_chunk, estado, stats_tabla, max_id_lote, chunks_confirmados,
+                                                opciones["checkpoint_chunks"])
+                        etl.print_log(f"   📦 Chunk procesado: {len(filas)} registros (acumulado: {stats_tabla['registros_leidos']})")
+                finally:
+                    if not siguiente.done(): siguiente.cancel()
+                    try: await siguiente
+                    except BaseException: pass
+    except Exception as e:
+        etl.print_log(f"⚠️ Error leyendo tabla {nombre_tabla}: {e}")
+        stats_tabla["error"] = str(e)
+        return stats_tabla
+
+    return await asyncio.to_thread(etl.cerrar_stats_tabla, stats_tabla, estado, max_id_lote) # También escribe state.json
+
+def opciones_sin_soporte(tablas, rendimiento):
+    """(tabla, opción) del YAML que solo entiende el motor síncrono: rangos en procesos y tubería de hilos"""
+    ignoradas = []
+    for tabla_info in tablas:
+        if int(tabla_info.get('particiones', 1)) > 1:
+            ignoradas.append((tabla_info['nombre'], "particiones"))
+        if etl.opciones_tabla(tabla_info, rendimiento)["pipeline"]:
+            ignoradas.append((tabla_info['nombre'], "pipeline"))
+    return ignoradas
+
+async def _migrar(config, estado, usuario_rol, es_incremental, execution_id, fecha_inicio, reanuda=None):
+    rendimiento = config.get('rendimiento', {}) or {}
+    max_concurrencia = max(1, int(rendimiento.get('max_concurrencia', 1)))
+    tablas = config['tablas']
+    # ### NUEVO: Este motor ya traslapa lectura y carga en el loop; esas opciones no aplican aquí ###
+    for nombre, opcion in opciones_sin_soporte(tablas, rendimiento):
+        etl.print_log(f"⚠️ {nombre}: `{opcion}` no aplica con el motor asíncrono (se ignora; úsela con motor: sync)")
+
+    etl.print_log("🔌 Conectando a Supabase (motor asíncrono asyncpg)...")
+    try:
+        t0 = time.perf_counter()
+        pool_source, pool_target = await asyncio.gather(
+            crear_pool_async(config['database']['source_url'], max_concurrencia),
+            crear_pool_async(config['database']['target_url'], max_concurrencia + 1)) # +1: auditoría
+        etl.sumar_etapa_ejecucion("conexion", time.perf_counter() - t0)
+    except Exception as e:
+        etl.print_log(f"❌ Error crítico: No se pudo conectar tras {etl.REINTENTOS['max_intentos']} intentos: {e}")
+        return
+
+    conn_consultas = conn_ddl = None
+    try:
+        conn_consultas = await asyncio.to_thread(etl.conectar_con_reintentos, config['database']['source_url'])
+
+        # Mismo grafo que el motor síncrono (YAML `depende_de` + FK del catálogo)
+        nombres = {t['nombre'] for t in tablas}
+        dependencias = {t['nombre']: set(t.get('depende_de', [])) & nombres for t in tablas}
+        if rendimiento.get('dependencias_catalogo', True):
+            try:
+                etl.agregar_dependencias_fk(dependencias, await pool_source.fetch(etl.SQL_DEPENDENCIAS_FK))
+            except Exception as e:
+                etl.print_log(f"   ⚠️ No se pudieron leer las FK del catálogo, se usa solo el YAML: {e}")
+        try:
+            orden = etl.orden_topologico(tablas, dependencias)
+        except Exception as e:
+            etl.print_log(f"⚠️ {e}. Se ignoran las dependencias y se usa el orden del YAML.")
+            dependencias = {t['nombre']: set() for t in tablas}
+            orden = [t['nombre'] for t in tablas]
+        etl.print_log(f"🧭 Orden de dependencias: {' -> '.join(orden)}")
+
+        # Limpieza / staging de la carga completa: mismas funciones (psycopg2) que el motor síncrono, en un hilo
+        staging = None
+        cdc, horizonte = etl.opciones_cdc(config), None
+        if cdc["activo"] and not es_incremental: # Triggers CDC antes de copiar (igual que el motor síncrono)
+            try:
+                await asyncio.to_thread(etl.instalar_cdc, conn_consultas, tablas, cdc)
+                horizonte = await asyncio.to_thread(etl.horizonte_cdc, conn_consultas)
+            except Exception as e:
+                conn_consultas.rollback()
+                etl.print_log(f"❌ No se pudo instalar la captura de cambios: {e}")
+        if not es_incremental:
+            conn_ddl = await asyncio.to_thread(etl.conectar_con_reintentos, config['database']['target_url'])
+            t0 = time.perf_counter()
+            staging = await asyncio.to_thread(etl.limpiar_destinos, conn_ddl.cursor(), tablas, orden, estado,
+                                              rendimiento.get('estrategia_completa', 'delete'),
+                                              rendimiento.get('staging_unlogged', True))
+            etl.sumar_etapa_ejecucion("limpieza", time.perf_counter() - t0)
+            if staging: # Las tablas se cargan en su *_staging
+                tablas = [dict(t, tabla_destino=staging[t['nombre']]["staging"]) for t in tablas]
+        with etl._LOCK_ESTADO: # Marca de esta ejecución + reseteos de la limpieza
+            etl.guardar_estado(estado)
+
+        etl.configurar_cache_mascaras(config.get('cache_mascaras'))
+        etl.configurar_pool_mascaras(config.get('pool_mascaras'))
+        contexto = {
+            "execution_id": execution_id,
+            "es_incremental": es_incremental,
+            "rendimiento": rendimiento,
+            "version_esquema": config.get('version_esquema', 1),
+            # psycopg2.sql necesita una conexión de libpq para escapar identificadores y literales
+            # (solo se usa del lado del cliente: no hace viajes a la base)
+            "conn_consultas": conn_consultas,
+        }
+
+        # Cada tabla espera a sus padres (eventos) y a un lugar libre (semáforo)
+        terminadas = {n: asyncio.Event() for n in nombres}
+        semaforo = asyncio.Semaphore(max_concurrencia)
+
+        async def correr(tabla_info):
+            nombre = tabla_info['nombre']
+            try:
+                for padre in dependencias[nombre]:
+                    await terminadas[padre].wait()
+                async with semaforo:
+                    if max_concurrencia > 1:
+                        etl._PREFIJO_LOG.set(nombre) # Cada tarea tiene su propio contexto
+                    return await migrar_tabla_async(tabla_info, pool_source, pool_target, estado, contexto)
+            except Exception as e:
+                etl.print_log(f"   ❌ Error inesperado en {nombre}: {e}")
+                return {"tabla": nombre, "registros_leidos": 0, "registros_insertados": 0, "errores": [], "error": str(e)}
+            finally:
+                terminadas[nombre].set()
+
+        if max_concurrencia > 1:
+            etl.print_log(f"\n⚡ Ejecutando hasta {max_concurrencia} tablas concurrentes (asyncio)")
+        log_detalles = list(await asyncio.gather(*(correr(t) for t in tablas))) # En el orden del YAML
+        total_registros_global = sum(d.get("registros_leidos", 0) for d in log_detalles)
+        publicada = True
+        if staging:
+            t0 = time.perf_counter()
+            publicada = await asyncio.to_thread(etl.publicar_staging, conn_ddl.cursor(), staging, log_detalles, estado)
+            etl.sumar_etapa_ejecucion("publicacion", time.perf_counter() - t0)
+        if horizonte is not None and publicada and not any(d.get("error") or d.get("errores") for d in log_detalles):
+            try:
+                recortados = await asyncio.to_thread(etl.recortar_cdc, conn_consultas, cdc, {t: None for t in nombres}, horizonte)
+                etl.print_log(f"🧹 Log CDC recortado tras la carga completa: {recortados} entradas")
+            except Exception as e:
+                etl.print_log(f"⚠️ No se pudo recortar el log CDC: {e}")
+
+        # ### NUEVO: Verificación al terminar (psycopg2 en un hilo: son pocas consultas de agregados) ###
+        verificaciones = None
+        if (config.get('verificacion') or {}).get('al_terminar'):
+            t0 = time.perf_counter()
+            verificaciones = await asyncio.to_thread(verificar_con_psycopg2, config, max_concurrencia)
+            for d in log_detalles:
+                d["verificacion"] = verificaciones.get(d['tabla'])
+            etl.sumar_etapa_ejecucion("verificacion", time.perf_counter() - t0)
+
+        # ### PUNTO 5: Auditoría local y en BD al mismo tiempo ###
+        fecha_fin = datetime.datetime.now()
+        t_auditoria = time.perf_counter()
+        log_final = etl.armar_log_final(execution_id, usuario_rol, fecha_inicio, fecha_fin, total_registros_global, log_detalles, reanuda,
+                                        etl.metricas_ejecucion("incremental" if es_incremental else "completa", "async"))
+        if verificaciones is not None:
+            log_final["verificacion"] = etl.resumen_verificacion(verificaciones)
+        etl.terminar_reanudacion(estado)
+
+        async def auditoria_bd():
+            try:
+                nombres_tablas_str = ", ".join([d['tabla'] for d in log_detalles])
+                await _con_reintentos(pool_target.execute, _posicional(etl.SQL_AUDITORIA), execution_id, fecha_inicio,
+                                      fecha_fin, nombres_tablas_str, total_registros_global, json.dumps(log_detalles))
+                etl.print_log("✅ Log guardado en Supabase (tabla auditoria_logs)")
+            except Exception as e:
+                etl.print_log(f"⚠️ Error guardando en auditoria_logs: {e}")
+
+        await asyncio.gather(asyncio.to_thread(etl.guardar_log_local, log_final, config.get('auditoria_local')), auditoria_bd())
+        etl.print_log(f"\n📄 Log guardado localmente en: {etl.ARCHIVO_LOGS}")
+        log_final["metricas"]["etapas"]["auditoria"] = round(time.perf_counter() - t_auditoria, 4)
+        etl.exportar_prometheus(log_final, config.get('metricas'))
+    finally:
+        await asyncio.gather(pool_source.close(), pool_target.close(), return_exceptions=True)
+        for conn in (conn_consultas, conn_ddl):
+            if conn is not None: conn.close()
+
+    etl.print_log("\n🏁 Proceso finalizado exitosamente.")
+
+def verificar_con_psycopg2(config, max_concurrencia):
+    """etl.verificar_migracion con pools psycopg2 propios (se cierran al terminar)"""
+    pool_source = etl.crear_pool_con_reintentos(config['database']['source_url'], max_concurrencia)
+    pool_target = etl.crear_pool_con_reintentos(config['database']['target_url'], max_concurrencia)
+    try:
+        return etl.verificar_migracion(pool_source, pool_target, config['tablas'], {}, max_concurrencia)
+    finally:
+        pool_source.closeall()
+        pool_target.closeall()
+
+def ejecutar_migracion_async(config, estado, usuario_rol, es_incremental, execution_id, fecha_inicio, reanuda=None):
+    """Punto de entrada síncrono (lo llama main.ejecutar_migracion ya validado el RBAC)"""
+    if asyncpg is None:
+        etl.print_log("❌ El motor asíncrono necesita asyncpg (pip install asyncpg).")
+        return
+    asyncio.run(_migrar(config, estado, usuario_rol, es_incremental, execution_id, fecha_inicio, reanuda))
@@ -1,13 +1,14 @@
 import yaml
 import psycopg2
-import requests
-from faker import Faker
 import random
-import sys
+import io
+import csv
+import time
+import argparse
 
 # Configuración
 NUM_REGISTROS = 100
-fake = Faker('es_MX')
+# ### NUEVO: Faker y requests se importan al generar (app.py importa este módulo y no siempre genera) ###
 API_URL = f"https://randomuser.me/api/?results={NUM_REGISTROS}&nat=mx"
 
 def cargar_config():
@@ -15,6 +16,10 @@ def cargar_config():
         return yaml.safe_load(file)
 
 def generar_datos_inteligentes():
+    import requests
+    from faker import Faker
+    fake = Faker('es_MX')
+
     # Buffer para capturar logs y mandarlos a la web
     log_buffer = []
     def log(texto):
@@ -29,8 +34,10 @@ def generar_datos_inteligentes():
         cursor = conn.cursor()
         
         # 1. BUSCAR EL ID MÁXIMO ACTUAL
-        cursor.execute("SELECT COALESCE(MAX(id), 99) FROM clientes")
-        ultimo_id = cursor.fetchone()[0]
+        # ### NUEVO: Uno por tabla: tras el generador masivo, órdenes y detalles van muy por delante de clientes ###
+        cursor.execute("SELECT (SELECT COALESCE(MAX(id), 99) FROM clientes), (SELECT COALESCE(MAX(id), 99) FROM ordenes), "
+                       "(SELECT COALESCE(MAX(id), 99) FROM detalle_ordenes)")
+        ultimo_id, ultima_orden, ultimo_detalle = cursor.fetchone()
         log(f"   📊 Último ID encontrado: {ultimo_id}")
         log(f"   🚀 Generando registros del {ultimo_id + 1} al {ultimo_id + NUM_REGISTROS}...")
 
@@ -53,13 +60,15 @@ def generar_datos_inteligentes():
         # 4. ORDENES Y DETALLES
         for i in range(NUM_REGISTROS):
             nid = ultimo_id + 1 + i
+            oid = ultima_orden + 1 + i
             fecha = fake.date_this_year()
             total = round(random.uniform(100, 5000), 2)
-            cursor.execute("INSERT INTO ordenes (id, cliente_id, fecha_orden, total) VALUES (%s, %s, %s, %s)", (nid, nid, fecha, total))
+            cursor.execute("INSERT INTO ordenes (id, cliente_id, fecha_orden, total) VALUES (%s, %s, %s, %s)", (oid, nid, fecha, total))
             
             prod = fake.word()
             cant = random.randint(1, 5)
-            cursor.execute("INSERT INTO detalle_ordenes (id, orden_id, producto, cantidad) VALUES (%s, %s, %s, %s)", (nid, nid, prod, cant))
+            cursor.execute("INSERT INTO detalle_ordenes (id, orden_id, producto, cantidad) VALUES (%s, %s, %s, %s)",
+                           (ultimo_detalle + 1 + i, oid, prod, cant))
 
         conn.commit()
         cursor.close()
@@ -72,5 +81,204 @@ def generar_datos_inteligentes():
         log(err)
         return err
 
+# ### NUEVO: GENERADOR MASIVO OFFLINE (PRUEBAS DE CARGA) ###
+# Sin API: nombres y productos salen de pools de Faker con semilla y todo lo demás se
+# sortea por arreglos con NumPy, una página de clientes a la vez, cada página con su propio
+# RandomState(semilla, página). Misma semilla + mismos parámetros = mismas filas en cualquier
+# máquina (con la misma versión de Faker; el flujo de RandomState no cambia entre versiones).
+
+GENERADOR_MASIVO_DEFAULT = {
+    "clientes": 100000,
+    "ordenes_por_cliente": [0, 4],   # Rango (min, max) de órdenes por cliente
+    "detalles_por_orden": [1, 5],    # Rango (min, max) de renglones por orden
+    "proporcion_total_alto": 0.3,    # Fracción de órdenes con total > umbral_total
+    "umbral_total": 12000,           # El mismo corte que usan los filtro_sql de config.yaml
+    "total_maximo": 50000,
+    "fecha_desde": "2024-01-01",
+    "dias": 730,
+    "semilla": 42,
+    "lote_clientes": 20000,          # Clientes por bloque (un COPY por tabla y un COMMIT por bloque)
+    "clientes_por_pagina": 1000,     # Clientes por sorteo; cambiarlo cambia el dataset (lote_clientes no)
+    "tamano_pools": 1000,
+}
+
+DOMINIOS_EMAIL = ["gmail.com", "hotmail.com", "outlook.com", "yahoo.com.mx", "prodigy.net.mx"]
+
+def opciones_generador(config=None, **sobrescribir):
+    """Mezcla defaults, la sección generador_masivo de config.yaml y los argumentos."""
+    opciones = dict(GENERADOR_MASIVO_DEFAULT)
+    opciones.update((config or {}).get("generador_masivo") or {})
+    opciones.update({k: v for k, v in sobrescribir.items() if v is not None})
+    return opciones
+
+def crear_pools(semilla, tamano):
+    """Listas de nombres, apellidos y productos generadas una sola vez con Faker."""
+    from faker import Faker
+    fk = Faker('es_MX')
+    fk.seed_instance(semilla)
+    return {
+        "nombres": [fk.first_name() for _ in range(tamano)],
+        "apellidos": [fk.last_name() for _ in range(tamano)],
+        "productos": [fk.word() for _ in range(max(50, tamano // 10))],
+    }
+
+def _tarjetas(np, rs, n):
+    """n tarjetas de 16 dígitos (empiezan en 4) con dígito verificador Luhn válido."""
+    digitos = np.concatenate([np.full((n, 1), 4), rs.randint(10, size=(n, 14))], axis=1)
+    # Luhn sobre 15 dígitos: se duplican las posiciones pares (contando desde la izquierda)
+    dobles = digitos[:, ::2] * 2
+    dobles -= 9 * (dobles > 9)
+    suma = dobles.sum(axis=1) + digitos[:, 1::2].sum(axis=1)
+    digitos = np.concatenate([digitos, ((10 - suma % 10) % 10)[:, None]], axis=1)
+    return np.char.decode((digitos + ord("0")).astype(np.uint8).view("S16").ravel(), "ascii")
+
+def _texto(arreglo):
+    """Arreglo -> arreglo de objetos str (para concatenar con + elemento a elemento)."""
+    return arreglo.astype(str).astype(object)
+
+def generar_bloque(semilla, pagina, pools, opciones, n_clientes, ids):
+    """
+    Genera la página `pagina` (n_clientes) con sus órdenes y detalles, por arreglos de NumPy.
+    `ids` = {"clientes","ordenes","detalle_ordenes"} con el siguiente ID libre de cada tabla
+    (se actualiza). Regresa tres listas de tuplas. Cada página sortea con su propio
+    RandomState(semilla, página): los datos no dependen de lote_clientes.
+    """
+    import numpy as np
+    rs = np.random.RandomState([semilla, pagina])
+    min_ord, max_ord = opciones["ordenes_por_cliente"]
+    min_det, max_det = opciones["detalles_por_orden"]
+    umbral = float(opciones["umbral_total"])
+    total_max = float(opciones["total_maximo"])
+    fecha_desde = np.datetime64(str(opciones["fecha_desde"]), "D")
+    nombres = np.array(pools["nombres"], dtype=object)
+    apellidos = np.array(pools["apellidos"], dtype=object)
+    productos = np.array(pools["productos"], dtype=object)
+    # Formas para el email: minúsculas, sin espacios y solo el primer apellido
+    nombres_email = np.array([n.lower().replace(" ", "") for n in pools["nombres"]], dtype=object)
+    apellidos_email = np.array([a.split(" ")[0].lower() for a in pools["apellidos"]], dtype=object)
+    dominios = np.array(DOMINIOS_EMAIL, dtype=object)
+
+    # Clientes
+    cids = np.arange(ids["clientes"], ids["clientes"] + n_clientes)
+    i_nombre = rs.randint(len(nombres), size=n_clientes)
+    i_ap1, i_ap2 = rs.randint(len(apellidos), size=(2, n_clientes))
+    i_dominio = rs.randint(len(dominios), size=n_clientes)
+    lada, prefijo = rs.randint(100, 1000, size=(2, n_clientes))
+    sufijo = np.char.zfill(rs.randint(10000, size=n_clientes).astype(str), 4).astype(object)
+    nombre_completo = nombres[i_nombre] + " " + apellidos[i_ap1] + " " + apellidos[i_ap2]
+    emails = nombres_email[i_nombre] + "." + apellidos_email[i_ap1] + _texto(cids) + "@" + dominios[i_dominio]
+    telefonos = "(" + _texto(lada) + ") " + _texto(prefijo) + "-" + sufijo
+    tarjetas = _tarjetas(np, rs, n_clientes)
+
+    # Órdenes: cliente_id repetido según cuántas tiene cada cliente
+    por_cliente = rs.randint(min_ord, max_ord + 1, size=n_clientes)
+    n_ordenes = int(por_cliente.sum())
+    oids = np.arange(ids["ordenes"], ids["ordenes"] + n_ordenes)
+    altos = rs.random_sample(n_ordenes) < float(opciones["proporcion_total_alto"])
+    totales = np.where(altos, rs.uniform(umbral + 0.01, total_max, n_ordenes), rs.uniform(100, umbral, n_ordenes))
+    fechas = fecha_desde + rs.randint(int(opciones["dias"]), size=n_ordenes)
+
+    # Detalles
+    por_orden = rs.randint(min_det, max_det + 1, size=n_ordenes)
+    n_detalles = int(por_orden.sum())
+    i_producto = rs.randint(len(productos), size=n_detalles)
+    cantidades = rs.randint(1, 11, size=n_detalles)
+
+    clientes = list(zip(cids.tolist(), nombre_completo.tolist(), emails.tolist(), telefonos.tolist(), tarjetas.tolist()))
+    ordenes = list(zip(oids.tolist(), np.repeat(cids, por_cliente).tolist(), fechas.astype(str).tolist(),
+                       np.char.mod("%.2f", totales).tolist()))
+    detalles = list(zip(range(ids["detalle_ordenes"], ids["detalle_ordenes"] + n_detalles),
+                        np.repeat(oids, por_orden).tolist(), productos[i_producto].tolist(), cantidades.tolist()))
+    ids["clientes"] += n_clientes
+    ids["ordenes"] += n_ordenes
+    ids["detalle_ordenes"] += n_detalles
+    return clientes, ordenes, detalles
+
+def generar_paginas(semilla, pools, opciones, total_clientes, ids):
+    """Itera las páginas de `clientes_por_pagina` clientes (la última puede ser más chica)."""
+    pagina = max(1, int(opciones["clientes_por_pagina"]))
+    for numero, desde in enumerate(range(0, total_clientes, pagina)):
+        yield generar_bloque(semilla, numero, pools, opciones, min(pagina, total_clientes - desde), ids)
+
+def _copiar(cursor, tabla, columnas, filas):
+    """COPY ... FROM STDIN (FORMAT csv) de una lista de tuplas."""
+    if not filas:
+        return
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(filas)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+COLUMNAS_GENERADOR = {
+    "clientes": ["id", "nombre_completo", "email", "telefono", "tarjeta_credito"],
+    "ordenes": ["id", "cliente_id", "fecha_orden", "total"],
+    "detalle_ordenes": ["id", "orden_id", "producto", "cantidad"],
+}
+
+def generar_datos_masivos(reiniciar=False, log=print, config=None, **parametros):
+    """
+    Modo offline: inserta `clientes` clientes con órdenes y detalles referencialmente
+    consistentes vía COPY en la BD origen. reiniciar=True vacía antes las tablas de
+    origen para que el dataset (IDs incluidos) sea idéntico entre máquinas.
+    """
+    config = config or cargar_config()
+    opciones = opciones_generador(config, **parametros)
+    semilla = int(opciones["semilla"])
+    pools = crear_pools(semilla, int(opciones["tamano_pools"]))
+
+    conn = psycopg2.connect(config['database']['source_url'])
+    try:
+        cursor = conn.cursor()
+        if reiniciar:
+            cursor.execute("TRUNCATE detalle_ordenes, ordenes, clientes RESTART IDENTITY")
+            log("🧹 Tablas de origen vaciadas")
+        ids = {}
+        for tabla in COLUMNAS_GENERADOR:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}")
+            ids[tabla] = cursor.fetchone()[0] + 1
+        conn.commit()
+
+        total_clientes = int(opciones["clientes"])
+        lote = max(1, int(opciones["lote_clientes"]))
+        conteos = {tabla: 0 for tabla in COLUMNAS_GENERADOR}
+        inicio = time.time()
+        log(f"🏭 Generando {total_clientes} clientes (semilla {semilla}, desde ID {ids['clientes']})...")
+        bloque = ([], [], [])
+        for pagina in generar_paginas(semilla, pools, opciones, total_clientes, ids):
+            for acumulado, filas in zip(bloque, pagina):
+                acumulado.extend(filas)
+            if len(bloque[0]) < lote and conteos["clientes"] + len(bloque[0]) < total_clientes:
+                continue
+            # Orden de FK: clientes -> ordenes -> detalle_ordenes, todo el bloque en una transacción
+            for tabla, filas in zip(COLUMNAS_GENERADOR, bloque):
+                _copiar(cursor, tabla, COLUMNAS_GENERADOR[tabla], filas)
+                conteos[tabla] += len(filas)
+            conn.commit()
+            bloque = ([], [], [])
+            log(f"   📦 {conteos['clientes']}/{total_clientes} clientes | {conteos['ordenes']} órdenes | {conteos['detalle_ordenes']} detalles")
+        cursor.execute("ANALYZE clientes; ANALYZE ordenes; ANALYZE detalle_ordenes")
+        conn.commit()
+        duracion = time.time() - inicio
+        filas = sum(conteos.values())
+        log(f"✅ {filas} filas en {duracion:.1f}s ({filas / max(duracion, 1e-9):,.0f} filas/s)")
+        return conteos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
-    generar_datos_inteligentes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generador de datos de origen")
+    parser.add_argument("--masivo", action="store_true", help="Modo offline de alto volumen (COPY)")
+    parser.add_argument("--clientes", type=int)
+    parser.add_argument("--semilla", type=int)
+    parser.add_argument("--proporcion-total-alto", type=float)
+    parser.add_argument("--lote-clientes", type=int)
+    parser.add_argument("--reiniciar", action="store_true", help="Vaciar las tablas de origen antes de generar")
+    args = parser.parse_args()
+    if args.masivo:
+        generar_datos_masivos(reiniciar=args.reiniciar, clientes=args.clientes, semilla=args.semilla,
+                              proporcion_total_alto=args.proporcion_total_alto, lote_clientes=args.lote_clientes)
+    else:
+        generar_datos_inteligentes()
\ No newline at end of file
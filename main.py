@@ -1,35 +1,136 @@
 import yaml
 import psycopg2
-from psycopg2 import extras # ### PUNTO 9: Necesario para Batch Inserts (Rendimiento) ###
+from psycopg2 import pool   # ### NUEVO: Pool de conexiones para procesar tablas en paralelo ###
+from psycopg2 import sql    # ### NUEVO: Consultas incrementales compuestas (identificadores y literales escapados) ###
+import re
 import hashlib
+import hmac     # ### NUEVO: Llave de la caché de máscaras en disco ###
+import sqlite3  # ### NUEVO: Caché persistente de máscaras ###
+from collections import OrderedDict # ### NUEVO: LRU de máscaras ###
+import io       # ### NUEVO: Buffer en memoria para COPY FROM STDIN ###
+import gzip     # ### NUEVO: Archivo comprimido de logs rotados ###
+import glob
+import shutil
+import struct   # ### NUEVO: Formato binario de COPY ###
+import decimal
 import json   # ### NUEVO: Necesario para guardar el archivo de estado (memoria) ###
 import os     # ### NUEVO: Necesario para verificar si el archivo existe ###
 import uuid      # ### PUNTO 5: Generar ID único de ejecución ###
 import datetime # ### PUNTO 5: Capturar hora inicio/fin ###
 import time      # ### PUNTO 6: Necesario para esperar entre reintentos ###
 import sys       # ### PUNTO 10: Necesario para leer argumentos de línea de comandos ###
-from faker import Faker
+import threading # ### NUEVO: Locks para estado/caché compartidos entre hilos ###
+import contextvars # ### NUEVO: Prefijo de log que funciona igual en hilos y en tareas asyncio ###
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing # ### NUEVO: Procesos por rango de llave (extracción particionada) ###
+import queue           # ### NUEVO: Colas acotadas entre etapas de la tubería ###
+import cProfile        # ### NUEVO: Perfilado (--profile) ###
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from itertools import repeat     # ### NUEVO: Plan de fila (columnas constantes sin copiar por fila) ###
+from operator import itemgetter
+import random
+from array import array # ### NUEVO: Teléfonos del pool de máscaras como uint64 ###
+try:
+    import fcntl # ### NUEVO: Lock entre procesos del historial local (CLI y app.py a la vez) ###
+except ImportError: # Windows: solo queda el lock entre hilos
+    fcntl = None
+# ### NUEVO: Faker, NumPy y psycopg2.extras se importan al primer uso (app.py importa este módulo en cada sesión) ###
 
 # --- FIX PARA QUE APP.PY LO ENCUENTRE SIEMPRE ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ARCHIVO_CONFIG = os.path.join(BASE_DIR, "config.yaml")
-ARCHIVO_ESTADO = os.path.join(BASE_DIR, "state.json")
-ARCHIVO_LOGS = os.path.join(BASE_DIR, "logs_historial.json") # ### PUNTO 5: Nombre del archivo local de logs ###
+# ### NUEVO: ETL_DIR_DATOS permite apartar config/estado/logs/cachés (p. ej. benchmark.py). Los procesos de partición lo heredan ###
+DIR_DATOS = os.environ.get("ETL_DIR_DATOS") or BASE_DIR
+ARCHIVO_CONFIG = os.path.join(DIR_DATOS, "config.yaml")
+ARCHIVO_ESTADO = os.path.join(DIR_DATOS, "state.json")
+ARCHIVO_LOGS = os.path.join(DIR_DATOS, "logs_historial.jsonl") # ### PUNTO 5: Nombre del archivo local de logs (una ejecución por línea) ###
+ARCHIVO_LOGS_LEGADO = os.path.join(DIR_DATOS, "logs_historial.json") # Formato anterior (un solo arreglo JSON)
+ARCHIVO_LOG_INDICE = os.path.join(DIR_DATOS, "logs_indice.json") # ### NUEVO: Resumen para los KPIs del dashboard ###
+ARCHIVO_PLANES = os.path.join(DIR_DATOS, "planes_carga.json") # ### NUEVO: Caché en disco de planes de carga ###
+ARCHIVO_CACHE_MASCARAS = os.path.join(DIR_DATOS, "cache_mascaras.sqlite") # ### NUEVO: Máscaras ya calculadas ###
+ARCHIVO_POOL_MASCARAS = os.path.join(DIR_DATOS, "pool_mascaras.bin") # ### NUEVO: Nombres y teléfonos precalculados ###
+DIR_PERFILES = os.path.join(DIR_DATOS, "perfiles") # ### NUEVO: Reportes de --profile (una carpeta por execution_id) ###
 
 # Inicializar Faker para datos falsos (México)
-fake = Faker('es_MX')
+# ### NUEVO: Bajo demanda: importar Faker y crear la instancia tarda cientos de ms ###
+_FAKER = None
+_LOCK_FAKER = threading.Lock()
+
+def obtener_faker():
+    """Instancia compartida de Faker('es_MX'), creada la primera vez que se pide"""
+    global _FAKER
+    if _FAKER is None:
+        with _LOCK_FAKER:
+            if _FAKER is None:
+                from faker import Faker
+                _FAKER = Faker('es_MX')
+    return _FAKER
+
+_NUMPY = [] # [] = aún no se intentó importar; [None] = no está instalado
+
+def obtener_numpy():
+    """NumPy si está instalado (opcional: generación masiva de dígitos para preserve_format)"""
+    if not _NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    return _NUMPY[0]
+
+def __getattr__(nombre):
+    """Compatibilidad: `main.fake` y `main.np` siguen existiendo, pero se cargan al primer acceso"""
+    if nombre == "fake": return obtener_faker()
+    if nombre == "np": return obtener_numpy()
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
 
 # ### PUNTO 6: CONFIGURACIÓN DE REINTENTOS ###
 MAX_REINTENTOS = 3
-TIEMPO_ESPERA = 1 # Segundos (Constante, NO exponencial)
+TIEMPO_ESPERA = 1 # Segundos antes del primer reintento (luego crece exponencialmente, ver espera_reintento)
+
+# ### NUEVO: Backoff exponencial con jitter (sección `reintentos` del YAML) ###
+REINTENTOS = {
+    "max_intentos": MAX_REINTENTOS,
+    "espera_base": TIEMPO_ESPERA, # Se duplica en cada intento...
+    "espera_max": 30,             # ...hasta este tope (segundos)
+    "jitter": True,               # Espera al azar entre la mitad y el total: los hilos no reintentan a la vez
+}
+
+# Errores que vale la pena reintentar: SQLSTATE exacto o su clase (2 primeros caracteres)
+SQLSTATE_TRANSITORIOS = {
+    "08",                         # connection_exception (conexión caída, rechazada, protocolo del pooler)
+    "40001", "40P01",             # serialization_failure, deadlock_detected
+    "55P03",                      # lock_not_available
+    "57014",                      # query_canceled (statement_timeout)
+    "57P01", "57P02", "57P03",    # admin_shutdown, crash_shutdown, cannot_connect_now
+    "53200", "53300",             # out_of_memory, too_many_connections
+}
+# Sin SQLSTATE (cliente o pooler): se reconocen por el mensaje
+MENSAJES_TRANSITORIOS = (
+    "server closed the connection", "connection already closed", "connection is closed", "connection reset",
+    "connection refused", "terminating connection", "could not receive data", "could not send data",
+    "ssl syscall", "ssl connection has been closed", "broken pipe", "eof detected", "timeout", "timed out",
+    "query_wait_timeout", "server_login_retry", "no more connections allowed",
+)
 
 # ### PUNTO 9: CONFIGURACIÓN DE RENDIMIENTO ###
 BATCH_SIZE = 1000 # Insertaremos de 1000 en 1000 registros para mayor velocidad
+CHUNK_SIZE = 5000 # ### NUEVO: Filas que se leen por viaje con el cursor del servidor (itersize/fetchmany) ###
 # ---------------------------------------------
 
 # Variable global para capturar logs hacia la web
 LOG_BUFFER = []
+_PREFIJO_LOG = contextvars.ContextVar("prefijo_log", default="") # ### NUEVO: Prefijo por hilo/tarea (nombre de la tabla) ###
+_LOCK_ESTADO = threading.Lock()   # ### NUEVO: state.json se escribe desde varios hilos ###
+_LOCK_PLANES = threading.Lock()   # ### NUEVO: caché de planes de carga compartida ###
+_LOCK_LOGS = threading.RLock()    # ### NUEVO: historial JSONL + índice (reentrante; entre procesos: lock_logs) ###
+_LOCK_METRICAS = threading.Lock() # ### NUEVO: contadores de reintentos compartidos entre hilos ###
+
 def print_log(texto):
+    prefijo = _PREFIJO_LOG.get()
+    if prefijo:
+        texto = "\n".join(f"[{prefijo}] {l}" if l else l for l in str(texto).split("\n"))
     print(texto)
     LOG_BUFFER.append(str(texto))
 
@@ -51,67 +152,745 @@ def cargar_estado():
     return {}
 
 def guardar_estado(estado):
-    with open(ARCHIVO_ESTADO, "w") as f:
+    # ### NUEVO: Escritura atómica (temporal + os.replace): un corte a medias deja intacto el state.json anterior ###
+    temporal = f"{ARCHIVO_ESTADO}.tmp"
+    with open(temporal, "w") as f:
         json.dump(estado, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ARCHIVO_ESTADO)
+
+# ### NUEVO: CHECKPOINTS POR CHUNK Y REANUDACIÓN ###
+# La marca de agua se guarda tras cada chunk confirmado (cada `checkpoint_chunks`). Mientras una ejecución
+# corre, state.json guarda además una marca con las filas ya confirmadas por tabla: si la ejecución muere,
+# la siguiente la encuentra y retoma desde el último chunk en lugar de empezar la tabla de nuevo.
+CLAVE_REANUDACION = "_carga_en_curso"
+
+def preparar_reanudacion(estado, es_incremental, execution_id, rendimiento):
+    """Deja en `estado` la marca de esta ejecución. Devuelve (es_incremental, id de la ejecución que se retoma o None)"""
+    anterior = estado.pop(CLAVE_REANUDACION, None)
+    modo = "incremental" if es_incremental else "completo"
+    reanuda, filas = None, {}
+    if anterior and "estado_previo" in anterior:
+        # Carga completa por staging interrumpida: QA nunca cambió, volvemos a sus marcas de agua
+        print_log(f"♻️  La carga por staging {anterior['execution_id']} no terminó: QA no cambió, se restauran sus marcas de agua")
+        estado.update(anterior["estado_previo"])
+    elif anterior and rendimiento.get('reanudar', True) and (es_incremental or anterior.get("modo") == "completo"):
+        reanuda, filas, modo = anterior["execution_id"], dict(anterior.get("filas", {})), anterior.get("modo", modo)
+        print_log(f"♻️  La ejecución {reanuda} no terminó: se retoma desde el último chunk confirmado")
+        if not es_incremental:
+            # Las tablas QA ya tienen lo confirmado: sin limpieza, cada tabla sigue desde su marca de agua
+            print_log("   La carga completa continúa como incremental (sin limpieza).")
+            es_incremental = True
+    estado[CLAVE_REANUDACION] = {"execution_id": execution_id, "modo": modo, "reanuda": reanuda, "filas": filas}
+    return es_incremental, reanuda
+
+def terminar_reanudacion(estado):
+    """La ejecución terminó: quitamos la marca para que la próxima no intente retomar"""
+    with _LOCK_ESTADO:
+        estado.pop(CLAVE_REANUDACION, None)
+        guardar_estado(estado)
+
+def guardar_avance_tabla(estado, stats_tabla, max_id_lote):
+    """Guarda la marca de agua de la tabla y las filas confirmadas hasta ahora"""
+    nombre_tabla = stats_tabla["tabla"]
+    with _LOCK_ESTADO: # Varias tablas pueden guardar al mismo tiempo
+        estado[nombre_tabla] = marca_json(max_id_lote) # ### NUEVO: Forma JSON solo al guardar ###
+        marca = estado.get(CLAVE_REANUDACION)
+        if marca is not None:
+            marca["filas"][nombre_tabla] = stats_tabla.get("filas_omitidas_reanudacion", 0) + stats_tabla["registros_insertados"]
+        guardar_estado(estado)
+
+def checkpoint_chunk(estado, stats_tabla, max_id_lote, chunks_confirmados, cada):
+    """Checkpoint tras un chunk confirmado, cada `cada` chunks (0 = solo al terminar la tabla)"""
+    if estado is None or not cada or chunks_confirmados % cada: return
+    guardar_avance_tabla(estado, stats_tabla, max_id_lote)
+
+# ### NUEVO: MÉTRICAS POR ETAPA ###
+# Cada tabla lleva en stats_tabla["metricas"] sus segundos por etapa (extracción, transformación,
+# carga, commit), los segundos por regla de enmascaramiento, un histograma de latencia por lote
+# y los bytes aproximados leídos/enviados; así viajan en detalle_json de la auditoría.
+# Lo que es de toda la ejecución (conexión, limpieza, auditoría, reintentos) va en METRICAS_EJECUCION.
+ETAPAS_TABLA = ("conexion", "extraccion", "transformacion", "carga", "commit")
+LIMITES_LATENCIA_LOTE = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30] # Segundos (buckets del histograma)
+METRICAS_EJECUCION = {"etapas": {}, "reintentos": {}}
+_METRICAS_TABLA = contextvars.ContextVar("metricas_tabla", default=None) # Tabla en curso (para atribuirle reintentos)
+
+def reiniciar_metricas_ejecucion():
+    METRICAS_EJECUCION["etapas"] = {}
+    METRICAS_EJECUCION["reintentos"] = {}
+
+def sumar_etapa_ejecucion(etapa, segundos):
+    with _LOCK_METRICAS:
+        METRICAS_EJECUCION["etapas"][etapa] = METRICAS_EJECUCION["etapas"].get(etapa, 0.0) + segundos
+
+def contar_reintento(operacion, veces=1):
+    """Lo llaman los *_con_reintentos antes de volver a intentar"""
+    with _LOCK_METRICAS:
+        reintentos = METRICAS_EJECUCION["reintentos"]
+        reintentos[operacion] = reintentos.get(operacion, 0) + veces
+        metricas = _METRICAS_TABLA.get()
+        if metricas is not None:
+            metricas["reintentos"][operacion] = metricas["reintentos"].get(operacion, 0) + veces
+
+def nuevo_histograma():
+    return {"limites": list(LIMITES_LATENCIA_LOTE), "conteos": [0] * (len(LIMITES_LATENCIA_LOTE) + 1), "suma": 0.0, "n": 0}
+
+def observar(histograma, valor):
+    """Cuenta un valor en su bucket (el último es +Inf)"""
+    i = 0
+    while i < len(histograma["limites"]) and valor > histograma["limites"][i]:
+        i += 1
+    histograma["conteos"][i] += 1
+    histograma["suma"] += valor
+    histograma["n"] += 1
+
+def nuevas_metricas_tabla():
+    return {
+        "segundos": {etapa: 0.0 for etapa in ETAPAS_TABLA},
+        "segundos_por_regla": {},
+        "latencia_lote": nuevo_histograma(),
+        "lotes": 0,
+        "bytes_leidos": 0,
+        "bytes_enviados": 0,
+        "reintentos": {},
+    }
+
+def sumar_metricas(destino, origen):
+    """Acumula las métricas de un rango/hilo en las de la tabla"""
+    for grupo in ("segundos", "segundos_por_regla", "reintentos"):
+        for k, v in origen.get(grupo, {}).items():
+            destino[grupo][k] = destino[grupo].get(k, 0) + v
+    for k in ("lotes", "bytes_leidos", "bytes_enviados"):
+        destino[k] += origen.get(k, 0)
+    hist = origen.get("latencia_lote")
+    if hist:
+        destino["latencia_lote"]["conteos"] = [a + b for a, b in zip(destino["latencia_lote"]["conteos"], hist["conteos"])]
+        destino["latencia_lote"]["suma"] += hist["suma"]
+        destino["latencia_lote"]["n"] += hist["n"]
+
+def bytes_aprox(filas, muestra=50):
+    """Tamaño en texto de un chunk estimado con las primeras filas (psycopg2 no expone los bytes del socket)"""
+    if not filas: return 0
+    ejemplo = filas[:muestra]
+    total = sum(len(str(v)) + 1 for fila in ejemplo for v in fila)
+    return int(total * len(filas) / len(ejemplo))
+
+def redondear_metricas(metricas):
+    for grupo in ("segundos", "segundos_por_regla"):
+        metricas[grupo] = {k: round(v, 4) for k, v in metricas[grupo].items()}
+    metricas["latencia_lote"]["suma"] = round(metricas["latencia_lote"]["suma"], 4)
+    return metricas
+
+# ### NUEVO: PERFILADO DEL CAMINO CRÍTICO (--profile) ###
+# "completo": un cProfile por hilo (cada tabla, sus hilos de pipeline y sus procesos de rango) más
+#   tracemalloc -> perfiles/<execution_id>/<tabla>.txt (funciones más calientes y mayores sitios de
+#   asignación) y <tabla>.prof (para pstats/snakeviz). Cuesta bastante: es para diagnosticar.
+# "muestreo": un hilo toma la pila de los hilos de cada tabla cada `intervalo_ms` (tiempo de pared:
+#   también se ve la espera de red) -> <tabla>.txt y <tabla>.folded (flamegraph). Costo casi fijo:
+#   se puede dejar encendido en producción con `perfilado.modo: muestreo`.
+# El hilo principal (conexión, limpieza, auditoría y, en el motor async, todo el loop) va en "_ejecucion";
+#   mientras procesa una tabla, ese perfil se pausa y el tiempo se cuenta solo en la tabla.
+# Python 3.12+ admite un solo cProfile activo por proceso (y ve todos los hilos): en "completo" ese único
+#   perfil es "_ejecucion" y el tiempo de cada tabla se atribuye con el muestreador.
+PERFILADO_DEFAULT = {"modo": "", "intervalo_ms": 10, "top": 25, "frames_tracemalloc": 10}
+MODOS_PERFIL = ("completo", "muestreo")
+_PERFIL = {"modo": None}
+_LOCK_PERFIL = threading.Lock()
+_TABLA_PERFIL = contextvars.ContextVar("tabla_perfil", default=None) # A quién se le atribuye la memoria
+PERFIL_EJECUCION = "_ejecucion"
+UN_SOLO_PERFILADOR = sys.version_info >= (3, 12)
+
+def iniciar_perfilado(modo, opciones, execution_id):
+    """Arranca el perfilado de esta ejecución (no hace nada si modo está vacío)"""
+    if modo not in MODOS_PERFIL: return
+    opciones = {**PERFILADO_DEFAULT, **(opciones or {})}
+    directorio = os.path.join(DIR_PERFILES, execution_id)
+    os.makedirs(directorio, exist_ok=True)
+    _PERFIL.clear()
+    _PERFIL.update({"modo": modo, "opciones": opciones, "directorio": directorio, "perfiles": {}, "archivos": {},
+                    "muestras": {}, "memoria": {}, "hilos": {}, "activos": {}, "resumenes": {}})
+    if modo == "completo":
+        tracemalloc.start(int(opciones["frames_tracemalloc"]))
+    if modo == "muestreo" or UN_SOLO_PERFILADOR:
+        _PERFIL["detener"] = threading.Event()
+        _PERFIL["muestreador"] = threading.Thread(target=_muestreador, args=(opciones["intervalo_ms"] / 1000, _PERFIL["detener"]),
+                                                  name="etl-muestreador", daemon=True)
+        _PERFIL["muestreador"].start()
+    _PERFIL["principal"] = perfilar_tabla(PERFIL_EJECUCION)
+    _PERFIL["principal"].__enter__()
+    print_log(f"🔬 Perfilado '{modo}' activo: {directorio}")
+
+def terminar_perfilado():
+    """Cierra el perfil del hilo principal, detiene muestreo/tracemalloc y escribe el índice"""
+    if not _PERFIL.get("modo"): return None
+    try:
+        _PERFIL["principal"].__exit__(None, None, None)
+        if "detener" in _PERFIL:
+            _PERFIL["detener"].set()
+            _PERFIL["muestreador"].join()
+            for tabla in list(_PERFIL["muestras"]): # Las tablas ya escribieron lo suyo; esto completa lo que llegó tarde
+                if tabla not in _PERFIL["resumenes"]:
+                    _escribir_reporte(tabla)
+        with open(os.path.join(_PERFIL["directorio"], "indice.json"), "w", encoding="utf-8") as f:
+            json.dump({"modo": _PERFIL["modo"], "opciones": _PERFIL["opciones"], "tablas": _PERFIL["resumenes"]},
+                      f, indent=2, ensure_ascii=False)
+        return _PERFIL["directorio"]
+    finally:
+        if tracemalloc.is_tracing(): tracemalloc.stop()
+        _PERFIL.clear()
+        _PERFIL["modo"] = None
+
+def info_perfilado():
+    """Lo que necesitan los procesos de rango para perfilarse igual que el padre"""
+    if not _PERFIL.get("modo"): return None
+    return {"modo": _PERFIL["modo"], "opciones": _PERFIL["opciones"], "directorio": _PERFIL["directorio"]}
+
+def _muestreador(intervalo, detener):
+    """Cada `intervalo` anota la pila de cada hilo registrado (pilas colapsadas: "f1;f2;f3" -> muestras)"""
+    while not detener.wait(intervalo):
+        marcos = sys._current_frames()
+        with _LOCK_PERFIL:
+            hilos = dict(_PERFIL.get("hilos", {}))
+        for id_hilo, tabla in hilos.items():
+            marco = marcos.get(id_hilo)
+            pila = []
+            while marco is not None:
+                codigo = marco.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                marco = marco.f_back
+            if not pila: continue
+            clave = ";".join(reversed(pila))
+            with _LOCK_PERFIL:
+                muestras = _PERFIL["muestras"].setdefault(tabla, {})
+                muestras[clave] = muestras.get(clave, 0) + 1
+
+@contextmanager
+def perfilar_tabla(tabla, principal=True):
+    """
+    Perfila el hilo actual a nombre de `tabla`. principal=True además toma la memoria de la tabla
+    y escribe su reporte al salir; los hilos auxiliares (pipeline, to_thread) usan principal=False.
+    Entrega un dict que al salir trae el resumen (top de funciones) para la auditoría.
+    """
+    resumen = {}
+    modo = _PERFIL.get("modo")
+    if not modo:
+        yield resumen
+        return
+
+    id_hilo = threading.get_ident()
+    with _LOCK_PERFIL:
+        anterior = _PERFIL["hilos"].get(id_hilo)
+        _PERFIL["hilos"][id_hilo] = tabla
+    perfil = exterior = None
+    if modo == "completo" and (not UN_SOLO_PERFILADOR or (principal and tabla == PERFIL_EJECUCION)):
+        with _LOCK_PERFIL:
+            exterior = _PERFIL["activos"].get(id_hilo)
+        if exterior is not None:
+            exterior.disable() # Un cProfile por hilo: el de afuera se pausa mientras dura esta tabla
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+            with _LOCK_PERFIL:
+                _PERFIL["activos"][id_hilo] = perfil
+        except ValueError: # Otro perfilador ajeno al ETL ya ocupa el lugar (p. ej. un depurador)
+            perfil = None
+    token = _TABLA_PERFIL.set(tabla) if principal else None
+    if principal and modo == "completo":
+        _PERFIL["memoria"][tabla] = {"inicio": tracemalloc.take_snapshot(), "pico": None, "bytes_pico": 0,
+                                     "bytes_inicio": tracemalloc.get_traced_memory()[0]}
+    try:
+        yield resumen
+    finally:
+        if perfil is not None:
+            perfil.disable()
+            with _LOCK_PERFIL:
+                _PERFIL["perfiles"].setdefault(tabla, []).append(perfil)
+                if exterior is None: _PERFIL["activos"].pop(id_hilo, None)
+                else: _PERFIL["activos"][id_hilo] = exterior
+        with _LOCK_PERFIL:
+            if anterior is None: _PERFIL["hilos"].pop(id_hilo, None)
+            else: _PERFIL["hilos"][id_hilo] = anterior
+        if token is not None:
+            _TABLA_PERFIL.reset(token)
+        if principal:
+            resumen.update(_escribir_reporte(tabla))
+        if exterior is not None:
+            exterior.enable() # Al final: pstats llama disable() del perfil de la tabla y eso quita el del hilo
+
+def en_hilo_perfilado(tabla, funcion, *args):
+    """Para asyncio.to_thread: la función corre perfilada (hilo auxiliar) a nombre de `tabla`"""
+    if not _PERFIL.get("modo"): return funcion(*args)
+    with perfilar_tabla(tabla, principal=False):
+        return funcion(*args)
+
+def capturar_pico_memoria():
+    """Si la memoria trazada subió >10% sobre el pico de la tabla en curso, guarda un snapshot"""
+    if _PERFIL.get("modo") != "completo": return
+    memoria = _PERFIL["memoria"].get(_TABLA_PERFIL.get())
+    if memoria is None: return
+    actual = tracemalloc.get_traced_memory()[0]
+    if actual > max(memoria["bytes_pico"], memoria["bytes_inicio"]) * 1.1:
+        memoria["bytes_pico"] = actual
+        memoria["pico"] = tracemalloc.take_snapshot()
+
+def agregar_perfil_hijo(tabla, perfil_hijo):
+    """Junta lo que devolvió un proceso de rango (archivo .prof o muestras) con lo de su tabla"""
+    if not perfil_hijo or not _PERFIL.get("modo"): return
+    with _LOCK_PERFIL:
+        if perfil_hijo.get("archivo"):
+            _PERFIL["archivos"].setdefault(tabla, []).append(perfil_hijo["archivo"])
+        for pila, n in perfil_hijo.get("muestras", {}).items():
+            muestras = _PERFIL["muestras"].setdefault(tabla, {})
+            muestras[pila] = muestras.get(pila, 0) + n
+
+def _escribir_reporte(tabla):
+    """Escribe <tabla>.txt (+ .prof o .folded) y devuelve el resumen para la auditoría"""
+    opciones, directorio = _PERFIL["opciones"], _PERFIL["directorio"]
+    top = int(opciones["top"])
+    base = os.path.join(directorio, tabla.replace(os.sep, "_"))
+    salida = io.StringIO()
+    resumen = {"reporte": base + ".txt"}
+
+    if _PERFIL["modo"] == "completo":
+        with _LOCK_PERFIL:
+            fuentes = _PERFIL["perfiles"].pop(tabla, []) + _PERFIL["archivos"].pop(tabla, [])
+        salida.write(f"Perfil de {tabla} (cProfile, {len(fuentes)} hilo(s)/proceso(s))\n")
+        if fuentes:
+            stats = pstats.Stats(*fuentes, stream=salida)
+            stats.dump_stats(base + ".prof")
+            stats.strip_dirs()
+            salida.write("\n== Funciones más calientes (tiempo propio) ==\n")
+            stats.sort_stats("tottime").print_stats(top)
+            salida.write("\n== Tiempo acumulado ==\n")
+            stats.sort_stats("cumulative").print_stats(top)
+            calientes = sorted(stats.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:5]
+            resumen["top"] = [f"{f[2]} ({f[0]}:{f[1]}) {v[2]:.3f}s" for f, v in calientes]
+        with _LOCK_PERFIL:
+            muestras = _PERFIL["muestras"].pop(tabla, {})
+        if muestras: # Python 3.12+: el tiempo de la tabla viene del muestreador
+            salida.write("\n")
+            top_muestras = _escribir_muestras(muestras, salida, base, resumen, opciones, top)
+            resumen.setdefault("top", top_muestras)
+
+        memoria = _PERFIL["memoria"].pop(tabla, None)
+        if memoria:
+            final = memoria["pico"] or tracemalloc.take_snapshot()
+            filtro = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            diferencias = final.filter_traces(filtro).compare_to(memoria["inicio"].filter_traces(filtro), "lineno")
+            diferencias = [d for d in diferencias if d.size_diff > 0][:top]
+            pico = memoria["bytes_pico"] - memoria["bytes_inicio"]
+            salida.write(f"\n== Mayores sitios de asignación (tracemalloc, pico de la tabla: {max(pico, 0) / 1024:,.0f} KiB) ==\n")
+            for d in diferencias:
+                marco = d.traceback[0]
+                salida.write(f"{d.size_diff / 1024:>12,.1f} KiB {d.count_diff:>9,} bloques  {marco.filename}:{marco.lineno}\n")
+            resumen["memoria_pico_kib"] = round(max(pico, 0) / 1024, 1)
+    else:
+        with _LOCK_PERFIL:
+            muestras = _PERFIL["muestras"].pop(tabla, {})
+        resumen["top"] = _escribir_muestras(muestras, salida, base, resumen, opciones, top, f" de {tabla}")
+
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write(salida.getvalue())
+    with _LOCK_PERFIL:
+        _PERFIL["resumenes"][tabla] = resumen
+    return resumen
+
+def _escribir_muestras(muestras, salida, base, resumen, opciones, top, titulo=""):
+    """Secciones de tiempo propio/inclusivo de las pilas muestreadas y <tabla>.folded; devuelve el top 5"""
+    total = sum(muestras.values())
+    propio, inclusivo = {}, {}
+    for pila, n in muestras.items():
+        funciones = pila.split(";")
+        propio[funciones[-1]] = propio.get(funciones[-1], 0) + n
+        for funcion in set(funciones):
+            inclusivo[funcion] = inclusivo.get(funcion, 0) + n
+    intervalo = opciones["intervalo_ms"]
+    salida.write(f"Perfil por muestreo{titulo}: {total} muestras cada {intervalo} ms (~{total * intervalo / 1000:.1f}s de pared)\n")
+    for encabezado, conteo in (("Tiempo propio (cima de la pila)", propio), ("Tiempo inclusivo", inclusivo)):
+        salida.write(f"\n== {encabezado} ==\n")
+        for funcion, n in sorted(conteo.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+            salida.write(f"{100 * n / max(total, 1):6.1f}% {n:>8,}  {funcion}\n")
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        f.writelines(f"{pila} {n}\n" for pila, n in muestras.items())
+    resumen["muestras"] = total
+    return [f"{funcion} {100 * n / max(total, 1):.1f}%" for funcion, n in
+            sorted(propio.items(), key=lambda kv: kv[1], reverse=True)[:5]]
 
 # ### PUNTO 6: FUNCIONES AUXILIARES PARA REINTENTOS ###
-def conectar_con_reintentos(url):
-    """Intenta conectar N veces antes de fallar"""
-    for i in range(MAX_REINTENTOS):
+ETIQUETAS_REINTENTO = {"conexion": "Falla de conexión", "sql": "Error SQL", "batch": "Error Batch", "copy": "Error COPY"}
+
+def configurar_reintentos(opciones):
+    """Aplica la sección `reintentos` del YAML"""
+    REINTENTOS.update(opciones or {})
+
+def es_error_transitorio(error):
+    """True si reintentar tiene sentido (conexión, serialización, pooler); restricciones y sintaxis fallan de inmediato"""
+    codigo = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None) # psycopg2 / asyncpg
+    if codigo:
+        return codigo in SQLSTATE_TRANSITORIOS or codigo[:2] in SQLSTATE_TRANSITORIOS
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError, ConnectionError, TimeoutError)):
+        return True
+    texto = str(error).lower()
+    return any(m in texto for m in MENSAJES_TRANSITORIOS)
+
+def espera_reintento(intento):
+    """Segundos antes del reintento N (1, 2, ...): espera_base * 2^(N-1) con tope y jitter"""
+    tope = min(float(REINTENTOS["espera_max"]), float(REINTENTOS["espera_base"]) * 2 ** (intento - 1))
+    return random.uniform(tope / 2, tope) if REINTENTOS["jitter"] else tope
+
+def reintentar(operacion, funcion, antes_de_reintentar=None):
+    """Corre funcion() y reintenta solo los errores transitorios, con backoff exponencial"""
+    maximo = int(REINTENTOS["max_intentos"])
+    etiqueta = ETIQUETAS_REINTENTO.get(operacion, f"Error {operacion}")
+    intento = 0
+    while True:
         try:
-            return psycopg2.connect(url)
+            return funcion()
         except Exception as e:
-            print_log(f"   ⚠️  Falla de conexión (Intento {i+1}/{MAX_REINTENTOS}): {e}")
-            if i < MAX_REINTENTOS - 1:
-                time.sleep(TIEMPO_ESPERA)
-            else:
-                raise e # Si fallan todos, lanzamos el error real
+            intento += 1
+            if not es_error_transitorio(e):
+                print_log(f"   ⚠️  {etiqueta} permanente (no se reintenta): {e}")
+                raise
+            if intento >= maximo:
+                print_log(f"   ⚠️  {etiqueta} (Intento {intento}/{maximo}): {e}")
+                raise # Si fallan todos, lanzamos el error real
+            espera = espera_reintento(intento)
+            print_log(f"   ⚠️  {etiqueta} (Intento {intento}/{maximo}): {e} -> reintento en {espera:.2f}s")
+            contar_reintento(operacion)
+            time.sleep(espera)
+            if antes_de_reintentar is not None:
+                antes_de_reintentar()
+
+def conectar_con_reintentos(url):
+    """Intenta conectar N veces antes de fallar"""
+    return reintentar("conexion", lambda: psycopg2.connect(url))
 
 def ejecutar_sql_con_reintentos(cursor, sql, params=None):
-    """Intenta ejecutar SQL N veces ante errores operativos (Para comandos simples)"""
-    for i in range(MAX_REINTENTOS):
+    """Intenta ejecutar SQL N veces ante errores transitorios (Para comandos simples)"""
+    def ejecutar():
         try:
             cursor.execute(sql, params)
-            return # Éxito
-        except Exception as e:
+        except Exception:
             try: cursor.connection.rollback()
             except: pass
-            
-            print_log(f"   ⚠️  Error SQL (Intento {i+1}/{MAX_REINTENTOS}): {e}")
-            if i < MAX_REINTENTOS - 1:
-                time.sleep(TIEMPO_ESPERA)
-            else:
-                raise e # Fallo definitivo
+            raise
+    reintentar("sql", ejecutar)
+
+# ### NUEVO: RECONEXIÓN TRANSPARENTE DEL DESTINO ###
+# Cada conexión prestada recuerda de dónde salió (pool o URL). Si se cae a mitad de una carga, reconectar()
+# toma otra del mismo origen; quien la pidió sigue usando su variable y al final devolver_conexion()
+# regresa al pool la que esté vigente.
+_CONEXIONES = {} # id(conexión) -> {"origen": pool o URL, "original": id de la conexión prestada al principio}
+_REEMPLAZOS = {} # id original -> conexión que hoy la reemplaza
+_LOCK_CONEXIONES = threading.Lock()
+
+def registrar_conexion(conn, origen):
+    """Anota el origen (pool o URL) de una conexión para poder reemplazarla si se cae"""
+    with _LOCK_CONEXIONES:
+        _CONEXIONES[id(conn)] = {"origen": origen, "original": id(conn)}
+    return conn
+
+def conexion_vigente(conn):
+    """La conexión que hoy reemplaza a `conn` (ella misma si nunca se cayó)"""
+    with _LOCK_CONEXIONES:
+        original = _CONEXIONES.get(id(conn), {}).get("original", id(conn))
+        return _REEMPLAZOS.get(original, conn)
+
+def reconectar(conn):
+    """Cambia una conexión caída por otra del mismo origen y devuelve la nueva"""
+    with _LOCK_CONEXIONES:
+        info = _CONEXIONES.get(id(conn))
+        vigente = _REEMPLAZOS.get(info["original"], conn) if info else conn
+    if info is None:
+        raise psycopg2.InterfaceError("La conexión no tiene origen registrado: no se puede reconectar")
+    if vigente is not conn and not vigente.closed:
+        return vigente # Ya la reemplazó otra llamada
+    origen = info["origen"]
+    if isinstance(origen, str):
+        try: vigente.close()
+        except Exception: pass
+        nueva = conectar_con_reintentos(origen)
+    else:
+        origen.putconn(vigente, close=True)
+        nueva = reintentar("conexion", origen.getconn)
+    contar_reintento("reconexion")
+    print_log("   🔌 Conexión al destino perdida: se continúa con una nueva")
+    with _LOCK_CONEXIONES:
+        _CONEXIONES[id(nueva)] = {"origen": origen, "original": info["original"]}
+        _REEMPLAZOS[info["original"]] = nueva
+    return nueva
+
+def olvidar_conexion(conn):
+    """Saca del registro a `conn` y a sus reemplazos (los id() se reciclan) y devuelve la vigente"""
+    with _LOCK_CONEXIONES:
+        original = _CONEXIONES.get(id(conn), {}).get("original", id(conn))
+        vigente = _REEMPLAZOS.pop(original, conn)
+        for clave in [k for k, v in _CONEXIONES.items() if v["original"] == original]:
+            del _CONEXIONES[clave]
+    return vigente
+
+def devolver_conexion(pool_conexiones, conn):
+    """putconn de la conexión vigente (la prestada o la que la reemplazó)"""
+    pool_conexiones.putconn(olvidar_conexion(conn))
+
+def confirmar_con_reintentos(conn, operacion, enviar, segundos_commit=None):
+    """
+    Envía una unidad de carga (enviar(cursor)) y la confirma. Ante un error transitorio se revierte,
+    espera (backoff) y reintenta solo esa unidad, reconectando si la conexión se cayó. Devuelve la conexión vigente.
+    """
+    destino = [conexion_vigente(conn)]
+
+    def intentar():
+        try:
+            with destino[0].cursor() as cursor:
+                enviar(cursor)
+            t0 = time.perf_counter()
+            destino[0].commit()
+            if segundos_commit is not None:
+                segundos_commit[0] += time.perf_counter() - t0
+        except Exception:
+            try: destino[0].rollback()
+            except Exception: pass
+            raise
+
+    def reparar():
+        if destino[0].closed:
+            destino[0] = reconectar(destino[0])
+
+    reintentar(operacion, intentar, reparar)
+    return destino[0]
 
 # ### PUNTO 9: NUEVA FUNCIÓN PARA INSERTAR POR LOTES (BATCH) ###
-def ejecutar_batch_con_reintentos(cursor, sql, lista_datos):
-    """Ejecuta inserciones masivas de forma segura y eficiente (Batch)"""
+def enviar_values(cursor, sql, lista_datos):
+    """Inserción masiva con execute_values (un intento; los reintentos los maneja confirmar_con_reintentos)"""
     if not lista_datos: return # Si la lista está vacía, no hace nada
+    # CORRECCIÓN AQUÍ: Usamos execute_values (compatible con VALUES %s)
+    # Antes usabas execute_batch que es para otro formato y causaba el error de string formatting
+    from psycopg2 import extras # ### NUEVO: Bajo demanda (importarlo cuesta ~80 ms al arrancar) ###
+    extras.execute_values(cursor, sql, lista_datos, page_size=BATCH_SIZE)
 
-    for i in range(MAX_REINTENTOS):
-        try:
-            # CORRECCIÓN AQUÍ: Usamos execute_values (compatible con VALUES %s)
-            # Antes usabas execute_batch que es para otro formato y causaba el error de string formatting
-            extras.execute_values(cursor, sql, lista_datos, page_size=BATCH_SIZE)
-            return # Éxito
-        except Exception as e:
-            try: cursor.connection.rollback()
-            except: pass
-            
-            print_log(f"   ⚠️  Error Batch (Intento {i+1}/{MAX_REINTENTOS}): {e}")
-            if i < MAX_REINTENTOS - 1:
-                time.sleep(TIEMPO_ESPERA)
-            else:
-                raise e
+# ### NUEVO: MOTOR DE CARGA COPY (Alternativa a execute_values) ###
+# Los datos viajan como un flujo COPY ... FROM STDIN hacia una tabla temporal y luego
+# un solo INSERT ... SELECT ... ON CONFLICT los pasa a la tabla QA (mismas reglas de upsert).
+EPOCA_PG = datetime.date(2000, 1, 1) # Postgres cuenta fechas binarias desde el 2000-01-01
+CABECERA_COPY_BINARIO = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+
+def _texto_copy(valor):
+    """Escapa un valor para el formato text de COPY (NULL = \\N)"""
+    if valor is None: return "\\N"
+    texto = str(valor)
+    return texto.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def _numeric_binario(valor):
+    """Codifica un Decimal en el formato binario de NUMERIC (dígitos base 10000)"""
+    d = decimal.Decimal(valor)
+    if d.is_nan(): return struct.pack(">hhhh", 0, 0, 0xC000 - 0x10000, 0)
+    signo, digitos, exponente = d.as_tuple()
+    texto = "".join(map(str, digitos))
+    if exponente > 0:
+        texto += "0" * exponente
+        exponente = 0
+    escala = -exponente
+    largo_entero = len(texto) - escala
+    if largo_entero <= 0:
+        parte_entera, parte_decimal = "", "0" * (-largo_entero) + texto
+    else:
+        parte_entera, parte_decimal = texto[:largo_entero].lstrip("0"), texto[largo_entero:]
+    # Rellenamos a grupos de 4 dígitos (entero hacia la izquierda, decimales hacia la derecha)
+    parte_entera = parte_entera.zfill(-(-len(parte_entera) // 4) * 4) if parte_entera else ""
+    parte_decimal = parte_decimal.ljust(-(-len(parte_decimal) // 4) * 4, "0")
+    grupos = [int(parte_entera[i:i+4]) for i in range(0, len(parte_entera), 4)]
+    grupos += [int(parte_decimal[i:i+4]) for i in range(0, len(parte_decimal), 4)]
+    peso = len(parte_entera) // 4 - 1
+    while grupos and grupos[0] == 0:
+        grupos.pop(0)
+        peso -= 1
+    while grupos and grupos[-1] == 0:
+        grupos.pop()
+    if not grupos: peso = 0
+    return struct.pack(f">hhhh{len(grupos)}h", len(grupos), peso, 0x4000 if signo else 0, escala, *grupos)
+
+def _timestamp_binario(valor):
+    if valor.tzinfo is not None:
+        valor = valor.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    delta = valor - datetime.datetime(2000, 1, 1)
+    return struct.pack(">q", (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+# Tipo de Postgres -> función que devuelve los bytes del campo en formato binario
+CODIFICADORES_BINARIOS = {
+    "smallint": lambda v: struct.pack(">h", int(v)),
+    "integer": lambda v: struct.pack(">i", int(v)),
+    "bigint": lambda v: struct.pack(">q", int(v)),
+    "real": lambda v: struct.pack(">f", float(v)),
+    "double precision": lambda v: struct.pack(">d", float(v)),
+    "boolean": lambda v: struct.pack(">?", bool(v)),
+    "numeric": _numeric_binario,
+    "date": lambda v: struct.pack(">i", (v - EPOCA_PG).days),
+    "timestamp without time zone": _timestamp_binario,
+    "timestamp with time zone": _timestamp_binario,
+    "text": lambda v: str(v).encode("utf-8"),
+    "character varying": lambda v: str(v).encode("utf-8"),
+    "character": lambda v: str(v).encode("utf-8"),
+}
+
+def construir_buffer_copy(lista_datos, formato="text", tipos=None):
+    """Arma en memoria el flujo que consume COPY FROM STDIN (text o binary)"""
+    if formato == "binary":
+        codificadores = [CODIFICADORES_BINARIOS[t] for t in tipos]
+        buffer = io.BytesIO()
+        buffer.write(CABECERA_COPY_BINARIO)
+        cabecera_fila = struct.pack(">h", len(codificadores))
+        nulo = struct.pack(">i", -1)
+        for fila in lista_datos:
+            buffer.write(cabecera_fila)
+            for valor, codificar in zip(fila, codificadores):
+                if valor is None:
+                    buffer.write(nulo)
+                else:
+                    datos = codificar(valor)
+                    buffer.write(struct.pack(">i", len(datos)))
+                    buffer.write(datos)
+        buffer.write(struct.pack(">h", -1)) # Fin del flujo
+    else:
+        buffer = io.StringIO()
+        buffer.writelines("\t".join(map(_texto_copy, fila)) + "\n" for fila in lista_datos)
+    buffer.seek(0)
+    return buffer
+
+def enviar_copy(cursor, tabla_qa, columnas, lista_datos, conflicto, formato="text"):
+    """COPY a una tabla temporal y fusión set-based con INSERT ... SELECT ... ON CONFLICT (un intento)"""
+    if not lista_datos: return
+
+    # Siempre en pg_temp: el DROP nunca alcanza una tabla real del search_path (y acepta destinos esquema.tabla)
+    tabla_stg = identificador(f"pg_temp.etl_stg_{tabla_qa.split('.')[-1]}")
+    lista_columnas = sql.SQL(", ").join(map(sql.Identifier, columnas))
+
+    # ON COMMIT DROP: la tabla vive solo en esta transacción (compatible con el pooler de Supabase)
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(tabla_stg)) # Por si quedó una de un chunk anterior sin commit
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP").format(tabla_stg, identificador(tabla_qa)))
+
+    tipos = None
+    formato_final = formato
+    if formato == "binary":
+        cursor.execute(
+            "SELECT attname, format_type(atttypid, NULL) FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped",
+            (tabla_stg.as_string(cursor),))
+        tipos_stg = dict(cursor.fetchall())
+        tipos = [tipos_stg[c] for c in columnas]
+        faltantes = [t for t in tipos if t not in CODIFICADORES_BINARIOS]
+        if faltantes:
+            print_log(f"   ⚠️  COPY binario no soporta {faltantes}, se usa formato text")
+            formato_final = "text"
+
+    buffer = construir_buffer_copy(lista_datos, formato_final, tipos)
+    opciones = sql.SQL(" WITH (FORMAT binary)" if formato_final == "binary" else "")
+    cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN{}").format(tabla_stg, lista_columnas, opciones).as_string(cursor), buffer)
+
+    cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} {}").format(
+        identificador(tabla_qa), lista_columnas, lista_columnas, tabla_stg, sql.SQL(conflicto)))
 # --------------------------------------------------------------
 
 # --- FUNCIONES DE ENMASCARAMIENTO ---
 
+SALT_EMAIL = "SECRETO_CLASE_ABD" # Semilla para variar el hash
+
+# ### NUEVO: POOL PRECALCULADO DE NOMBRES Y TELÉFONOS (faker_name / preserve_format) ###
+# Faker tarda en arrancar y arma cada nombre en Python puro. Con el pool activo esas dos reglas solo
+# muestrean de listas generadas una vez con semilla y guardadas en pool_mascaras.bin:
+# "ETLPOOL1" + largos (uint32) + cabecera JSON + textos UTF-8 separados por \n + teléfonos como uint64.
+POOL_MASCARAS = {
+    "activo": False,     # Se enciende con pool_mascaras.activo (sin él: Faker valor por valor)
+    "semilla": 2024,     # Misma semilla (y versión de Faker) = mismo pool en cualquier máquina
+    "nombres": 2000,
+    "apellidos": 2000,
+    "telefonos": 50000,
+}
+MAGIA_POOL = b"ETLPOOL1"
+_POOL = {}                # Pool listo para muestrear en este proceso (se llena al primer uso)
+_LOCK_POOL = threading.Lock()
+
+def configurar_pool_mascaras(opciones):
+    """Aplica la sección `pool_mascaras` del YAML (el archivo se lee o se genera al primer uso)"""
+    with _LOCK_POOL:
+        previo = dict(POOL_MASCARAS)
+        POOL_MASCARAS.update(opciones or {})
+        if POOL_MASCARAS != previo:
+            _POOL.clear()
+
+def generar_pool_mascaras(semilla, n_nombres, n_apellidos, n_telefonos):
+    """Nombres, apellidos y teléfonos de 10 dígitos generados con Faker('es_MX') y la semilla dada"""
+    from faker import Faker
+    fk = Faker('es_MX') # Instancia propia: sembrarla no altera la compartida
+    fk.seed_instance(semilla)
+    rng = random.Random(semilla)
+    return {
+        "semilla": semilla,
+        "nombres": [fk.first_name() for _ in range(n_nombres)],
+        "apellidos": [fk.last_name() for _ in range(n_apellidos)],
+        "telefonos": array("Q", (rng.randrange(10 ** 10) for _ in range(n_telefonos))),
+    }
+
+def guardar_pool_mascaras(ruta, pool_mascaras):
+    cabecera = json.dumps({"semilla": pool_mascaras["semilla"], "nombres": len(pool_mascaras["nombres"]),
+                           "apellidos": len(pool_mascaras["apellidos"])}).encode()
+    textos = "\n".join(pool_mascaras["nombres"] + pool_mascaras["apellidos"]).encode("utf-8")
+    telefonos = array("Q", pool_mascaras["telefonos"])
+    if sys.byteorder == "big": telefonos.byteswap() # El archivo siempre es little-endian
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(MAGIA_POOL + struct.pack("<II", len(cabecera), len(textos)) + cabecera + textos)
+        telefonos.tofile(f)
+    os.replace(temporal, ruta) # Atómico: otro proceso nunca lee un pool a medias
+
+def leer_pool_mascaras(ruta):
+    """Lee pool_mascaras.bin; devuelve None si no existe o no es un pool válido"""
+    try:
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        if datos[:len(MAGIA_POOL)] != MAGIA_POOL: return None
+        largo_cabecera, largo_textos = struct.unpack_from("<II", datos, len(MAGIA_POOL))
+        inicio = len(MAGIA_POOL) + 8
+        cabecera = json.loads(datos[inicio:inicio + largo_cabecera])
+        inicio += largo_cabecera
+        textos = datos[inicio:inicio + largo_textos].decode("utf-8").split("\n")
+        telefonos = array("Q")
+        telefonos.frombytes(datos[inicio + largo_textos:])
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    if sys.byteorder == "big": telefonos.byteswap()
+    n = cabecera["nombres"]
+    return {"semilla": cabecera["semilla"], "nombres": textos[:n], "apellidos": textos[n:], "telefonos": telefonos}
+
+def obtener_pool_mascaras():
+    """Pool listo para muestrear (teléfonos ya formateados). Se regenera si falta o no coincide con la config"""
+    if _POOL: return _POOL
+    with _LOCK_POOL:
+        if _POOL: return _POOL
+        esperado = (POOL_MASCARAS["semilla"], int(POOL_MASCARAS["nombres"]), int(POOL_MASCARAS["apellidos"]), int(POOL_MASCARAS["telefonos"]))
+        pool_mascaras = leer_pool_mascaras(ARCHIVO_POOL_MASCARAS)
+        if pool_mascaras is None or (pool_mascaras["semilla"], len(pool_mascaras["nombres"]), len(pool_mascaras["apellidos"]),
+                                     len(pool_mascaras["telefonos"])) != esperado:
+            print_log(f"   🎲 Generando pool de máscaras (semilla {esperado[0]})...")
+            pool_mascaras = generar_pool_mascaras(*esperado)
+            guardar_pool_mascaras(ARCHIVO_POOL_MASCARAS, pool_mascaras)
+        telefonos = (format(t, "010d") for t in pool_mascaras["telefonos"])
+        _POOL.update(nombres=pool_mascaras["nombres"], apellidos=pool_mascaras["apellidos"],
+                     telefonos=[f"+52 ({n[:3]}) {n[3:6]}-{n[6:]}" for n in telefonos])
+    return _POOL
+
+def nombres_del_pool(cantidad):
+    """`cantidad` nombres completos (nombre + dos apellidos) muestreados del pool"""
+    pool_mascaras = obtener_pool_mascaras()
+    nombres = random.choices(pool_mascaras["nombres"], k=cantidad)
+    apellidos = random.choices(pool_mascaras["apellidos"], k=2 * cantidad)
+    return [f"{n} {a} {b}" for n, a, b in zip(nombres, apellidos[:cantidad], apellidos[cantidad:])]
+
 def mascara_hash_email(valor_original):
     """Convierte el email en un Hash SHA256 (Determinístico)"""
     if not valor_original: return None
-    salt = "SECRETO_CLASE_ABD" # Semilla para variar el hash
-    hash_object = hashlib.sha256((valor_original + salt).encode())
+    hash_object = hashlib.sha256((valor_original + SALT_EMAIL).encode())
     return f"{hash_object.hexdigest()[:12]}@dominio.com"
 
 def mascara_redaccion(valor_original):
@@ -123,13 +902,15 @@ def mascara_redaccion(valor_original):
 
 def mascara_sintetica_nombre(valor_original):
     """Genera un nombre falso aleatorio"""
-    return fake.name()
+    if POOL_MASCARAS["activo"]: return nombres_del_pool(1)[0]
+    return obtener_faker().name()
 
 def mascara_preservar_formato(valor_original):
     """Mantiene formato de teléfono pero cambia números"""
     if not valor_original: return None
+    if POOL_MASCARAS["activo"]: return random.choice(obtener_pool_mascaras()["telefonos"])
     # Generamos números al azar
-    nums = fake.numerify(text="##########") 
+    nums = obtener_faker().numerify(text="##########") 
     # Forzamos el formato +52 (XXX) ...
     return f"+52 ({nums[:3]}) {nums[3:6]}-{nums[6:]}"
 
@@ -141,12 +922,2308 @@ MAPPING_FUNCIONES = {
     "preserve_format": mascara_preservar_formato
 }
 
+# ### NUEVO: ENMASCARAMIENTO POR COLUMNA (VECTORIZADO) ###
+# Cada regla recibe la columna completa (lista, arreglo NumPy o pyarrow) y devuelve la columna enmascarada.
+# Las funciones de arriba (un valor a la vez) se conservan como capa de compatibilidad.
+
+def _como_lista(columna):
+    """Acepta list/tuple, numpy.ndarray o pyarrow.Array y devuelve una lista de Python"""
+    if hasattr(columna, "to_pylist"): return columna.to_pylist() # pyarrow
+    if hasattr(columna, "tolist"): return columna.tolist()       # numpy
+    return list(columna)
+
+def _digitos_aleatorios(cantidad, largo=10):
+    """Genera `cantidad` cadenas de `largo` dígitos de una sola vez (NumPy si está instalado)"""
+    np = obtener_numpy()
+    if np is not None:
+        numeros = np.random.default_rng().integers(0, 10 ** largo, size=cantidad, dtype=np.int64)
+        return np.char.zfill(numeros.astype(str), largo).tolist()
+    limite = 10 ** largo
+    formato = f"0{largo}d"
+    return [format(random.randrange(limite), formato) for _ in range(cantidad)]
+
+def mascara_hash_email_columna(columna):
+    sha256 = hashlib.sha256
+    return [f"{sha256((v + SALT_EMAIL).encode()).hexdigest()[:12]}@dominio.com" if v else None
+            for v in _como_lista(columna)]
+
+def mascara_redaccion_columna(columna):
+    return [None if not v else ("" if len(v) < 5 else "---" + v[-4:]) for v in _como_lista(columna)]
+
+def mascara_sintetica_nombre_columna(columna):
+    if POOL_MASCARAS["activo"]: return nombres_del_pool(len(columna))
+    nombre = obtener_faker().name
+    return [nombre() for _ in range(len(columna))]
+
+def mascara_preservar_formato_columna(columna):
+    valores = _como_lista(columna)
+    if POOL_MASCARAS["activo"]:
+        muestra = iter(random.choices(obtener_pool_mascaras()["telefonos"], k=len(valores)))
+        return [next(muestra) if v else None for v in valores]
+    digitos = iter(_digitos_aleatorios(sum(1 for v in valores if v)))
+    resultado = []
+    for v in valores:
+        if not v:
+            resultado.append(None)
+        else:
+            n = next(digitos)
+            resultado.append(f"+52 ({n[:3]}) {n[3:6]}-{n[6:]}")
+    return resultado
+
+MAPPING_FUNCIONES_COLUMNA = {
+    "hash_email": mascara_hash_email_columna,
+    "redact_last4": mascara_redaccion_columna,
+    "faker_name": mascara_sintetica_nombre_columna,
+    "preserve_format": mascara_preservar_formato_columna
+}
+
+# ### NUEVO: CACHÉ DETERMINÍSTICA DE MÁSCARAS (LRU en memoria + SQLite en disco) ###
+# Un valor repetido se enmascara una sola vez: primero se busca en la LRU del proceso, luego en
+# cache_mascaras.sqlite (indexado por un HMAC del valor original, nunca el valor en claro) y solo
+# los que faltan se calculan. Así faker_name da el mismo nombre falso en cada recarga.
+CACHE_MASCARAS = {
+    "activo": False,
+    "tamano_lru": 100000,
+    "disco": True,
+    "reglas": ["faker_name", "hash_email", "preserve_format"],
+    "clave": SALT_EMAIL,
+}
+_CACHE_LRU = OrderedDict()       # (regla, valor) -> máscara
+_CACHE_LOCK = threading.Lock()
+_CACHE_DB = None                 # Conexión SQLite (se abre al primer uso en cada proceso)
+
+def configurar_cache_mascaras(opciones):
+    """Aplica la sección `cache_mascaras` del YAML"""
+    global _CACHE_DB
+    CACHE_MASCARAS.update(opciones or {})
+    with _CACHE_LOCK:
+        while len(_CACHE_LRU) > int(CACHE_MASCARAS["tamano_lru"]):
+            _CACHE_LRU.popitem(last=False)
+        if _CACHE_DB is not None and not CACHE_MASCARAS["disco"]:
+            _CACHE_DB.close()
+            _CACHE_DB = None
+
+def _db_cache():
+    global _CACHE_DB
+    if _CACHE_DB is None:
+        _CACHE_DB = sqlite3.connect(ARCHIVO_CACHE_MASCARAS, timeout=30, check_same_thread=False)
+        _CACHE_DB.execute("CREATE TABLE IF NOT EXISTS mascaras (regla TEXT, llave TEXT, valor TEXT, PRIMARY KEY (regla, llave))")
+        _CACHE_DB.commit()
+    return _CACHE_DB
+
+def _llave_cache(valor):
+    """HMAC-SHA256 del valor original: lo que se guarda en disco no revela el dato real"""
+    return hmac.new(str(CACHE_MASCARAS["clave"]).encode(), str(valor).encode(), hashlib.sha256).hexdigest()
+
+def _enmascarar_con_cache(regla, valores, contadores):
+    """Enmascara una columna consultando LRU -> SQLite -> función real (solo para los faltantes)"""
+    resultado = [None] * len(valores)
+    pendientes = {} # valor -> posiciones que lo esperan
+    tamano = int(CACHE_MASCARAS["tamano_lru"])
+
+    with _CACHE_LOCK:
+        for i, v in enumerate(valores):
+            if v is None or v == "":
+                continue # Los vacíos no se guardan; se resuelven abajo con la regla normal
+            llave = (regla, v)
+            if llave in _CACHE_LRU:
+                _CACHE_LRU.move_to_end(llave)
+                resultado[i] = _CACHE_LRU[llave]
+                contadores["hits_memoria"] += 1
+            else:
+                pendientes.setdefault(v, []).append(i)
+
+    encontrados = {}
+    if pendientes and CACHE_MASCARAS["disco"]:
+        llaves = {_llave_cache(v): v for v in pendientes}
+        lista = list(llaves)
+        with _CACHE_LOCK:
+            db = _db_cache()
+            for k in range(0, len(lista), 500): # SQLite limita los parámetros por consulta
+                bloque = lista[k:k+500]
+                filas = db.execute(
+                    f"SELECT llave, valor FROM mascaras WHERE regla = ? AND llave IN ({','.join('?' * len(bloque))})",
+                    [regla] + bloque).fetchall()
+                for llave, mascara in filas:
+                    encontrados[llaves[llave]] = mascara
+        contadores["hits_disco"] += sum(len(pendientes[v]) for v in encontrados)
+
+    faltantes = [v for v in pendientes if v not in encontrados]
+    nuevos = dict(zip(faltantes, MAPPING_FUNCIONES_COLUMNA[regla](faltantes))) if faltantes else {}
+    contadores["misses"] += len(faltantes)
+    contadores["hits_memoria"] += sum(len(pendientes[v]) - 1 for v in faltantes) # Repetidos dentro del chunk
+
+    with _CACHE_LOCK:
+        if nuevos and CACHE_MASCARAS["disco"]:
+            db = _db_cache()
+            db.executemany("INSERT OR IGNORE INTO mascaras (regla, llave, valor) VALUES (?, ?, ?)",
+                           [(regla, _llave_cache(v), m) for v, m in nuevos.items()])
+            db.commit()
+        for origen in (encontrados, nuevos):
+            for v, mascara in origen.items():
+                _CACHE_LRU[(regla, v)] = mascara
+                for i in pendientes[v]:
+                    resultado[i] = mascara
+        while len(_CACHE_LRU) > tamano:
+            _CACHE_LRU.popitem(last=False)
+
+    # Vacíos/nulos: misma salida que la regla sin caché
+    vacios = [i for i, v in enumerate(valores) if v is None or v == ""]
+    if vacios:
+        for i, mascara in zip(vacios, MAPPING_FUNCIONES_COLUMNA[regla]([valores[i] for i in vacios])):
+            resultado[i] = mascara
+    return resultado
+
+def nuevos_contadores_cache():
+    return {"hits_memoria": 0, "hits_disco": 0, "misses": 0}
+
+def enmascarar_columna(regla, columna, contadores=None):
+    """API por lotes: aplica una regla del YAML a una columna completa"""
+    if CACHE_MASCARAS["activo"] and regla in CACHE_MASCARAS["reglas"] and regla in MAPPING_FUNCIONES_COLUMNA:
+        return _enmascarar_con_cache(regla, _como_lista(columna),
+                                     contadores if contadores is not None else nuevos_contadores_cache())
+    if regla in MAPPING_FUNCIONES_COLUMNA:
+        return MAPPING_FUNCIONES_COLUMNA[regla](columna)
+    funcion = MAPPING_FUNCIONES[regla] # Reglas sin versión vectorizada: valor por valor
+    return [funcion(v) for v in _como_lista(columna)]
+
+# --- FUNCIONES DE EXTRACCIÓN / TRANSFORMACIÓN / CARGA POR CHUNKS ---
+# ### NUEVO: Streaming con cursores del lado del servidor (memoria acotada) ###
+
+def extraer_en_chunks(conn, sql, nombre_tabla, chunk_size=CHUNK_SIZE, streaming=True):
+    """Genera (columnas, filas) por bloques de `chunk_size` usando un cursor con nombre (server-side)"""
+    if not streaming:
+        # Modo clásico: todo el resultado en memoria (un solo chunk)
+        cursor = conn.cursor()
+        try:
+            ejecutar_sql_con_reintentos(cursor, sql)
+            columnas = [desc[0] for desc in cursor.description]
+            yield columnas, cursor.fetchall()
+        finally:
+            cursor.close()
+        return
+
+    # Un cursor con nombre hace DECLARE ... CURSOR en Postgres: el servidor guarda el resultado
+    # y nosotros solo traemos `chunk_size` filas por viaje.
+    cursor = conn.cursor(name=f"etl_{nombre_tabla}_{uuid.uuid4().hex[:8]}")
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(sql)
+        while True:
+            filas = cursor.fetchmany(chunk_size)
+            if not filas: break
+            columnas = [desc[0] for desc in cursor.description]
+            yield columnas, filas
+    finally:
+        # Cerramos el cursor y la transacción de lectura que lo mantenía vivo (también si se corta a medias)
+        try:
+            cursor.close()
+            conn.rollback()
+        except: pass
+
+# ### NUEVO: MARCAS DE AGUA DE CUALQUIER TIPO (entero, timestamp o compuesta) ###
+# Durante la ejecución la marca es el valor nativo (int, Decimal, datetime o tupla) y así se compara;
+# solo al guardarla en state.json pasa a forma JSON: fechas en ISO 8601, Decimal como texto, compuestas como lista.
+def marca_json(valor):
+    """Convierte un valor de la(s) columna(s) incremental(es) a su forma en state.json"""
+    if isinstance(valor, (list, tuple)): return [marca_json(v) for v in valor]
+    if isinstance(valor, (datetime.date, datetime.datetime)): return valor.isoformat()
+    if isinstance(valor, decimal.Decimal): return int(valor) if valor == valor.to_integral_value() else str(valor)
+    return valor
+
+def _marca_como(valor, referencia):
+    """Lleva una marca leída de state.json (forma JSON) al tipo nativo de `referencia` para compararlas"""
+    if isinstance(referencia, tuple) and isinstance(valor, (list, tuple)):
+        return tuple(_marca_como(v, r) for v, r in zip(valor, referencia))
+    if isinstance(valor, str):
+        if isinstance(referencia, datetime.datetime): return datetime.datetime.fromisoformat(valor)
+        if isinstance(referencia, datetime.date): return datetime.date.fromisoformat(valor)
+        if isinstance(referencia, decimal.Decimal): return decimal.Decimal(valor)
+    return valor
+
+def _forma_marca(valor):
+    return len(valor) if isinstance(valor, (list, tuple)) else 1
+
+def mayor_marca(a, b):
+    """
+    La mayor de dos marcas de agua (0/None = sin marca todavía). `b` es la nueva; `a` puede venir de
+    state.json. Si no tienen la misma forma (cambió columna_incremental) gana la nueva.
+    """
+    if a is None or a == 0: return b
+    if b is None or b == 0: return a
+    if _forma_marca(a) != _forma_marca(b): return b
+    a, b = _marca_como(a, b), _marca_como(b, a)
+    return b if b > a else a
+
+def validar_marca_guardada(estado, tabla_info):
+    """Reinicia la marca de state.json si ya no tiene la forma de columna_incremental (p. ej. id -> [updated_at, id])"""
+    nombre_tabla = tabla_info['nombre']
+    valor = estado.get(nombre_tabla, 0)
+    claves = columnas_marca(tabla_info)
+    if valor in (0, None) or _forma_marca(valor) == len(claves) and isinstance(valor, list) == (len(claves) > 1):
+        return valor
+    print_log(f"   ⚠️ La marca guardada {valor!r} no corresponde a columna_incremental {claves}: se lee desde el principio")
+    with _LOCK_ESTADO:
+        estado[nombre_tabla] = 0
+    return 0
+
+def columnas_marca(tabla_info):
+    """`columna_incremental` como lista: "id" -> ["id"], ["updated_at", "id"] se queda igual"""
+    col = tabla_info.get('columna_incremental', 'id')
+    return list(col) if isinstance(col, (list, tuple)) else [col]
+
+# ### NUEVO: PLAN DE FILA (una vez por tabla) ###
+# Con las columnas del primer chunk se resuelven los índices de las columnas enmascaradas, de la marca de agua
+# y de la proyección de carga. Cada chunk sale directo como las tuplas que espera el destino (una tupla por fila),
+# sin reconstruir las filas de origen y volver a proyectarlas en cargar_lote.
+def compilar_plan_fila(columnas, reglas, col_inc, plan_carga=None):
+    """Precalcula máscaras, marca de agua y proyección de carga para transformar los chunks de una tabla"""
+    claves = col_inc if isinstance(col_inc, (list, tuple)) else [col_inc]
+    indices = list(plan_carga["indices"]) if plan_carga else list(range(len(columnas)))
+    marca = [columnas.index(c) for c in claves] if all(c in columnas for c in claves) else None
+    return {
+        "mascaras": [(columnas.index(c), regla) for c, regla in reglas.items() if regla in MAPPING_FUNCIONES and c in columnas],
+        # itemgetter con varios índices devuelve la tupla (marca compuesta), con uno solo el valor
+        "marca": itemgetter(*marca) if marca else None,
+        "marca_compuesta": bool(marca) and len(marca) > 1,
+        "indices": indices,
+        "extra": plan_carga["extra"] if plan_carga else (),
+        "identidad": indices == list(range(len(columnas))), # La proyección no reordena ni descarta columnas
+        "proyectada": plan_carga is not None,
+    }
+
+def aplicar_plan_fila(plan_fila, filas, max_id_lote, contadores_cache=None, segundos_por_regla=None):
+    """Transforma un chunk con un plan de fila y devuelve (filas_para_cargar, nuevo_max_id)"""
+    if not filas: return [], max_id_lote
+
+    # ### NUEVO: Actualizar el "watermark" (marca de agua) con una sola pasada sobre su(s) columna(s) ###
+    if plan_fila["marca"] is not None:
+        valores = map(plan_fila["marca"], filas)
+        if plan_fila["marca_compuesta"]: # p. ej. (updated_at, id): se compara como tupla, igual que en Postgres
+            max_chunk = max((t for t in valores if None not in t), default=None)
+        else:
+            max_chunk = max((v for v in valores if v is not None), default=None)
+        if max_chunk is not None:
+            max_id_lote = mayor_marca(max_id_lote, max_chunk)
+    # -----------------------------------------------------
+
+    indices, extra = plan_fila["indices"], plan_fila["extra"]
+    if not plan_fila["mascaras"] and plan_fila["identidad"]:
+        # Nada que enmascarar ni reordenar: las filas de origen ya sirven (solo se agrega el lote)
+        return ([f + extra for f in filas] if extra else filas), max_id_lote
+
+    # ### NUEVO: Transformación por columnas ###
+    # Transponemos el chunk una vez (zip en C), enmascaramos columnas completas y armamos
+    # las filas de carga en el orden del destino con un solo zip (las constantes van con repeat).
+    datos = list(zip(*filas))
+    for idx, regla in plan_fila["mascaras"]:
+        t0 = time.perf_counter()
+        datos[idx] = enmascarar_columna(regla, datos[idx], contadores_cache)
+        if segundos_por_regla is not None: # ### NUEVO: Métricas por regla ###
+            segundos_por_regla[regla] = segundos_por_regla.get(regla, 0.0) + time.perf_counter() - t0
+
+    n = len(filas)
+    return list(zip(*[datos[i] for i in indices], *[repeat(v, n) for v in extra])), max_id_lote
+
+def transformar_lote(columnas, filas, reglas, col_inc, max_id_lote, contadores_cache=None, segundos_por_regla=None):
+    """Aplica las reglas de enmascaramiento a un chunk y devuelve (filas_enmascaradas, nuevo_max_id)"""
+    return aplicar_plan_fila(compilar_plan_fila(columnas, reglas, col_inc), filas, max_id_lote,
+                             contadores_cache, segundos_por_regla)
+
+# ### NUEVO: CARGADOR GENÉRICO CON PLANES PRECOMPILADOS ###
+# Las columnas y la llave primaria de cada tabla QA se leen UNA vez de information_schema
+# y se guardan en memoria y en disco (planes_carga.json), indexadas por versión de esquema.
+_PLANES_CARGA = {} # Caché en memoria: "tabla@version" -> {"columnas": [...], "llave": [...]}
+
+SQL_COLUMNAS_DESTINO = """
+    SELECT column_name FROM information_schema.columns
+    WHERE table_schema = coalesce(%s, current_schema()) AND table_name = %s
+    ORDER BY ordinal_position
+"""
+SQL_LLAVE_DESTINO = """
+    SELECT kcu.column_name
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+      ON kcu.constraint_name = tc.constraint_name AND kcu.table_schema = tc.table_schema
+    WHERE tc.table_schema = coalesce(%s, current_schema()) AND tc.table_name = %s AND tc.constraint_type = 'PRIMARY KEY'
+    ORDER BY kcu.ordinal_position
+"""
+
+def _cargar_planes_disco():
+    if os.path.exists(ARCHIVO_PLANES):
+        try:
+            with open(ARCHIVO_PLANES, "r") as f: return json.load(f)
+        except: pass # Si está corrupto, lo regeneramos
+    return {}
+
+def obtener_plan_carga(cursor, tabla_qa, version_esquema):
+    """Devuelve columnas y llave primaria de la tabla destino (memoria -> disco -> information_schema)"""
+    clave = f"{tabla_qa}@{version_esquema}"
+    if clave in _PLANES_CARGA:
+        return _PLANES_CARGA[clave]
+
+    with _LOCK_PLANES: # Varios hilos pueden pedir planes a la vez (planes_carga.json es compartido)
+        return _obtener_plan_carga_sin_cache(cursor, tabla_qa, clave, version_esquema)
+
+def _obtener_plan_carga_sin_cache(cursor, tabla_qa, clave, version_esquema):
+    if clave in _PLANES_CARGA: # Otro hilo pudo llenarlo mientras esperábamos el lock
+        return _PLANES_CARGA[clave]
+
+    planes_disco = _cargar_planes_disco()
+    if clave in planes_disco:
+        _PLANES_CARGA[clave] = planes_disco[clave]
+        return planes_disco[clave]
+
+    print_log(f"   🔎 Introspección de {tabla_qa} (versión de esquema {version_esquema})...")
+    ejecutar_sql_con_reintentos(cursor, SQL_COLUMNAS_DESTINO, partes_tabla(tabla_qa))
+    columnas = [r[0] for r in cursor.fetchall()]
+    if not columnas:
+        raise Exception(f"La tabla destino '{tabla_qa}' no existe")
+
+    ejecutar_sql_con_reintentos(cursor, SQL_LLAVE_DESTINO, partes_tabla(tabla_qa))
+    llave = [r[0] for r in cursor.fetchall()]
+    cursor.connection.commit() # Cerramos la transacción de solo lectura
+
+    return registrar_plan_carga(clave, {"columnas": columnas, "llave": llave})
+
+def registrar_plan_carga(clave, plan):
+    """Guarda un plan recién leído en la caché de memoria y en planes_carga.json"""
+    _PLANES_CARGA[clave] = plan
+    planes_disco = _cargar_planes_disco()
+    planes_disco[clave] = plan
+    temporal = f"{ARCHIVO_PLANES}.{os.getpid()}.tmp" # Atómico, como state.json (uno por proceso: los rangos también escriben)
+    with open(temporal, "w") as f:
+        json.dump(planes_disco, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ARCHIVO_PLANES)
+    return plan
+
+def compilar_plan_carga(cursor, tabla_info, columnas_origen, execution_id, version_esquema):
+    """Precalcula la proyección (índices de columnas) y el SQL de carga para una tabla"""
+    tabla_qa = tabla_info.get('tabla_destino', f"{tabla_info['nombre']}_qa")
+    plan = obtener_plan_carga(cursor, tabla_qa, version_esquema)
+    return armar_plan_carga(plan, tabla_info, tabla_qa, columnas_origen, execution_id)
+
+def armar_plan_carga(plan, tabla_info, tabla_qa, columnas_origen, execution_id):
+    """Parte pura de compilar_plan_carga (sin BD): también la usa el motor asíncrono"""
+    # Columnas destino que vienen del origen (en el orden del destino) + el lote de la ejecución
+    columnas_qa = [c for c in plan["columnas"] if c in columnas_origen]
+    indices = [columnas_origen.index(c) for c in columnas_qa]
+    con_batch_id = "etl_batch_id" in plan["columnas"] and "etl_batch_id" not in columnas_origen
+    if con_batch_id:
+        columnas_qa.append("etl_batch_id")
+
+    # ### PUNTO 9: Mismas reglas de conflicto que antes (clientes = upsert, el resto = DO NOTHING) ###
+    llave = plan["llave"]
+    conflicto = ""
+    if llave:
+        actualizables = [c for c in columnas_qa if c not in llave]
+        if tabla_info.get('conflicto', 'ignorar') == "actualizar" and actualizables:
+            sets = ", ".join(f"{c} = EXCLUDED.{c}" for c in actualizables)
+            conflicto = f"ON CONFLICT ({', '.join(llave)}) DO UPDATE SET {sets}"
+        else:
+            conflicto = f"ON CONFLICT ({', '.join(llave)}) DO NOTHING"
+
+    return {
+        "tabla_qa": tabla_qa,
+        "columnas": columnas_qa,
+        "indices": indices,
+        "extra": (execution_id,) if con_batch_id else (),
+        "conflicto": conflicto,
+        "sql_values": f"INSERT INTO {tabla_qa} ({', '.join(columnas_qa)}) VALUES %s {conflicto};",
+    }
+
+# ### PUNTO 9: INSERCIÓN POR LOTES (BATCH) ###
+def cargar_lote(conn, plan, filas_enmascaradas, motor="values", formato_copy="text", proyectadas=False,
+                filas_por_pagina=None, segundos_commit=None):
+    """
+    Inserta y confirma un chunk ya enmascarado usando el plan precompilado. Devuelve cuántas filas envió.
+    Con llave (ON CONFLICT) el chunk se confirma por páginas: si una falla, solo esa se reintenta.
+    `conn` no debe tener trabajo pendiente: cada página es su propia transacción.
+    """
+    print_log(f"   -> Preparando lote de {len(filas_enmascaradas)} registros para {plan['tabla_qa']}... ({'COPY' if motor == 'copy' else 'Batch'})")
+    if not filas_enmascaradas: return 0
+
+    # Lista de tuplas para batch: proyección por índices precalculados
+    # (proyectadas=True: las filas ya vienen de aplicar_plan_fila en el orden del destino)
+    if proyectadas:
+        datos_batch = filas_enmascaradas
+    else:
+        indices, extra = plan["indices"], plan["extra"]
+        datos_batch = [tuple([f[i] for i in indices]) + extra for f in filas_enmascaradas]
+
+    if motor == "copy":
+        # ### NUEVO: COPY a tabla temporal + INSERT ... SELECT ... ON CONFLICT ###
+        operacion = "copy"
+        enviar = lambda cursor, pagina: enviar_copy(cursor, plan["tabla_qa"], plan["columnas"], pagina, plan["conflicto"], formato_copy)
+    else:
+        # Usamos execute_values para máxima velocidad en Postgres
+        operacion = "batch"
+        enviar = lambda cursor, pagina: enviar_values(cursor, plan["sql_values"], pagina)
+
+    # ### NUEVO: Unidad de reintento = página ###
+    # Solo se parte el chunk si recargar una página es idempotente (ON CONFLICT); sin llave, reintentar
+    # una página ya confirmada duplicaría filas, así que el chunk entero sigue siendo una sola transacción.
+    paso = len(datos_batch)
+    if plan["conflicto"]:
+        paso = int(filas_por_pagina or (BATCH_SIZE if motor != "copy" else paso)) or paso
+    for inicio in range(0, len(datos_batch), paso):
+        pagina = datos_batch[inicio:inicio + paso]
+        conn = confirmar_con_reintentos(conn, operacion, lambda cursor: enviar(cursor, pagina), segundos_commit)
+
+    return len(datos_batch)
+# --------------------------------------------------------------
+
+def opciones_tabla(tabla_info, rendimiento):
+    """Parámetros de rendimiento de una tabla (lo del YAML de la tabla gana sobre `rendimiento`)"""
+    return {
+        # ### NUEVO: Streaming por chunks ###
+        "streaming": tabla_info.get('streaming', rendimiento.get('streaming', True)),
+        "chunk_size": int(tabla_info.get('chunk_size', rendimiento.get('chunk_size', CHUNK_SIZE))),
+        # ### NUEVO: Motor de carga ("values" = execute_values, "copy" = COPY FROM STDIN) ###
+        "motor_carga": tabla_info.get('motor_carga', rendimiento.get('motor_carga', 'values')),
+        "formato_copy": tabla_info.get('formato_copy', rendimiento.get('formato_copy', 'text')),
+        # ### NUEVO: Tubería lector -> enmascaradores -> escritor ###
+        "pipeline": tabla_info.get('pipeline', rendimiento.get('pipeline', False)),
+        "trabajadores_mascara": tabla_info.get('trabajadores_mascara', rendimiento.get('trabajadores_mascara', 2)),
+        "profundidad_cola": tabla_info.get('profundidad_cola', rendimiento.get('profundidad_cola', 4)),
+        # ### NUEVO: Guardar la marca de agua cada N chunks confirmados (0 = solo al final de la tabla) ###
+        "checkpoint_chunks": int(tabla_info.get('checkpoint_chunks', rendimiento.get('checkpoint_chunks', 1))),
+        # ### NUEVO: Filas por commit dentro de un chunk (unidad de reintento; None = BATCH_SIZE / chunk completo en COPY) ###
+        "filas_por_pagina": tabla_info.get('filas_por_pagina', rendimiento.get('filas_por_pagina')),
+    }
+
+def registrar_lote(metricas, t_inicio, t_commit, filas_enviadas):
+    """Métricas de un lote confirmado: carga (inicio -> commit), commit y latencia total del lote"""
+    fin = time.perf_counter()
+    metricas["segundos"]["carga"] += t_commit - t_inicio
+    metricas["segundos"]["commit"] += fin - t_commit
+    observar(metricas["latencia_lote"], fin - t_inicio)
+    metricas["lotes"] += 1
+    metricas["bytes_enviados"] += bytes_aprox(filas_enviadas)
+    capturar_pico_memoria() # ### NUEVO: --profile completo (el chunk y su versión enmascarada siguen vivos aquí) ###
+
+def migrar_consulta(conn_source, conn_target, tabla_info, sql_final, contexto, stats_tabla, max_id_lote):
+    """Extrae `sql_final` por chunks, lo enmascara y lo carga. Acumula en stats_tabla y devuelve el nuevo watermark"""
+    nombre_tabla = tabla_info['nombre']
+    reglas = tabla_info['columnas_enmascarar']
+    col_inc = tabla_info.get('columna_incremental', 'id')
+    opciones = opciones_tabla(tabla_info, contexto["rendimiento"])
+    if opciones["pipeline"]:
+        return migrar_consulta_pipeline(conn_source, conn_target, tabla_info, sql_final, contexto, stats_tabla, max_id_lote)
+
+    conn_target = conexion_vigente(conn_target) # ### NUEVO: Pudo reconectarse en una llamada anterior (CDC, diff) ###
+    cursor_target = conn_target.cursor()
+    plan_carga = None # ### NUEVO: Se compila con las columnas del primer chunk ###
+    plan_fila = None  # ### NUEVO: Plan de fila (índices de máscaras, marca y proyección), también una vez ###
+    chunks_confirmados = 0
+    metricas = stats_tabla["metricas"]
+    segundos = metricas["segundos"]
+
+    # ### NUEVO: EXTRACT -> TRANSFORM -> LOAD POR CHUNKS ###
+    # Cada bloque se enmascara y se carga (commit) antes de pedir el siguiente,
+    # así la memoria queda acotada a `chunk_size` filas sin importar el tamaño de la tabla.
+    try:
+        t_extraccion = time.perf_counter()
+        for columnas, filas in extraer_en_chunks(conn_source, sql_final, nombre_tabla, opciones["chunk_size"], opciones["streaming"]):
+            segundos["extraccion"] += time.perf_counter() - t_extraccion
+            # ### PUNTO 5: Registrar conteo de lectura ###
+            stats_tabla["registros_leidos"] += len(filas)
+            metricas["bytes_leidos"] += bytes_aprox(filas)
+            # ------------------------------------------
+
+            if plan_fila is None:
+                try:
+                    plan_carga = compilar_plan_carga(cursor_target, tabla_info, columnas, contexto["execution_id"], contexto["version_esquema"])
+                except Exception as e:
+                    print_log(f"   ❌ Error insertando lote (Batch): {e}")
+                    stats_tabla["errores"].append(str(e))
+                    break
+                plan_fila = compilar_plan_fila(columnas, reglas, col_inc, plan_carga)
+
+            # Transformar datos (Transform): sale con la forma de la tabla destino
+            t0 = time.perf_counter()
+            filas_enmascaradas, max_chunk = aplicar_plan_fila(plan_fila, filas, max_id_lote,
+                                                              stats_tabla.get("cache_mascaras"), metricas["segundos_por_regla"])
+            segundos["transformacion"] += time.perf_counter() - t0
+
+            # Cargar datos (Load)
+            try:
+                t0 = time.perf_counter()
+                commit = [0.0]
+                stats_tabla["registros_insertados"] += cargar_lote(conn_target, plan_carga, filas_enmascaradas,
+                                                                   opciones["motor_carga"], opciones["formato_copy"], proyectadas=True,
+                                                                   filas_por_pagina=opciones["filas_por_pagina"], segundos_commit=commit)
+                registrar_lote(metricas, t0, time.perf_counter() - commit[0], filas_enmascaradas)
+                stats_tabla["segundos_carga"] += time.perf_counter() - t0
+            except Exception as e:
+                print_log(f"   ❌ Error insertando lote (Batch): {e}")
+                stats_tabla["errores"].append(str(e))
+                break # No seguimos leyendo si el destino falló
+
+            max_id_lote = max_chunk # Solo avanzamos la marca de agua con chunks ya confirmados
+            chunks_confirmados += 1
+            checkpoint_chunk(contexto.get("estado"), stats_tabla, max_id_lote, chunks_confirmados, opciones["checkpoint_chunks"])
+            if opciones["streaming"]:
+                print_log(f"   📦 Chunk procesado: {len(filas)} registros (acumulado: {stats_tabla['registros_leidos']})")
+            t_extraccion = time.perf_counter()
+    finally:
+        cursor_target.close()
+
+    return max_id_lote
+
+# ### NUEVO: EJECUCIÓN EN TUBERÍA (Lector -> Enmascaradores -> Escritor) ###
+# Mientras el escritor carga el chunk N, los enmascaradores trabajan el N+1 y el lector ya pide el N+2.
+# Un semáforo limita los chunks "en vuelo" (backpressure): la memoria queda acotada aunque una etapa sea lenta.
+def migrar_consulta_pipeline(conn_source, conn_target, tabla_info, sql_final, contexto, stats_tabla, max_id_lote):
+    """Igual que migrar_consulta pero con las tres etapas en hilos conectados por colas acotadas"""
+    nombre_tabla = tabla_info['nombre']
+    reglas = tabla_info['columnas_enmascarar']
+    col_inc = tabla_info.get('columna_incremental', 'id')
+    opciones = opciones_tabla(tabla_info, contexto["rendimiento"])
+    n_trabajadores = max(1, int(opciones["trabajadores_mascara"]))
+    profundidad = max(1, int(opciones["profundidad_cola"]))
+
+    q_extraidos = queue.Queue(maxsize=profundidad)
+    q_enmascarados = queue.Queue(maxsize=profundidad)
+    en_vuelo = threading.Semaphore(profundidad + n_trabajadores) # Chunks leídos y aún no confirmados
+    cancelar = threading.Event()
+    errores_etapa = {}
+    FIN = object()
+
+    # Cada hilo lleva sus propios tiempos [ocupado, espera] para no competir por el mismo contador
+    t_lector = [0.0, 0.0]
+    t_enmascaradores = [[0.0, 0.0] for _ in range(n_trabajadores)]
+    t_escritor = [0.0, 0.0]
+    contadores_trabajadores = [nuevos_contadores_cache() for _ in range(n_trabajadores)]
+    reglas_trabajadores = [{} for _ in range(n_trabajadores)] # ### NUEVO: Segundos por regla de cada enmascarador ###
+    bytes_leidos = [0]
+    metricas = stats_tabla["metricas"]
+
+    # ### NUEVO: El destino se lee antes de arrancar los hilos: cada enmascarador arma su plan de fila ###
+    tabla_qa = tabla_info.get('tabla_destino', f"{nombre_tabla}_qa")
+    conn_target = conexion_vigente(conn_target)
+    cursor_target = conn_target.cursor()
+    try:
+        plan_destino = obtener_plan_carga(cursor_target, tabla_qa, contexto["version_esquema"])
+    except Exception as e:
+        cursor_target.close()
+        print_log(f"   ❌ Error insertando lote (Batch): {e}")
+        stats_tabla["errores"].append(str(e))
+        return max_id_lote
+
+    def poner(cola, item, tiempos):
+        t0 = time.perf_counter()
+        while not cancelar.is_set():
+            try:
+                cola.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        tiempos[1] += time.perf_counter() - t0
+        return not cancelar.is_set()
+
+    def tomar(cola, tiempos):
+        t0 = time.perf_counter()
+        item = None
+        while not cancelar.is_set():
+            try:
+                item = cola.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        tiempos[1] += time.perf_counter() - t0
+        return item
+
+    def lector():
+        with perfilar_tabla(nombre_tabla, principal=False): # ### NUEVO: --profile ###
+            _lector()
+
+    def _lector():
+        try:
+            seq = 0
+            t0 = time.perf_counter()
+            for columnas, filas in extraer_en_chunks(conn_source, sql_final, nombre_tabla, opciones["chunk_size"], opciones["streaming"]):
+                t_lector[0] += time.perf_counter() - t0
+                bytes_leidos[0] += bytes_aprox(filas)
+                t0 = time.perf_counter()
+                while not en_vuelo.acquire(timeout=0.1): # Backpressure: esperamos a que el escritor confirme
+                    if cancelar.is_set(): return
+                t_lector[1] += time.perf_counter() - t0
+                if not poner(q_extraidos, (seq, columnas, filas), t_lector): return
+                seq += 1
+                t0 = time.perf_counter()
+        except Exception as e:
+            errores_etapa["lector"] = e
+            cancelar.set()
+        finally:
+            for _ in range(n_trabajadores):
+                poner(q_extraidos, FIN, t_lector)
+
+    def enmascarador(tiempos, contadores, segundos_por_regla):
+        with perfilar_tabla(nombre_tabla, principal=False): # ### NUEVO: --profile ###
+            _enmascarador(tiempos, contadores, segundos_por_regla)
+
+    def _enmascarador(tiempos, contadores, segundos_por_regla):
+        plan_carga = plan_fila = None
+        try:
+            while True:
+                item = tomar(q_extraidos, tiempos)
+                if item is None or item is FIN: break
+                seq, columnas, filas = item
+                t0 = time.perf_counter()
+                if plan_fila is None:
+                    plan_carga = armar_plan_carga(plan_destino, tabla_info, tabla_qa, columnas, contexto["execution_id"])
+                    plan_fila = compilar_plan_fila(columnas, reglas, col_inc, plan_carga)
+                filas_enmascaradas, max_chunk = aplicar_plan_fila(plan_fila, filas, max_id_lote, contadores, segundos_por_regla)
+                tiempos[0] += time.perf_counter() - t0
+                if not poner(q_enmascarados, (seq, plan_carga, filas_enmascaradas, max_chunk, len(filas)), tiempos): break
+        except Exception as e:
+            errores_etapa["enmascarado"] = e
+            cancelar.set()
+        finally:
+            poner(q_enmascarados, FIN, tiempos)
+
+    hilos = [threading.Thread(target=lector, name=f"etl-lector-{nombre_tabla}", daemon=True)]
+    hilos += [threading.Thread(target=enmascarador, args=(t_enmascaradores[k], contadores_trabajadores[k], reglas_trabajadores[k]),
+                               name=f"etl-mascara-{nombre_tabla}-{k}", daemon=True) for k in range(n_trabajadores)]
+    for h in hilos: h.start()
+
+    # El escritor es este mismo hilo (dueño de conn_target). Confirma los chunks en orden para
+    # que la marca de agua siempre represente "todo lo anterior ya está cargado".
+    pendientes = {}
+    siguiente = 0
+    fines = 0
+    try:
+        while fines < n_trabajadores and not cancelar.is_set():
+            item = tomar(q_enmascarados, t_escritor)
+            if item is None: break
+            if item is FIN:
+                fines += 1
+                continue
+            pendientes[item[0]] = item
+
+            while siguiente in pendientes:
+                _, plan_carga, filas_enmascaradas, max_chunk, leidas = pendientes.pop(siguiente)
+                stats_tabla["registros_leidos"] += leidas
+                try:
+                    t0 = time.perf_counter()
+                    commit = [0.0]
+                    stats_tabla["registros_insertados"] += cargar_lote(conn_target, plan_carga, filas_enmascaradas,
+                                                                       opciones["motor_carga"], opciones["formato_copy"], proyectadas=True,
+                                                                       filas_por_pagina=opciones["filas_por_pagina"], segundos_commit=commit)
+                    registrar_lote(metricas, t0, time.perf_counter() - commit[0], filas_enmascaradas)
+                    duracion = time.perf_counter() - t0
+                    stats_tabla["segundos_carga"] += duracion
+                    t_escritor[0] += duracion
+                except Exception as e:
+                    print_log(f"   ❌ Error insertando lote (Batch): {e}")
+                    stats_tabla["errores"].append(str(e))
+                    cancelar.set() # Detenemos lector y enmascaradores
+                    break
+
+                en_vuelo.release()
+                max_id_lote = mayor_marca(max_id_lote, max_chunk)
+                siguiente += 1
+                checkpoint_chunk(contexto.get("estado"), stats_tabla, max_id_lote, siguiente, opciones["checkpoint_chunks"])
+                print_log(f"   📦 Chunk procesado: {leidas} registros (acumulado: {stats_tabla['registros_leidos']})")
+    finally:
+        cancelar.set() # Libera a cualquier hilo que siga esperando en una cola
+        for h in hilos: h.join()
+        cursor_target.close()
+
+    # ### Tiempos por etapa: la que más tiempo pasó "ocupada" es el cuello de botella ###
+    etapas = {
+        "lector": t_lector,
+        "enmascarado": [sum(t[0] for t in t_enmascaradores), sum(t[1] for t in t_enmascaradores)],
+        "escritor": t_escritor,
+    }
+    stats_tabla["pipeline"] = {e: {"ocupado_s": round(t[0], 3), "espera_s": round(t[1], 3)} for e, t in etapas.items()}
+    cuello = max(etapas, key=lambda e: etapas[e][0])
+    stats_tabla["pipeline"]["cuello_de_botella"] = cuello
+    print_log("   🚦 Pipeline (ocupado/espera): " +
+              " | ".join(f"{e} {t[0]:.2f}s/{t[1]:.2f}s" for e, t in etapas.items()) + f" -> cuello de botella: {cuello}")
+
+    if "cache_mascaras" in stats_tabla:
+        for contadores in contadores_trabajadores:
+            for k, v in contadores.items(): stats_tabla["cache_mascaras"][k] += v
+    # Extracción y transformación = tiempo ocupado del lector y de los enmascaradores (se traslapan con la carga)
+    metricas["segundos"]["extraccion"] += t_lector[0]
+    metricas["segundos"]["transformacion"] += etapas["enmascarado"][0]
+    metricas["bytes_leidos"] += bytes_leidos[0]
+    for segundos_por_regla in reglas_trabajadores:
+        sumar_metricas(metricas, {"segundos_por_regla": segundos_por_regla})
+
+    # Un error de lectura o de enmascarado se reporta igual que en el modo secuencial
+    if "lector" in errores_etapa: raise errores_etapa["lector"]
+    if "enmascarado" in errores_etapa: raise errores_etapa["enmascarado"]
+    return max_id_lote
+
+# ### NUEVO: EXTRACCIÓN PARTICIONADA POR RANGOS DE LLAVE (Multiproceso) ###
+# Una tabla grande se divide en N rangos de `columna_incremental`; cada rango lo extrae,
+# enmascara y carga un proceso distinto con sus propias conexiones (Faker/SHA-256 usan varios núcleos).
+def calcular_rangos(cursor, sql_final, nombre_tabla, col_inc, particiones, metodo="minmax", desde=None):
+    """
+    Devuelve rangos (inferior, superior] sobre col_inc. El primero y el último quedan abiertos (None).
+    MIN/MAX se calculan sobre la consulta de extracción (filtro_sql y marca de agua incluidos), no sobre la tabla.
+    """
+    cortes = []
+    if metodo == "histograma":
+        # pg_stats ya tiene los cuantiles de la columna: no hay que escanear la tabla
+        cursor.execute("""
+            SELECT histogram_bounds::text FROM pg_stats
+            WHERE schemaname = current_schema() AND tablename = %s AND attname = %s
+        """, (nombre_tabla, col_inc))
+        fila = cursor.fetchone()
+        if fila and fila[0]:
+            try:
+                limites = [int(v) for v in fila[0].strip("{}").split(",")]
+                if desde is not None: limites = [v for v in limites if v > desde]
+                if len(limites) >= particiones:
+                    paso = len(limites) / particiones
+                    cortes = sorted({limites[int(paso * k)] for k in range(1, particiones)})
+            except ValueError:
+                pass # Columna no entera: usamos MIN/MAX
+        if not cortes:
+            print_log(f"   ℹ  Sin histograma útil en pg_stats para {nombre_tabla}.{col_inc}, se usa MIN/MAX")
+
+    if not cortes:
+        cursor.execute(sql.SQL("SELECT MIN({c}), MAX({c}) FROM ({}) AS t").format(
+            sql.SQL(sql_final), c=sql.Identifier(col_inc)))
+        minimo, maximo = cursor.fetchone()
+        if isinstance(minimo, int) and isinstance(maximo, int):
+            paso = (maximo - minimo + 1) / particiones
+            cortes = sorted({minimo - 1 + int(paso * k) for k in range(1, particiones)})
+    cursor.connection.commit()
+
+    limites = [None] + cortes + [None]
+    return list(zip(limites[:-1], limites[1:]))
+
+def _sql_rango(conn, sql_final, col_inc, inferior, superior):
+    """
+    Envuelve la consulta de extracción y le agrega el rango. Sin LIMIT en el filtro, Postgres empuja el
+    predicado hasta el escaneo de la tabla; con LIMIT no puede (cada rango reevaluaría el LIMIT completo),
+    por eso migrar_particionado no reparte esas tablas.
+    """
+    columna = sql.Identifier(col_inc)
+    condiciones = []
+    if inferior is not None: condiciones.append(sql.SQL("{} > {}").format(columna, sql.Literal(int(inferior))))
+    if superior is not None: condiciones.append(sql.SQL("{} <= {}").format(columna, sql.Literal(int(superior))))
+    if not condiciones: return sql_final
+    return sql.SQL("SELECT * FROM ({}) AS rango WHERE {} ORDER BY {}").format(
+        sql.SQL(sql_final), sql.SQL(" AND ").join(condiciones), columna).as_string(conn)
+
+def _procesar_rango(tarea):
+    """Corre en un proceso aparte: abre sus conexiones y migra un solo rango"""
+    global LOG_BUFFER
+    LOG_BUFFER = []
+    tabla_info, contexto = tarea["tabla_info"], tarea["contexto"]
+    _PREFIJO_LOG.set(f"{tabla_info['nombre']}#{tarea['indice']}")
+
+    configurar_cache_mascaras(contexto["cache_mascaras"]) # Proceso nuevo (spawn): la caché arranca con defaults
+    configurar_pool_mascaras(contexto["pool_mascaras"])
+    configurar_reintentos(contexto["reintentos"])
+    stats = {"rango": tarea["rango"], "registros_leidos": 0, "registros_insertados": 0, "segundos_carga": 0.0, "errores": [],
+             "cache_mascaras": nuevos_contadores_cache(), "metricas": nuevas_metricas_tabla()}
+    _METRICAS_TABLA.set(stats["metricas"])
+    max_id_lote = tarea["max_id_lote"]
+    perfil = contexto.get("perfilado") # ### NUEVO: --profile también en los procesos de rango ###
+    if perfil:
+        _PERFIL.update({"modo": perfil["modo"], "opciones": perfil["opciones"], "directorio": perfil["directorio"],
+                        "perfiles": {}, "archivos": {}, "muestras": {}, "memoria": {}, "hilos": {}, "activos": {}, "resumenes": {}})
+        if perfil["modo"] == "muestreo":
+            detener = threading.Event()
+            muestreador = threading.Thread(target=_muestreador, args=(perfil["opciones"]["intervalo_ms"] / 1000, detener), daemon=True)
+            muestreador.start()
+        perfilador = cProfile.Profile() if perfil["modo"] == "completo" else None
+        with _LOCK_PERFIL:
+            _PERFIL["hilos"][threading.get_ident()] = tabla_info['nombre']
+            if perfilador: _PERFIL["activos"][threading.get_ident()] = perfilador
+        if perfilador: perfilador.enable()
+    try:
+        t0 = time.perf_counter()
+        conn_source = conectar_con_reintentos(contexto["source_url"])
+        conn_target = registrar_conexion(conectar_con_reintentos(contexto["target_url"]), contexto["target_url"])
+        stats["metricas"]["segundos"]["conexion"] += time.perf_counter() - t0
+        try:
+            max_id_lote = migrar_consulta(conn_source, conn_target, tabla_info, tarea["sql"], contexto, stats, max_id_lote)
+        finally:
+            conn_source.close()
+            olvidar_conexion(conn_target).close() # La reconectada, si el destino se cayó a mitad del rango
+    except Exception as e:
+        print_log(f"⚠️ Error en el rango {tarea['rango']}: {e}")
+        stats["error"] = str(e)
+
+    if perfil:
+        if perfilador:
+            perfilador.disable()
+            archivo = os.path.join(perfil["directorio"], f"{tabla_info['nombre']}#{tarea['indice']}.prof")
+            perfilador.dump_stats(archivo)
+            stats["perfil"] = {"archivo": archivo}
+        else:
+            detener.set()
+            muestreador.join()
+            stats["perfil"] = {"muestras": _PERFIL["muestras"].get(tabla_info['nombre'], {})}
+
+    stats["max_id_lote"] = max_id_lote
+    stats["logs"] = LOG_BUFFER
+    return stats
+
+def migrar_particionado(conn_source, conn_target, tabla_info, sql_final, contexto, stats_tabla, max_id_lote, desde=None):
+    """Reparte los rangos en un pool de procesos y junta sus resultados en stats_tabla"""
+    nombre_tabla = tabla_info['nombre']
+    col_inc = tabla_info.get('columna_incremental', 'id')
+    particiones = int(tabla_info.get('particiones', 1))
+    metodo = tabla_info.get('particiones_metodo', 'minmax')
+    if filtro_con_limit(tabla_info):
+        # Las filas del LIMIT dependen de toda la consulta: partirla en rangos no reparte el trabajo
+        print_log(f"   ℹ  {nombre_tabla}: filtro_sql con LIMIT, se extrae sin particiones")
+        return migrar_consulta(conn_source, conn_target, tabla_info, sql_final, contexto, stats_tabla, max_id_lote)
+
+    cursor = conn_source.cursor()
+    try:
+        rangos = calcular_rangos(cursor, sql_final, nombre_tabla, col_inc, particiones, metodo, desde)
+    finally:
+        cursor.close()
+    print_log(f"   ✂️  {len(rangos)} rangos sobre '{col_inc}': {rangos}")
+    if len(rangos) == 1: # Nada que repartir (tabla vacía o sin llave entera)
+        return migrar_consulta(conn_source, conn_target, tabla_info, sql_final, contexto, stats_tabla, max_id_lote)
+
+    # Calentamos la caché de planes en disco para que los procesos no hagan la introspección a la vez
+    cursor_target = conn_target.cursor()
+    try:
+        obtener_plan_carga(cursor_target, tabla_info.get('tabla_destino', f"{nombre_tabla}_qa"), contexto["version_esquema"])
+    finally:
+        cursor_target.close()
+    # ### NUEVO: Igual con el pool de máscaras: se genera aquí una vez y los procesos solo lo leen ###
+    if POOL_MASCARAS["activo"] and {"faker_name", "preserve_format"} & set(tabla_info['columnas_enmascarar'].values()):
+        obtener_pool_mascaras()
+
+    tareas = [
+        {"tabla_info": tabla_info, "contexto": dict(contexto, estado=None, perfilado=info_perfilado()), "indice": i, "rango": list(rango),
+         "sql": _sql_rango(conn_source, sql_final, col_inc, *rango), "max_id_lote": max_id_lote}
+        for i, rango in enumerate(rangos)
+    ]
+    # "spawn": el proceso padre tiene hilos (planificador), así evitamos heredar locks a medias con fork
+    procesos = min(len(tareas), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn")) as ejecutor:
+        resultados = list(ejecutor.map(_procesar_rango, tareas))
+
+    # Juntamos los resultados de cada rango
+    stats_tabla["particiones"] = []
+    fallo = False
+    for r in resultados:
+        LOG_BUFFER.extend(r.pop("logs")) # Ya se imprimieron en el proceso hijo
+        stats_tabla["registros_leidos"] += r["registros_leidos"]
+        stats_tabla["registros_insertados"] += r["registros_insertados"]
+        stats_tabla["segundos_carga"] += r["segundos_carga"]
+        stats_tabla["errores"].extend(r["errores"])
+        if "cache_mascaras" in stats_tabla:
+            for k, v in r["cache_mascaras"].items(): stats_tabla["cache_mascaras"][k] += v
+        sumar_metricas(stats_tabla["metricas"], r["metricas"])
+        agregar_perfil_hijo(nombre_tabla, r.pop("perfil", None))
+        for operacion, veces in r["metricas"]["reintentos"].items(): # Los reintentos del hijo también son de la ejecución
+            with _LOCK_METRICAS:
+                METRICAS_EJECUCION["reintentos"][operacion] = METRICAS_EJECUCION["reintentos"].get(operacion, 0) + veces
+        if r.get("error"): stats_tabla["errores"].append(r["error"])
+        fallo = fallo or bool(r["errores"]) or bool(r.get("error"))
+        stats_tabla["particiones"].append({k: r[k] for k in ("rango", "registros_leidos", "registros_insertados")})
+
+    # Un rango fallido deja un hueco: no movemos la marca de agua para no saltarlo en el próximo delta
+    # (por lo mismo, los rangos no hacen checkpoint por chunk: terminan en desorden)
+    if fallo:
+        print_log("   ⚠️ Al menos un rango falló: la marca de agua no avanza")
+        return max_id_lote
+    for r in resultados:
+        max_id_lote = mayor_marca(max_id_lote, r["max_id_lote"])
+    return max_id_lote
+
+
+# ### NUEVO: PROCESAMIENTO DE UNA TABLA (Extract -> Transform -> Load) ###
+# Se separó del ciclo principal para que el planificador pueda correr varias tablas a la vez,
+# cada una con sus propias conexiones tomadas del pool.
+def nuevas_stats_tabla(tabla_info, opciones, estado=None):
+    """Diccionario de estadísticas de una tabla para la auditoría (PUNTO 5)"""
+    motor_carga, formato_copy = opciones["motor_carga"], opciones["formato_copy"]
+    stats_tabla = {
+        "tabla": tabla_info['nombre'],
+        "registros_leidos": 0,
+        "registros_insertados": 0,
+        "reglas_aplicadas": list(tabla_info['columnas_enmascarar'].keys()),
+        "motor_carga": motor_carga if motor_carga != "copy" else f"copy/{formato_copy}",
+        "segundos_carga": 0.0,
+        "errores": [], # ### PUNTO 6: Agregamos lista de errores ###
+        "metricas": nuevas_metricas_tabla(), # ### NUEVO: Segundos por etapa/regla, latencia por lote, bytes, reintentos ###
+    }
+    if CACHE_MASCARAS["activo"]:
+        stats_tabla["cache_mascaras"] = nuevos_contadores_cache() # ### NUEVO: Aciertos/fallos de la caché ###
+    marca = (estado or {}).get(CLAVE_REANUDACION) or {}
+    if marca.get("reanuda"):
+        # ### NUEVO: Filas que la ejecución interrumpida ya había confirmado (no se vuelven a leer) ###
+        stats_tabla["filas_omitidas_reanudacion"] = marca["filas"].get(tabla_info['nombre'], 0)
+    return stats_tabla
+
+# ### NUEVO: CONSTRUCTOR DE CONSULTAS INCREMENTALES ###
+# Antes se parchaba el texto (replace de "WHERE" y split en "LIMIT"), lo que rompía filtros con
+# subconsultas. Ahora el filtro del YAML se separa en su WHERE y su LIMIT y la consulta se compone
+# con psycopg2.sql: WHERE (filtro) AND (marca) > (último valor) ORDER BY marca LIMIT n.
+# El ORDER BY sobre la columna incremental deja que Postgres use su índice (paginación por llave)
+# y garantiza que LIMIT + marca de agua nunca se salten filas.
+_RE_LIMIT = re.compile(r"\s+LIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+
+def filtro_con_limit(tabla_info):
+    """True si el filtro_sql del YAML termina en LIMIT (cada corrida trae solo las primeras N filas)"""
+    return bool(_RE_LIMIT.search(" " + (tabla_info.get('filtro_sql') or '').strip()))
+# Solo un WHERE "simple" se combina con el predicado incremental; si trae ORDER BY, GROUP BY, etc. va como subconsulta
+_RE_WHERE = re.compile(r"^\s*WHERE\s+((?:(?!\b(?:ORDER\s+BY|GROUP\s+BY|HAVING|WINDOW|OFFSET|FETCH|UNION|INTERSECT|EXCEPT|FOR\s+(?:UPDATE|SHARE))\b).)*)$",
+                       re.IGNORECASE | re.DOTALL)
+
+def construir_consulta(tabla_info, estado, es_incremental, conn, llaves=None):
+    """
+    Arma el SELECT de extracción (filtro del YAML + marca de agua + ORDER BY). Devuelve (sql, ultimo_valor).
+    llaves = (columnas_llave, json) limita la consulta a esas llaves (CDC) y omite el LIMIT del filtro.
+    """
+    consulta, ultimo_valor = componer_consulta(tabla_info, estado, es_incremental, llaves)
+    return consulta.as_string(conn), ultimo_valor
+
+def componer_consulta(tabla_info, estado, es_incremental, llaves=None):
+    """Igual que construir_consulta, pero devuelve el sql.Composed sin convertirlo a texto"""
+    nombre_tabla = tabla_info['nombre']
+    claves = [sql.Identifier(c) for c in columnas_marca(tabla_info)] # ### NUEVO: Una o varias columnas (updated_at, id) ###
+    tabla = identificador(nombre_tabla) # Acepta esquema.tabla
+
+    # Leemos el filtro del YAML. Si está vacío, no pone nada.
+    filtro = " " + (tabla_info.get('filtro_sql') or '').strip()
+    limite = _RE_LIMIT.search(filtro)
+    if limite:
+        filtro = filtro[:limite.start()]
+    condiciones = []
+    origen = tabla
+    where = _RE_WHERE.match(filtro)
+    if where:
+        condiciones.append(sql.SQL("({})").format(sql.SQL(where.group(1))))
+    elif filtro.strip():
+        # Filtro que no es un WHERE simple (JOIN, GROUP BY...): queda intacto dentro de una subconsulta
+        origen = sql.SQL("(SELECT * FROM {} {}) AS etl_origen").format(tabla, sql.SQL(filtro.strip()))
+
+    ultimo_valor = None
+    if es_incremental:
+        ultimo_valor = validar_marca_guardada(estado, tabla_info)
+        print_log(f"   ℹ  Modo INCREMENTAL: Buscando nuevos registros > {ultimo_valor}")
+        if ultimo_valor is not None and ultimo_valor != 0: # Sin marca todavía: se lee todo
+            valores = ultimo_valor if isinstance(ultimo_valor, list) else [ultimo_valor]
+            condiciones.append(sql.SQL("({}) > ({})").format(sql.SQL(", ").join(claves),
+                                                            sql.SQL(", ").join(map(sql.Literal, valores))))
+    if llaves: # ### NUEVO: CDC (los tipos de la llave salen del propio tipo fila de la tabla) ###
+        condiciones.append(condicion_llaves(nombre_tabla, *llaves))
+        limite = None
+
+    consulta = sql.SQL("SELECT * FROM {}").format(origen)
+    if condiciones:
+        consulta += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(condiciones)
+    # Con el orden de la marca de agua, "marca = N" significa que todo lo <= N ya está cargado
+    # (los checkpoints por chunk y la reanudación dependen de esto)
+    consulta += sql.SQL(" ORDER BY ") + sql.SQL(", ").join(claves)
+    if limite:
+        consulta += sql.SQL(" LIMIT {}").format(sql.Literal(int(limite.group(1))))
+    return consulta, ultimo_valor
+
+def cerrar_stats_tabla(stats_tabla, estado, max_id_lote):
+    """Calcula filas/seg de la carga y guarda la marca de agua de la tabla"""
+    nombre_tabla = stats_tabla["tabla"]
+    print_log(f"   -> Se encontraron {stats_tabla['registros_leidos']} registros.")
+
+    # ### NUEVO: Rendimiento del motor de carga (para comparar values vs copy) ###
+    tiempo_carga = stats_tabla["segundos_carga"]
+    conteo_inserts = stats_tabla["registros_insertados"]
+    stats_tabla["segundos_carga"] = round(tiempo_carga, 3)
+    stats_tabla["filas_por_segundo_carga"] = round(conteo_inserts / tiempo_carga, 1) if tiempo_carga > 0 else 0
+    if conteo_inserts:
+        print_log(f"   ⚡ Carga ({stats_tabla['motor_carga']}): {conteo_inserts} filas en {tiempo_carga:.2f}s -> {stats_tabla['filas_por_segundo_carga']:,} filas/s")
+    if "metricas" in stats_tabla:
+        segundos = redondear_metricas(stats_tabla["metricas"])["segundos"]
+        print_log("   ⏱️  Etapas: " + " | ".join(f"{etapa} {s:.2f}s" for etapa, s in segundos.items() if s))
+
+    # ### NUEVO: Guardar el estado si hubo éxito ###
+    if stats_tabla["registros_leidos"]:
+        guardar_avance_tabla(estado, stats_tabla, max_id_lote)
+        print_log(f"   💾 Estado actualizado: {nombre_tabla} -> {estado.get(nombre_tabla)}")
+    return stats_tabla
+
+def procesar_tabla(tabla_info, conn_source, conn_target, estado, contexto):
+    """Migra una tabla del YAML y devuelve su diccionario de estadísticas para la auditoría"""
+    nombre_tabla = tabla_info['nombre']
+    # ### PUNTO 5: Crear diccionario de estadísticas para esta tabla ###
+    opciones = opciones_tabla(tabla_info, contexto["rendimiento"])
+    stats_tabla = nuevas_stats_tabla(tabla_info, opciones, estado)
+    # Los rangos solo aplican a una marca de agua de una sola columna
+    particionada = int(tabla_info.get('particiones', 1)) > 1 and len(columnas_marca(tabla_info)) == 1
+
+    token_metricas = _METRICAS_TABLA.set(stats_tabla["metricas"]) # Los reintentos se atribuyen a esta tabla
+    t0 = time.perf_counter()
+    try:
+        with perfilar_tabla(tabla_info['nombre']) as perfil: # ### NUEVO: --profile (no hace nada si está apagado) ###
+            stats_tabla = _procesar_tabla(tabla_info, conn_source, conn_target, estado, contexto, stats_tabla, particionada)
+        if perfil:
+            stats_tabla["perfil"] = perfil
+        return stats_tabla
+    finally:
+        stats_tabla["metricas"]["duracion_segundos"] = round(time.perf_counter() - t0, 4)
+        _METRICAS_TABLA.reset(token_metricas)
+
+def _procesar_tabla(tabla_info, conn_source, conn_target, estado, contexto, stats_tabla, particionada):
+    nombre_tabla = tabla_info['nombre']
+    print_log(f"\n🔄 Procesando tabla: {nombre_tabla.upper()}")
+    sql_final, ultimo_valor = construir_consulta(tabla_info, estado, contexto["es_incremental"], conn_source)
+    max_id_lote = estado.get(nombre_tabla, 0) # ### NUEVO: Variable para rastrear el ID más alto de este lote ###
+
+    try:
+        if particionada:
+            # ### NUEVO: Rangos de llave en procesos separados ###
+            max_id_lote = migrar_particionado(conn_source, conn_target, tabla_info, sql_final, contexto,
+                                              stats_tabla, max_id_lote, ultimo_valor)
+        else:
+            max_id_lote = migrar_consulta(conn_source, conn_target, tabla_info, sql_final, contexto,
+                                          stats_tabla, max_id_lote)
+    except Exception as e:
+        print_log(f"⚠️ Error leyendo tabla {nombre_tabla}: {e}")
+        stats_tabla["error"] = str(e) # ### PUNTO 5: Guardar error si ocurre ###
+        try: conn_source.rollback()
+        except: pass
+        return stats_tabla
+
+    return cerrar_stats_tabla(stats_tabla, estado, max_id_lote)
+
+# ### NUEVO: PLANIFICADOR POR DEPENDENCIAS (FK) Y POOL DE CONEXIONES ###
+def crear_pool_con_reintentos(url, max_conexiones):
+    """Crea un ThreadedConnectionPool reintentando N veces (igual que conectar_con_reintentos)"""
+    return reintentar("conexion", lambda: pool.ThreadedConnectionPool(1, max_conexiones, url))
+
+SQL_DEPENDENCIAS_FK = """
+    SELECT conrelid::regclass::text, confrelid::regclass::text
+    FROM pg_constraint
+    WHERE contype = 'f' AND connamespace = current_schema()::regnamespace
+"""
+
+def agregar_dependencias_fk(dependencias, pares_fk):
+    """Suma al grafo las FK (hija, padre) entre tablas que están en el YAML"""
+    for hija, padre in pares_fk:
+        if hija in dependencias and padre in dependencias and hija != padre:
+            dependencias[hija].add(padre)
+
+def obtener_dependencias(tablas, cursor_source, usar_catalogo=True):
+    """Devuelve {tabla: {padres}} combinando `depende_de` del YAML y las FK de pg_constraint"""
+    nombres = {t['nombre'] for t in tablas}
+    dependencias = {t['nombre']: set(t.get('depende_de', [])) & nombres for t in tablas}
+
+    if usar_catalogo:
+        try:
+            cursor_source.execute(SQL_DEPENDENCIAS_FK)
+            agregar_dependencias_fk(dependencias, cursor_source.fetchall())
+            cursor_source.connection.commit()
+        except Exception as e:
+            print_log(f"   ⚠️ No se pudieron leer las FK del catálogo, se usa solo el YAML: {e}")
+            try: cursor_source.connection.rollback()
+            except: pass
+
+    return dependencias
+
+def orden_topologico(tablas, dependencias):
+    """Padres antes que hijos (Kahn). Respeta el orden del YAML entre tablas independientes"""
+    pendientes = [t['nombre'] for t in tablas]
+    orden = []
+    while pendientes:
+        listas = [n for n in pendientes if dependencias[n] <= set(orden)]
+        if not listas:
+            raise Exception(f"Dependencia circular entre tablas: {pendientes}")
+        orden.extend(listas)
+        pendientes = [n for n in pendientes if n not in listas]
+    return orden
+
+def ejecutar_planificador(tablas, dependencias, procesar, max_concurrencia):
+    """Corre `procesar(tabla_info)` en un pool de hilos: una tabla arranca cuando sus padres terminaron"""
+    pendientes = {t['nombre']: t for t in tablas}
+    terminadas = set()
+    resultados = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix="etl") as ejecutor:
+        en_curso = {}
+        while pendientes or en_curso:
+            listas = [n for n in pendientes if dependencias[n] <= terminadas]
+            for n in listas:
+                en_curso[ejecutor.submit(procesar, pendientes.pop(n))] = n
+            if not en_curso: break # Solo pasaría con un ciclo (ya validado en orden_topologico)
+
+            hechas, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in hechas:
+                n = en_curso.pop(futuro)
+                resultados[n] = futuro.result()
+                terminadas.add(n)
+
+    # Devolvemos en el orden del YAML para que la auditoría sea estable
+    return [resultados[t['nombre']] for t in tablas if t['nombre'] in resultados]
+
+# ### NUEVO: ESTRATEGIAS DE CARGA COMPLETA ###
+# "delete"   -> DELETE FROM hijo -> padre (la de siempre)
+# "truncate" -> un solo TRUNCATE de todas las tablas QA (sin recorrer filas ni inflar la tabla)
+# "staging"  -> se carga en *_qa_staging (UNLOGGED, sin índices), luego se crean índices/llaves y
+#               se intercambian con RENAME en una sola transacción: quien lee QA nunca ve tablas
+#               vacías ni a medias, y si algo falla las tablas QA quedan como estaban.
+#               Permisos, triggers, RLS y políticas de la tabla QA se copian a la staging.
+SUFIJO_STAGING = "_staging"
+
+SQL_INDICES_TABLA = """
+    SELECT i.relname, pg_get_indexdef(x.indexrelid), c.conname, pg_get_constraintdef(c.oid)
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid
+    WHERE x.indrelid = %s::regclass
+"""
+SQL_FKS_TABLA = "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'"
+SQL_PERMISOS_TABLA = """
+    SELECT grantee, privilege_type FROM information_schema.role_table_grants
+    WHERE table_schema = current_schema() AND table_name = %s AND grantee <> current_user
+"""
+SQL_SECUENCIAS_TABLA = """
+    SELECT s.oid::regclass::text, a.attname
+    FROM pg_depend d
+    JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+    JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE d.refobjid = %s::regclass AND d.deptype = 'a'
+"""
+SQL_TRIGGERS_TABLA = "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal"
+SQL_RLS_TABLA = "SELECT relrowsecurity, relforcerowsecurity FROM pg_class WHERE oid = %s::regclass"
+SQL_POLITICAS_TABLA = """
+    SELECT policyname, permissive, roles::text[], cmd, qual, with_check FROM pg_policies
+    WHERE format('%%I.%%I', schemaname, tablename)::regclass = %s::regclass
+"""
+_RE_INDICE = re.compile(r"^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (USING .*)$", re.DOTALL)
+_RE_TRIGGER = re.compile(r"^(CREATE (?:CONSTRAINT )?TRIGGER .+? ON )\S+( .*)$", re.DOTALL)
+
+def identificador(nombre):
+    """"esquema.tabla" o "tabla" como psycopg2.sql.Identifier"""
+    return sql.Identifier(*nombre.split("."))
+
+def partes_tabla(nombre):
+    """(esquema, tabla) de "esquema.tabla"; sin esquema -> (None, tabla) y las consultas usan current_schema()"""
+    partes = nombre.split(".")
+    return (partes[0] if len(partes) > 1 else None, partes[-1])
+
+def destino_tabla(tabla_info):
+    return tabla_info.get('tabla_destino', f"{tabla_info['nombre']}_qa")
+
+def limpiar_con_truncate(cursor, destinos):
+    """Vacía todas las tablas QA con un solo TRUNCATE (las FK entre ellas no estorban)"""
+    print_log(f"   ✂️  TRUNCATE {', '.join(destinos)}")
+    ejecutar_sql_con_reintentos(cursor, sql.SQL("TRUNCATE {}").format(sql.SQL(", ").join(map(identificador, destinos))))
+    cursor.connection.commit()
+
+def preparar_staging(cursor, destino, unlogged=True):
+    """Crea {destino}_staging vacía (misma estructura, sin índices) y guarda lo que hay que recrear"""
+    staging = f"{destino}{SUFIJO_STAGING}"
+    nombre_corto = destino.split(".")[-1]
+    ejecutar_sql_con_reintentos(cursor, sql.SQL("DROP TABLE IF EXISTS {}").format(identificador(staging)))
+    ejecutar_sql_con_reintentos(cursor, sql.SQL(
+        "CREATE {} TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED INCLUDING IDENTITY INCLUDING STORAGE)"
+    ).format(sql.SQL("UNLOGGED" if unlogged else ""), identificador(staging), identificador(destino)))
+
+    ejecutar_sql_con_reintentos(cursor, SQL_INDICES_TABLA, (destino,))
+    indices = cursor.fetchall()
+    ejecutar_sql_con_reintentos(cursor, SQL_FKS_TABLA, (destino,))
+    fks = cursor.fetchall()
+    ejecutar_sql_con_reintentos(cursor, SQL_PERMISOS_TABLA, (nombre_corto,))
+    for grantee, privilegio in cursor.fetchall(): # Los permisos siguen a la tabla cuando se renombra
+        receptor = sql.SQL("PUBLIC") if grantee == "PUBLIC" else sql.Identifier(grantee)
+        ejecutar_sql_con_reintentos(cursor, sql.SQL("GRANT {} ON {} TO {}").format(sql.SQL(privilegio), identificador(staging), receptor))
+    # Triggers desde antes de cargar: disparan con cada fila, igual que con "delete"/"truncate"
+    ejecutar_sql_con_reintentos(cursor, SQL_TRIGGERS_TABLA, (destino,))
+    for (definicion,) in cursor.fetchall():
+        ejecutar_sql_con_reintentos(cursor, ddl_trigger(staging, definicion))
+    # RLS y políticas se aplican al terminar la carga (con FORCE, la carga misma quedaría filtrada)
+    ejecutar_sql_con_reintentos(cursor, SQL_RLS_TABLA, (destino,))
+    rls = cursor.fetchone()
+    ejecutar_sql_con_reintentos(cursor, SQL_POLITICAS_TABLA, (destino,))
+    politicas = cursor.fetchall()
+    cursor.connection.commit()
+    return {"destino": destino, "staging": staging, "unlogged": unlogged, "indices": indices, "fks": fks,
+            "rls": list(rls), "politicas": politicas}
+
+def ddl_indice(staging, nombre_indice, definicion, restriccion, definicion_restriccion):
+    """Índice de QA recreado en la staging con nombre temporal *_stg (PK/UNIQUE/EXCLUDE como restricción)"""
+    if restriccion: # Como restricción para que ON CONFLICT la vea
+        return sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}").format(
+            identificador(staging), sql.Identifier(f"{restriccion}_stg"), sql.SQL(definicion_restriccion))
+    partes = _RE_INDICE.match(definicion)
+    return sql.SQL("CREATE {}INDEX {} ON {} {}").format(
+        sql.SQL(partes.group(1) or ""), sql.Identifier(f"{nombre_indice}_stg"), identificador(staging), sql.SQL(partes.group(2)))
+
+def ddl_trigger(staging, definicion):
+    """pg_get_triggerdef de la tabla QA apuntando a la staging (el nombre del trigger es por tabla: no choca)"""
+    partes = _RE_TRIGGER.match(definicion)
+    return sql.SQL("{}{}{}").format(sql.SQL(partes.group(1)), identificador(staging), sql.SQL(partes.group(2)))
+
+def ddl_rls(staging, habilitada, forzada):
+    """ENABLE/FORCE ROW LEVEL SECURITY de la tabla QA (None si no tenía)"""
+    if not habilitada and not forzada: return None
+    partes = [sql.SQL("ENABLE ROW LEVEL SECURITY")] if habilitada else []
+    if forzada: partes.append(sql.SQL("FORCE ROW LEVEL SECURITY"))
+    return sql.SQL("ALTER TABLE {} {}").format(identificador(staging), sql.SQL(", ").join(partes))
+
+def ddl_politica(staging, nombre, permisiva, roles, comando, usando, verificacion):
+    """CREATE POLICY a partir de una fila de pg_policies"""
+    receptores = [sql.SQL("PUBLIC") if r == "public" else sql.Identifier(r) for r in roles]
+    return sql.SQL("CREATE POLICY {} ON {} AS {} FOR {} TO {}{}{}").format(
+        sql.Identifier(nombre), identificador(staging), sql.SQL(permisiva), sql.SQL(comando), sql.SQL(", ").join(receptores),
+        sql.SQL(" USING ({})").format(sql.SQL(usando)) if usando else sql.SQL(""),
+        sql.SQL(" WITH CHECK ({})").format(sql.SQL(verificacion)) if verificacion else sql.SQL(""))
+
+def finalizar_staging(cursor, info):
+    """Después de la carga: tabla LOGGED, índices y llaves (con nombre temporal *_stg), RLS/políticas y ANALYZE"""
+    staging = identificador(info["staging"])
+    if info["unlogged"]:
+        ejecutar_sql_con_reintentos(cursor, sql.SQL("ALTER TABLE {} SET LOGGED").format(staging))
+    for indice in info["indices"]:
+        ejecutar_sql_con_reintentos(cursor, ddl_indice(info["staging"], *indice))
+    rls = ddl_rls(info["staging"], *info["rls"])
+    if rls is not None:
+        ejecutar_sql_con_reintentos(cursor, rls)
+    for politica in info["politicas"]:
+        ejecutar_sql_con_reintentos(cursor, ddl_politica(info["staging"], *politica))
+    ejecutar_sql_con_reintentos(cursor, sql.SQL("ANALYZE {}").format(staging))
+    cursor.connection.commit()
+
+def intercambiar_staging(cursor, infos):
+    """Publica todas las tablas staging en UNA transacción: RENAME, borra las viejas y restaura nombres/FK"""
+    for info in infos:
+        finalizar_staging(cursor, info)
+
+    conn = cursor.connection
+    try:
+        destinos = [identificador(i["destino"]) for i in infos]
+        cursor.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(sql.SQL(", ").join(destinos)))
+        for info in infos:
+            viejo = info["destino"].split(".")[-1] + "_old"
+            cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(identificador(info["destino"]), sql.Identifier(viejo)))
+            cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(identificador(info["staging"]),
+                                                                        sql.Identifier(info["destino"].split(".")[-1])))
+            info["viejo"] = ".".join(info["destino"].split(".")[:-1] + [viejo])
+            # Las secuencias (serial) de la tabla vieja pasan a la nueva antes de borrarla
+            cursor.execute(SQL_SECUENCIAS_TABLA, (info["viejo"],))
+            for secuencia, columna in cursor.fetchall():
+                cursor.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY {}.{}").format(
+                    identificador(secuencia), identificador(info["destino"]), sql.Identifier(columna)))
+        # Si otra tabla fuera del YAML tiene FK hacia una tabla vieja, esto falla y no se publica nada
+        cursor.execute(sql.SQL("DROP TABLE {}").format(sql.SQL(", ").join(identificador(i["viejo"]) for i in infos)))
+        for info in infos:
+            destino = identificador(info["destino"])
+            for nombre_indice, _, restriccion, _ in info["indices"]:
+                if restriccion:
+                    cursor.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+                        destino, sql.Identifier(f"{restriccion}_stg"), sql.Identifier(restriccion)))
+                else:
+                    esquema = info["destino"].split(".")[:-1]
+                    cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        identificador(".".join(esquema + [f"{nombre_indice}_stg"])), sql.Identifier(nombre_indice)))
+            # FK con NOT VALID: no escanean la tabla dentro de la transacción del intercambio
+            for restriccion, definicion in info["fks"]:
+                cursor.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID").format(
+                    destino, sql.Identifier(restriccion), sql.SQL(definicion)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # Ya publicadas: validamos las FK sin bloquear lecturas
+    for info in infos:
+        for restriccion, _ in info["fks"]:
+            ejecutar_sql_con_reintentos(cursor, sql.SQL("ALTER TABLE {} VALIDATE CONSTRAINT {}").format(
+                identificador(info["destino"]), sql.Identifier(restriccion)))
+    conn.commit()
+
+def descartar_staging(cursor, infos):
+    """La carga falló: se borran las staging y QA queda intacto"""
+    for info in infos:
+        try:
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(identificador(info["staging"])))
+            cursor.connection.commit()
+        except Exception as e:
+            cursor.connection.rollback()
+            print_log(f"   ⚠️ No se pudo borrar {info['staging']}: {e}")
+
+def limpiar_destinos(cursor_target, tablas, orden, estado, estrategia, unlogged=True):
+    """Limpieza de la carga completa según la estrategia. Con "staging" devuelve {nombre: info} (si no, None)"""
+    conn_target = cursor_target.connection
+    destinos = {t['nombre']: destino_tabla(t) for t in tablas}
+
+    if estrategia == "staging":
+        print_log("\n🧱 MODO COMPLETO (staging): se carga en tablas *_staging y se intercambian al final")
+        marca = estado.get(CLAVE_REANUDACION)
+        if marca is not None: # Si la carga se corta, QA no cambió: hay que volver a estas marcas de agua
+            marca["estado_previo"] = {n: estado.get(n, 0) for n in orden}
+        staging = {}
+        for n in orden:
+            staging[n] = preparar_staging(cursor_target, destinos[n], unlogged)
+            print_log(f"   🧱 {staging[n]['staging']} lista{' (UNLOGGED)' if unlogged else ''}")
+            estado[n] = 0
+        return staging
+
+    if estrategia == "truncate":
+        print_log("\n🧹 MODO COMPLETO: TRUNCATE de las tablas destino...")
+        try:
+            limpiar_con_truncate(cursor_target, [destinos[n] for n in reversed(orden)])
+            for n in orden: estado[n] = 0
+            return None
+        except Exception as e:
+            conn_target.rollback()
+            print_log(f"   ⚠️ TRUNCATE falló ({e}), se usa DELETE")
+
+    # ### PUNTO 7: CORRECCIÓN DE LIMPIEZA (Borrar Hijos -> Padres) ###
+    # Esto evita el error de Foreign Key Constraint al borrar
+    print_log("\n🧹 MODO COMPLETO: Ejecutando limpieza en orden inverso...")
+    # ### NUEVO: Orden topológico inverso del mismo grafo (antes estaba fijo en el código) ###
+    tablas_borrar = [(destinos[n], n) for n in reversed(orden)]
+    
+    for t, nombre_base in tablas_borrar:
+        print_log(f"   🗑  Limpiando tabla: {t}...")
+        try:
+            ejecutar_sql_con_reintentos(cursor_target, f"DELETE FROM {t};")
+            conn_target.commit()
+            # Reseteamos la memoria de esa tabla
+            estado[nombre_base] = 0 
+        except Exception as e:
+            print_log(f"   ⚠️ No se pudo limpiar {t}: {e}")
+    return None
+
+def publicar_staging(cursor_target, staging, log_detalles, estado):
+    """Intercambia las staging si todas las tablas cargaron bien; si no, las descarta y restaura las marcas de agua"""
+    infos = list(staging.values())
+    fallidas = [d['tabla'] for d in log_detalles if d.get("error") or d.get("errores")]
+    try:
+        if fallidas:
+            raise Exception(f"tablas con errores: {', '.join(fallidas)}")
+        intercambiar_staging(cursor_target, infos)
+        print_log(f"🔁 Intercambio atómico completado: {', '.join(i['destino'] for i in infos)}")
+        return True
+    except Exception as e:
+        print_log(f"⚠️ No se publicó la carga completa ({e}). Las tablas QA quedan como estaban.")
+        descartar_staging(cursor_target, infos)
+        marca = estado.get(CLAVE_REANUDACION) or {}
+        with _LOCK_ESTADO:
+            estado.update(marca.get("estado_previo", {}))
+            guardar_estado(estado)
+        return False
+
+# ### NUEVO: CAPTURA DE CAMBIOS (CDC) CON TRIGGERS EN ORIGEN ###
+# Cada tabla de origen lleva triggers por sentencia (con tablas de transición: una sola inserción al log
+# por INSERT/UPDATE/DELETE, no una por fila) que anotan la llave primaria de lo que cambió en `etl_cdc_log`.
+# `lsn` (bigserial) ordena los cambios y `txid` permite leer solo hasta un horizonte seguro: lo escrito por
+# transacciones con txid < xmin del snapshot ya está confirmado (o abortado) y ninguna otra puede agregar
+# algo debajo de ese horizonte. La opción 4 relee en origen el estado ACTUAL de las llaves cambiadas:
+# si la fila existe (y pasa el filtro del YAML) se enmascara y se hace upsert; si no, se borra de QA.
+# Aplicar dos veces es idempotente, por eso el log se recorta hasta después de confirmar el destino.
+CDC_DEFAULT = {"activo": False, "tabla_log": "etl_cdc_log", "lote": 5000}
+
+SQL_CDC_LOG = """
+    CREATE TABLE IF NOT EXISTS {log} (
+        lsn BIGSERIAL PRIMARY KEY,
+        tabla TEXT NOT NULL,
+        llave JSONB NOT NULL,
+        operacion CHAR(1) NOT NULL,
+        txid BIGINT NOT NULL DEFAULT txid_current(),
+        registrado TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS {indice} ON {log} (tabla, lsn);
+"""
+SQL_CDC_FUNCION = """
+    CREATE OR REPLACE FUNCTION {funcion}() RETURNS trigger LANGUAGE plpgsql AS $etl_cdc$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO {log} (tabla, llave, operacion) SELECT {nombre}, jsonb_build_object({llave_f}), 'I' FROM nuevas f;
+        ELSIF TG_OP = 'UPDATE' THEN
+            INSERT INTO {log} (tabla, llave, operacion)
+            SELECT {nombre}, jsonb_build_object({llave_f}), 'U' FROM nuevas f
+            UNION ALL -- Si el UPDATE cambió la llave, la vieja también se anota
+            SELECT {nombre}, jsonb_build_object({llave_f}), 'D' FROM viejas f
+            WHERE NOT EXISTS (SELECT 1 FROM nuevas n WHERE ({columnas_n}) = ({columnas_f}));
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO {log} (tabla, llave, operacion) SELECT {nombre}, jsonb_build_object({llave_f}), 'D' FROM viejas f;
+        ELSE -- TRUNCATE: no hay llaves; al aplicar se vacía la tabla QA
+            INSERT INTO {log} (tabla, llave, operacion) VALUES ({nombre}, '{{}}', 'T');
+        END IF;
+        RETURN NULL;
+    END $etl_cdc$;
+    DROP TRIGGER IF EXISTS etl_cdc_insert ON {tabla};
+    DROP TRIGGER IF EXISTS etl_cdc_update ON {tabla};
+    DROP TRIGGER IF EXISTS etl_cdc_delete ON {tabla};
+    DROP TRIGGER IF EXISTS etl_cdc_truncate ON {tabla};
+    CREATE TRIGGER etl_cdc_insert AFTER INSERT ON {tabla} REFERENCING NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+    CREATE TRIGGER etl_cdc_update AFTER UPDATE ON {tabla} REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+    CREATE TRIGGER etl_cdc_delete AFTER DELETE ON {tabla} REFERENCING OLD TABLE AS viejas
+        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+    CREATE TRIGGER etl_cdc_truncate AFTER TRUNCATE ON {tabla}
+        FOR EACH STATEMENT EXECUTE FUNCTION {funcion}();
+"""
+SQL_CDC_INSTALADO = "SELECT count(*) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = 'etl_cdc_insert'"
+SQL_CDC_HORIZONTE = "SELECT txid_snapshot_xmin(txid_current_snapshot())"
+SQL_CDC_PENDIENTES = "SELECT lsn, llave, operacion FROM {log} WHERE tabla = %s AND txid < %s AND lsn > %s ORDER BY lsn LIMIT %s"
+SQL_CDC_RECORTAR = "DELETE FROM {log} WHERE tabla = %s AND txid < %s AND lsn <= %s"
+
+def opciones_cdc(config):
+    return {**CDC_DEFAULT, **(config.get('cdc') or {})}
+
+def obtener_llave_origen(cursor, nombre_tabla):
+    """Columnas de la llave primaria de una tabla de origen"""
+    ejecutar_sql_con_reintentos(cursor, SQL_LLAVE_DESTINO, partes_tabla(nombre_tabla))
+    llave = [r[0] for r in cursor.fetchall()]
+    if not llave:
+        raise Exception(f"La tabla '{nombre_tabla}' no tiene llave primaria (CDC la necesita)")
+    return llave
+
+def sql_instalar_cdc(nombre_tabla, llave, tabla_log):
+    """DDL (idempotente) de la función y los cuatro triggers CDC de una tabla"""
+    f, n = sql.Identifier("f"), sql.Identifier("n")
+    return sql.SQL(SQL_CDC_FUNCION).format(
+        funcion=identificador(f"{nombre_tabla}_etl_cdc"), tabla=identificador(nombre_tabla), log=identificador(tabla_log),
+        nombre=sql.Literal(nombre_tabla),
+        llave_f=sql.SQL(", ").join(sql.SQL("{}, {}.{}").format(sql.Literal(c), f, sql.Identifier(c)) for c in llave),
+        columnas_n=sql.SQL(", ").join(sql.SQL("{}.{}").format(n, sql.Identifier(c)) for c in llave),
+        columnas_f=sql.SQL(", ").join(sql.SQL("{}.{}").format(f, sql.Identifier(c)) for c in llave))
+
+def instalar_cdc(conn_source, tablas, opciones):
+    """Crea el log y los triggers en las tablas que aún no los tienen. Devuelve las que se instalaron"""
+    cursor = conn_source.cursor()
+    tabla_log = opciones["tabla_log"]
+    nuevas = []
+    try:
+        for tabla_info in tablas:
+            nombre = tabla_info['nombre']
+            ejecutar_sql_con_reintentos(cursor, SQL_CDC_INSTALADO, (nombre,))
+            if cursor.fetchone()[0]: continue
+            if not nuevas:
+                ejecutar_sql_con_reintentos(cursor, sql.SQL(SQL_CDC_LOG).format(
+                    log=identificador(tabla_log), indice=sql.Identifier(f"{tabla_log.split('.')[-1]}_tabla_lsn")))
+            ejecutar_sql_con_reintentos(cursor, sql_instalar_cdc(nombre, obtener_llave_origen(cursor, nombre), tabla_log))
+            nuevas.append(nombre)
+        conn_source.commit()
+    finally:
+        cursor.close()
+    if nuevas:
+        print_log(f"🪝 Triggers CDC instalados en: {', '.join(nuevas)} (log: {tabla_log})")
+    return nuevas
+
+def horizonte_cdc(conn_source):
+    """txid bajo el cual todo lo anotado en el log ya es definitivo"""
+    with conn_source.cursor() as cursor:
+        ejecutar_sql_con_reintentos(cursor, SQL_CDC_HORIZONTE)
+        horizonte = cursor.fetchone()[0]
+    conn_source.commit()
+    return horizonte
+
+def recortar_cdc(conn_source, opciones, hasta_por_tabla, horizonte):
+    """Borra del log lo ya aplicado (hasta_por_tabla: tabla -> último lsn; None = todo bajo el horizonte)"""
+    consulta = sql.SQL(SQL_CDC_RECORTAR).format(log=identificador(opciones["tabla_log"]))
+    borrados = 0
+    with conn_source.cursor() as cursor:
+        for nombre, hasta in hasta_por_tabla.items():
+            ejecutar_sql_con_reintentos(cursor, consulta, (nombre, horizonte, hasta if hasta is not None else 2 ** 63 - 1))
+            borrados += cursor.rowcount
+    conn_source.commit()
+    return borrados
+
+def condicion_llaves(nombre_tabla, columnas_llave, llaves_json):
+    """(llave) IN (llaves del JSON), con los tipos tomados del tipo fila de la tabla"""
+    columnas = sql.SQL(", ").join(map(sql.Identifier, columnas_llave))
+    return sql.SQL("({}) IN (SELECT {} FROM jsonb_populate_recordset(NULL::{}, {}::jsonb))").format(
+        columnas, columnas, identificador(nombre_tabla), sql.Literal(llaves_json))
+
+def _llave_texto(llave):
+    return json.dumps(llave, sort_keys=True, default=str)
+
+def aplicar_cdc_tabla(conn_source, conn_target, tabla_info, contexto, stats_tabla, opciones, horizonte, cambios_padres=None):
+    """
+    Aplica (upsert) los cambios pendientes de una tabla hasta el horizonte, más las filas cuyos padres
+    cambiaron (`cdc_padres`: su filtro depende del padre). Devuelve (último lsn leído, columnas de la llave,
+    llaves tocadas, llaves a borrar en QA); los borrados van aparte, en orden inverso de dependencias.
+    """
+    nombre = tabla_info['nombre']
+    tabla_cdc = dict(tabla_info, conflicto="actualizar") # El cambio debe pisar la versión vieja en QA
+    contexto_cdc = dict(contexto, estado=None) # Sin checkpoints: CDC no mueve las marcas de agua
+    pendientes = sql.SQL(SQL_CDC_PENDIENTES).format(log=identificador(opciones["tabla_log"]))
+    lote = int(opciones["lote"])
+    cursor = conn_source.cursor()
+    ultimo_lsn, tocadas, eliminar = 0, {}, {}
+
+    def aplicar(llaves):
+        """Relee en origen un lote de llaves: las vivas se enmascaran y cargan, las demás se anotan para borrar"""
+        llaves_json = json.dumps(list(llaves.values()), default=str)
+        sql_final, _ = construir_consulta(tabla_cdc, {}, False, conn_source, llaves=(llave, llaves_json))
+        ejecutar_sql_con_reintentos(cursor, sql.SQL("SELECT {} FROM ({}) AS etl_cdc").format(objeto_llave, sql.SQL(sql_final)))
+        vivas = {_llave_texto(r[0]) for r in cursor.fetchall()}
+        conn_source.commit()
+        for texto, l in llaves.items():
+            tocadas[texto] = l
+            if texto in vivas: eliminar.pop(texto, None) # Borrada y vuelta a insertar
+            else: eliminar[texto] = l
+        if vivas:
+            migrar_consulta(conn_source, conn_target, tabla_cdc, sql_final, contexto_cdc, stats_tabla, None)
+
+    try:
+        llave = obtener_llave_origen(cursor, nombre)
+        objeto_llave = sql.SQL("jsonb_build_object({})").format(
+            sql.SQL(", ").join(sql.SQL("{}, {}").format(sql.Literal(c), sql.Identifier(c)) for c in llave))
+        while True:
+            t0 = time.perf_counter()
+            ejecutar_sql_con_reintentos(cursor, pendientes, (nombre, horizonte, ultimo_lsn, lote))
+            cambios = cursor.fetchall()
+            conn_source.commit()
+            stats_tabla["metricas"]["segundos"]["extraccion"] += time.perf_counter() - t0
+            if not cambios: break
+            ultimo_lsn = cambios[-1][0]
+            stats_tabla["cambios_leidos"] += len(cambios)
+
+            if any(op == "T" for _, _, op in cambios):
+                # Tras un TRUNCATE toda fila viva tiene su propio INSERT en el log: basta vaciar QA y seguir
+                print_log(f"   ✂️  TRUNCATE en origen: se vacía {destino_tabla(tabla_info)}")
+                destino = conexion_vigente(conn_target) # Pudo reconectarse en un lote anterior
+                with destino.cursor() as cursor_target:
+                    ejecutar_sql_con_reintentos(cursor_target, sql.SQL("DELETE FROM {}").format(identificador(destino_tabla(tabla_info))))
+                destino.commit()
+                eliminar.clear()
+
+            llaves = {_llave_texto(l): l for _, l, op in cambios if op != "T"}
+            if llaves: aplicar(llaves)
+
+        # Filas cuyo padre cambió (p. ej. la orden cruzó el umbral de `total`): se reevalúan con el filtro
+        for padre, columna in (tabla_info.get('cdc_padres') or {}).items():
+            llaves_padre = list((cambios_padres or {}).get(padre, {}).values())
+            for i in range(0, len(llaves_padre), lote):
+                columna_padre = next(iter(llaves_padre[i]))
+                ejecutar_sql_con_reintentos(cursor, sql.SQL(
+                    "SELECT {} FROM {} WHERE {} IN (SELECT {} FROM jsonb_populate_recordset(NULL::{}, {}::jsonb))").format(
+                    objeto_llave, identificador(nombre), sql.Identifier(columna), sql.Identifier(columna_padre),
+                    identificador(padre), sql.Literal(json.dumps(llaves_padre[i:i + lote], default=str))))
+                hijas = {_llave_texto(r[0]): r[0] for r in cursor.fetchall()}
+                conn_source.commit()
+                hijas = {t: l for t, l in hijas.items() if t not in tocadas}
+                stats_tabla["reevaluadas_por_padre"] = stats_tabla.get("reevaluadas_por_padre", 0) + len(hijas)
+                if hijas: aplicar(hijas)
+    finally:
+        cursor.close()
+    return ultimo_lsn, llave, tocadas, list(eliminar.values())
+
+def borrar_llaves_qa(conn_target, tabla_info, llave, llaves, lote):
+    """DELETE en la tabla QA de las llaves que ya no existen (o ya no pasan el filtro) en origen"""
+    destino = destino_tabla(tabla_info)
+    borradas = 0
+    conn_target = conexion_vigente(conn_target)
+    with conn_target.cursor() as cursor:
+        for i in range(0, len(llaves), lote):
+            consulta = sql.SQL("DELETE FROM {} WHERE {}").format(
+                identificador(destino), condicion_llaves(destino, llave, json.dumps(llaves[i:i + lote], default=str)))
+            ejecutar_sql_con_reintentos(cursor, consulta)
+            borradas += cursor.rowcount
+            conn_target.commit()
+    return borradas
+
+def ejecutar_cdc(conn_source, conn_target, tablas, orden, contexto, opciones):
+    """Opción 4: upserts en orden de dependencias, borrados en orden inverso y al final recorte del log"""
+    por_nombre = {t['nombre']: t for t in tablas}
+    horizonte = horizonte_cdc(conn_source)
+    print_log(f"\n🪝 MODO CDC: aplicando cambios anotados antes del txid {horizonte}")
+    log_detalles, pendientes_borrar, aplicado, tocadas = [], [], {}, {}
+
+    for nombre in orden:
+        tabla_info = por_nombre[nombre]
+        print_log(f"\n🔄 Cambios de: {nombre.upper()}")
+        opciones_carga = opciones_tabla(tabla_info, contexto["rendimiento"])
+        stats_tabla = nuevas_stats_tabla(tabla_info, opciones_carga)
+        stats_tabla.update(cambios_leidos=0, registros_eliminados=0)
+        token = _METRICAS_TABLA.set(stats_tabla["metricas"])
+        t0 = time.perf_counter()
+        try:
+            hasta, llave, tocadas[nombre], eliminar = aplicar_cdc_tabla(conn_source, conn_target, tabla_info, contexto, stats_tabla,
+                                                                       opciones, horizonte, tocadas)
+            if not stats_tabla["errores"]:
+                aplicado[nombre] = hasta
+                pendientes_borrar.append((tabla_info, llave, eliminar, stats_tabla))
+        except Exception as e:
+            print_log(f"⚠️ Error aplicando cambios de {nombre}: {e}")
+            stats_tabla["error"] = str(e)
+            for conn in (conn_source, conexion_vigente(conn_target)):
+                try: conn.rollback()
+                except: pass
+        finally:
+            stats_tabla["metricas"]["duracion_segundos"] = round(time.perf_counter() - t0, 4)
+            _METRICAS_TABLA.reset(token)
+        log_detalles.append(stats_tabla)
+
+    for tabla_info, llave, eliminar, stats_tabla in reversed(pendientes_borrar):
+        if not eliminar: continue
+        try:
+            stats_tabla["registros_eliminados"] = borrar_llaves_qa(conn_target, tabla_info, llave, eliminar, int(opciones["lote"]))
+        except Exception as e:
+            print_log(f"⚠️ Error borrando en {destino_tabla(tabla_info)}: {e}")
+            stats_tabla["error"] = str(e)
+            aplicado.pop(tabla_info['nombre'], None) # Su log se queda para la siguiente corrida
+            try: conexion_vigente(conn_target).rollback()
+            except: pass
+
+    for stats_tabla in log_detalles:
+        redondear_metricas(stats_tabla["metricas"])
+        stats_tabla["segundos_carga"] = round(stats_tabla["segundos_carga"], 3)
+        print_log(f"   🪝 {stats_tabla['tabla']}: {stats_tabla['cambios_leidos']} cambios -> "
+                  f"{stats_tabla['registros_insertados']} upserts, {stats_tabla['registros_eliminados']} borrados")
+
+    recortados = recortar_cdc(conn_source, opciones, {n: h for n, h in aplicado.items() if h}, horizonte)
+    print_log(f"   🧹 Log CDC recortado: {recortados} entradas aplicadas")
+    return log_detalles
+
+# ### NUEVO: SINCRONIZACIÓN POR CHECKSUMS (DIFF POR RANGOS, ESTILO MERKLE) ###
+# Opción 5: cada tabla se parte en `tramos` rangos de su columna incremental y Postgres calcula, en origen
+# y en QA, conteo + suma de un hash de 64 bits por fila (independiente del orden). Solo viajan esas tres
+# cifras por rango. Los rangos que difieren se vuelven a partir hasta tener <= `hoja` filas; esos se
+# re-migran (DELETE del rango en QA + extracción normal del rango). Las máscaras determinísticas se
+# reproducen en SQL para comparar el valor ya enmascarado; las aleatorias (faker_name, preserve_format)
+# no se pueden comparar y quedan fuera del hash.
+DIFF_SYNC_DEFAULT = {"tramos": 16, "hoja": 1000, "solo_reportar": False}
+
+MASCARAS_SQL = {
+    "hash_email": "CASE WHEN {c} IS NULL OR {c} = '' THEN NULL "
+                  "ELSE left(encode(sha256(convert_to({c} || {sal}, 'UTF8')), 'hex'), 12) || '@dominio.com' END",
+    "redact_last4": "CASE WHEN {c} IS NULL OR {c} = '' THEN NULL WHEN length({c}) < 5 THEN '' ELSE '---' || right({c}, 4) END",
+}
+
+# Suma (numeric: no se desborda) de los primeros 64 bits del md5 de cada fila: no depende del orden
+SQL_SUMA_HASH = "sum(('x' || substr(md5(ROW({valores})::text), 1, 16))::bit(64)::bigint)"
+SQL_HASH_TRAMOS = """
+    SELECT width_bucket({col}::numeric, {umbrales}::numeric[]), count(*), """ + SQL_SUMA_HASH + """
+    FROM {origen} WHERE {col} > %s AND {col} <= %s GROUP BY 1
+"""
+
+def opciones_diff(config):
+    return {**DIFF_SYNC_DEFAULT, **(config.get('diff_sync') or {})}
+
+def columnas_diff(tabla_info, columnas_origen, columnas_qa):
+    """Columnas que entran al hash (orden de QA) y las que se excluyen por tener máscara aleatoria"""
+    reglas = tabla_info.get('columnas_enmascarar') or {}
+    comunes = [c for c in columnas_qa if c in columnas_origen and c != "etl_batch_id"]
+    excluidas = [c for c in comunes if c in reglas and reglas[c] in MAPPING_FUNCIONES and reglas[c] not in MASCARAS_SQL]
+    return [c for c in comunes if c not in excluidas], excluidas
+
+def expresion_diff(columna, regla=None):
+    """La columna tal como queda en QA: con su máscara en SQL si la tiene"""
+    if regla in MASCARAS_SQL:
+        return sql.SQL(MASCARAS_SQL[regla]).format(c=sql.Identifier(columna), sal=sql.Literal(SALT_EMAIL))
+    return sql.Identifier(columna)
+
+def limites_rango(inferior, superior, tramos):
+    """Parte (inferior, superior] en hasta `tramos` rangos enteros contiguos: [inferior, l1, ..., superior]"""
+    paso = max(1, -(-(superior - inferior) // tramos))
+    return list(range(inferior, superior, paso)) + [superior]
+
+def hashes_tramos(cursor, origen, col, valores, limites):
+    """{tramo: (filas, suma de hashes)} de cada rango (limites[i], limites[i+1]]"""
+    consulta = sql.SQL(SQL_HASH_TRAMOS).format(
+        col=sql.Identifier(col), valores=valores, origen=origen,
+        umbrales=sql.Literal([l + 1 for l in limites[1:-1]])) # width_bucket cuenta umbrales <= valor
+    ejecutar_sql_con_reintentos(cursor, consulta, (limites[0], limites[-1]))
+    resultado = {tramo: (filas, suma) for tramo, filas, suma in cursor.fetchall()}
+    cursor.connection.commit()
+    return resultado
+
+def sincronizar_tabla_diff(tabla_info, conn_source, conn_target, estado, contexto):
+    """Compara origen vs QA por rangos y re-migra solo los rangos que no cuadran"""
+    nombre_tabla = tabla_info['nombre']
+    opciones = contexto["diff_sync"]
+    stats_tabla = nuevas_stats_tabla(tabla_info, opciones_tabla(tabla_info, contexto["rendimiento"]))
+    stats_tabla.update(consultas_hash=0, rangos_comparados=0, rangos_reparados=0, registros_borrados_qa=0)
+    token = _METRICAS_TABLA.set(stats_tabla["metricas"])
+    t0 = time.perf_counter()
+    try:
+        _sincronizar_tabla_diff(tabla_info, conn_source, conn_target, contexto, opciones, stats_tabla)
+    except Exception as e:
+        print_log(f"⚠️ Error comparando {nombre_tabla}: {e}")
+        stats_tabla["error"] = str(e)
+        for conn in (conn_source, conexion_vigente(conn_target)):
+            try: conn.rollback()
+            except: pass
+    finally:
+        stats_tabla["metricas"]["duracion_segundos"] = round(time.perf_counter() - t0, 4)
+        redondear_metricas(stats_tabla["metricas"])
+        stats_tabla["segundos_carga"] = round(stats_tabla["segundos_carga"], 3)
+        _METRICAS_TABLA.reset(token)
+    return stats_tabla
+
+def _sincronizar_tabla_diff(tabla_info, conn_source, conn_target, contexto, opciones, stats_tabla):
+    nombre_tabla = tabla_info['nombre']
+    destino = destino_tabla(tabla_info)
+    print_log(f"\n🔍 Comparando por checksums: {nombre_tabla.upper()} vs {destino}")
+    claves = columnas_marca(tabla_info)
+    if len(claves) != 1:
+        print_log("   ⚠️ La comparación por rangos necesita una columna incremental entera (no compuesta): se omite")
+        return
+    col = claves[0]
+
+    # Mismo conjunto de filas que carga el ETL: consulta base con el filtro del YAML (incluido su LIMIT)
+    sql_final, _ = construir_consulta(tabla_info, {}, False, conn_source)
+    origen = sql.SQL("({}) AS t").format(sql.SQL(sql_final))
+    qa = sql.SQL("{} AS t").format(identificador(destino))
+    cursor_s, cursor_t = conn_source.cursor(), conn_target.cursor()
+    try:
+        ejecutar_sql_con_reintentos(cursor_s, sql.SQL("SELECT * FROM {} LIMIT 0").format(origen))
+        columnas_origen = [d[0] for d in cursor_s.description]
+        plan = obtener_plan_carga(cursor_t, destino, contexto["version_esquema"])
+        columnas, excluidas = columnas_diff(tabla_info, columnas_origen, plan["columnas"])
+        if excluidas:
+            print_log(f"   ℹ  Fuera del hash (máscara aleatoria): {', '.join(excluidas)}")
+        reglas = tabla_info.get('columnas_enmascarar') or {}
+        valores_origen = sql.SQL(", ").join(expresion_diff(c, reglas.get(c)) for c in columnas)
+        valores_qa = sql.SQL(", ").join(map(sql.Identifier, columnas))
+
+        extremos_origen, extremos_qa = [], []
+        for cursor, fuente, extremos in ((cursor_s, origen, extremos_origen), (cursor_t, qa, extremos_qa)):
+            ejecutar_sql_con_reintentos(cursor, sql.SQL("SELECT min({c}), max({c}) FROM {}").format(fuente, c=sql.Identifier(col)))
+            extremos += [v for v in cursor.fetchone() if v is not None]
+            cursor.connection.commit()
+        extremos = extremos_origen + extremos_qa
+        if not extremos:
+            print_log("   ✅ Ambas tablas están vacías")
+            return
+        if not all(isinstance(v, int) for v in extremos):
+            print_log(f"   ⚠️ {col} no es entera: la comparación por rangos no aplica")
+            return
+        superior = max(extremos)
+        if filtro_con_limit(tabla_info):
+            # Con LIMIT el origen solo ve las primeras N llaves; lo que las cargas incrementales dejaron en QA
+            # más allá de ellas es legítimo y no se compara (si no, se borraría sin nada que re-migrar)
+            if not extremos_origen:
+                print_log("   ⚠️ filtro_sql con LIMIT y origen vacío: no hay rango que comparar")
+                return
+            superior = max(extremos_origen)
+            print_log(f"   ℹ  filtro_sql con LIMIT: se compara solo hasta {col} = {superior}")
+
+        # Recorrido por niveles: solo se baja a los rangos cuyo (filas, suma) no coincide
+        pendientes, reparar = [(min(extremos) - 1, superior)], []
+        while pendientes:
+            siguientes = []
+            for inferior, superior in pendientes:
+                limites = limites_rango(inferior, superior, int(opciones["tramos"]))
+                t0 = time.perf_counter()
+                en_origen = hashes_tramos(cursor_s, origen, col, valores_origen, limites)
+                en_qa = hashes_tramos(cursor_t, qa, col, valores_qa, limites)
+                stats_tabla["metricas"]["segundos"]["extraccion"] += time.perf_counter() - t0
+                stats_tabla["consultas_hash"] += 2
+                stats_tabla["rangos_comparados"] += len(limites) - 1
+                for i in range(len(limites) - 1):
+                    if en_origen.get(i) == en_qa.get(i): continue
+                    rango = (limites[i], limites[i + 1])
+                    filas = max(en_origen.get(i, (0, 0))[0], en_qa.get(i, (0, 0))[0])
+                    if filas <= int(opciones["hoja"]) or rango[1] - rango[0] <= 1:
+                        if reparar and reparar[-1][1] == rango[0]: # Contiguo al anterior: un solo viaje
+                            reparar[-1] = (reparar[-1][0], rango[1])
+                        else:
+                            reparar.append(rango)
+                    else:
+                        siguientes.append(rango)
+            pendientes = siguientes
+    finally:
+        cursor_s.close()
+        cursor_t.close()
+
+    if not reparar:
+        print_log(f"   ✅ Sin diferencias ({stats_tabla['rangos_comparados']} rangos, {stats_tabla['consultas_hash']} consultas de hash)")
+        return
+    print_log(f"   ⚠️ {len(reparar)} rango(s) con diferencias: " + ", ".join(f"({a}, {b}]" for a, b in reparar[:10])
+              + (" ..." if len(reparar) > 10 else ""))
+    stats_tabla["rangos_diferentes"] = [list(r) for r in reparar]
+    if opciones["solo_reportar"]: return
+
+    contexto_diff = dict(contexto, estado=None) # Reparar no mueve las marcas de agua
+    borrar = sql.SQL("DELETE FROM {} WHERE {c} > %s AND {c} <= %s").format(identificador(destino), c=sql.Identifier(col))
+    for inferior, superior in reparar:
+        # El DELETE se confirma antes de cargar: cargar_lote confirma (y reintenta) página por página, y un
+        # rollback de reintento no debe llevarse el DELETE. Si la carga falla, el rango queda vacío en QA
+        # y la siguiente comparación lo vuelve a detectar.
+        destino_conn = conexion_vigente(conn_target)
+        with destino_conn.cursor() as cursor:
+            ejecutar_sql_con_reintentos(cursor, borrar, (inferior, superior))
+            stats_tabla["registros_borrados_qa"] += cursor.rowcount
+        destino_conn.commit()
+        migrar_consulta(conn_source, destino_conn, tabla_info, _sql_rango(conn_source, sql_final, col, inferior, superior),
+                        contexto_diff, stats_tabla, None)
+        stats_tabla["rangos_reparados"] += 1
+    print_log(f"   🔧 Re-migrados {stats_tabla['rangos_reparados']} rango(s): {stats_tabla['registros_borrados_qa']} filas "
+              f"reemplazadas en QA por {stats_tabla['registros_insertados']} de origen")
+
+# ### NUEVO: VERIFICACIÓN EN EL SERVIDOR (RECONCILIACIÓN SIN TRAER FILAS) ###
+# Opción 6, o `verificacion.al_terminar` después de cada carga. Por tabla, una sola consulta en cada lado:
+# conteo, MIN/MAX de la(s) columna(s) incremental(es), SUM de las columnas numéricas sin máscara y la suma
+# de hashes por fila (mismas columnas que el diff por checksums). El origen se consulta con el filtro del
+# YAML, es decir, contra las filas que QA *debería* tener. Solo viaja un renglón de agregados por lado.
+VERIFICACION_DEFAULT = {"al_terminar": False}
+
+def agregados_tabla(cursor, origen, claves, sumas, valores_hash):
+    """Un renglón con conteo, extremos, sumas y hash de `origen` (valores listos para JSON)"""
+    nombres = ["filas"] + [f"{f}({c})" for c in claves for f in ("min", "max")] + [f"sum({c})" for c in sumas] + ["hash"]
+    expresiones = ([sql.SQL("count(*)")]
+                   + [sql.SQL("{}({})").format(sql.SQL(f), sql.Identifier(c)) for c in claves for f in ("min", "max")]
+                   + [sql.SQL("sum({})").format(sql.Identifier(c)) for c in sumas]
+                   + [sql.SQL(SQL_SUMA_HASH).format(valores=valores_hash)])
+    ejecutar_sql_con_reintentos(cursor, sql.SQL("SELECT {} FROM {}").format(sql.SQL(", ").join(expresiones), origen))
+    fila = cursor.fetchone()
+    cursor.connection.commit()
+    agregados = dict(zip(nombres, (marca_json(v) for v in fila)))
+    if agregados["hash"] is not None: # Solo importan 64 bits: más corto y legible en la auditoría
+        agregados["hash"] = format(int(decimal.Decimal(agregados["hash"])) % 2 ** 64, "016x")
+    return agregados
+
+def verificar_tabla(tabla_info, conn_source, conn_target, estado, contexto):
+    """Compara los agregados de origen (filtrado) y QA de una tabla. Misma firma que procesar_tabla"""
+    nombre_tabla = tabla_info['nombre']
+    destino = destino_tabla(tabla_info)
+    resultado = {"tabla": nombre_tabla, "registros_leidos": 0, "registros_insertados": 0, "errores": [],
+                 "metricas": nuevas_metricas_tabla()}
+    t0 = time.perf_counter()
+    cursor_s, cursor_t = conn_source.cursor(), conn_target.cursor()
+    try:
+        sql_final, _ = construir_consulta(tabla_info, {}, False, conn_source)
+        origen = sql.SQL("({}) AS t").format(sql.SQL(sql_final))
+        qa = sql.SQL("{} AS t").format(identificador(destino))
+        ejecutar_sql_con_reintentos(cursor_s, sql.SQL("SELECT * FROM {} LIMIT 0").format(origen))
+        columnas_origen = [d[0] for d in cursor_s.description]
+        ejecutar_sql_con_reintentos(cursor_t, sql.SQL("SELECT * FROM {} LIMIT 0").format(qa))
+        columnas_qa = [d[0] for d in cursor_t.description]
+        numericas_qa = {d[0] for d in cursor_t.description if d[1] == psycopg2.NUMBER}
+        for conn in (conn_source, conn_target): conn.commit()
+
+        reglas = tabla_info.get('columnas_enmascarar') or {}
+        claves = columnas_marca(tabla_info)
+        columnas, excluidas = columnas_diff(tabla_info, columnas_origen, columnas_qa)
+        sumas = [c for c in columnas if c in numericas_qa and c not in reglas and c not in claves]
+        en_origen = agregados_tabla(cursor_s, origen, claves, sumas,
+                                    sql.SQL(", ").join(expresion_diff(c, reglas.get(c)) for c in columnas))
+        en_qa = agregados_tabla(cursor_t, qa, claves, sumas, sql.SQL(", ").join(map(sql.Identifier, columnas)))
+        diferencias = [k for k in en_origen if en_origen[k] != en_qa.get(k)]
+        resultado["verificacion"] = {"ok": not diferencias, "diferencias": diferencias, "origen": en_origen, "qa": en_qa,
+                                     "fuera_del_hash": excluidas}
+        if diferencias:
+            print_log(f"   ❌ {nombre_tabla}: no cuadra " + ", ".join(f"{k} ({en_origen[k]} vs {en_qa.get(k)})" for k in diferencias))
+        else:
+            print_log(f"   ✅ {nombre_tabla}: {en_origen['filas']} filas; coinciden " + ", ".join(k for k in en_origen if k != "filas"))
+    except Exception as e:
+        print_log(f"   ⚠️ No se pudo verificar {nombre_tabla}: {e}")
+        resultado["error"] = str(e)
+        for conn in (conn_source, conn_target):
+            try: conn.rollback()
+            except: pass
+    finally:
+        cursor_s.close()
+        cursor_t.close()
+        resultado["metricas"]["duracion_segundos"] = round(time.perf_counter() - t0, 4)
+    return resultado
+
+def verificar_migracion(pool_source, pool_target, tablas, contexto, max_concurrencia):
+    """Verifica todas las tablas en paralelo (conexiones del pool). Devuelve {tabla: verificacion}"""
+    def verificar_con_pool(tabla_info):
+        conn_s, conn_t = pool_source.getconn(), registrar_conexion(pool_target.getconn(), pool_target)
+        try:
+            return verificar_tabla(tabla_info, conn_s, conn_t, None, contexto)
+        finally:
+            pool_source.putconn(conn_s)
+            devolver_conexion(pool_target, conn_t)
+
+    print_log("\n🧮 Verificando en el servidor (agregados de origen filtrado vs QA)...")
+    resultados = ejecutar_planificador(tablas, {t['nombre']: set() for t in tablas}, verificar_con_pool, max_concurrencia)
+    return {r["tabla"]: r.get("verificacion") or {"ok": False, "error": r.get("error")} for r in resultados}
+
+def resumen_verificacion(verificaciones):
+    """Lo que va al log final: si todo cuadró y qué tablas no"""
+    return {"ok": all(v.get("ok") for v in verificaciones.values()),
+            "tablas_con_diferencias": [t for t, v in verificaciones.items() if not v.get("ok")]}
+
 # --- PROCESO ETL PRINCIPAL ---
 
+SQL_AUDITORIA = """
+    INSERT INTO auditoria_logs (execution_id, fecha_inicio, fecha_fin, tablas_procesadas, total_registros, detalle_json)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+def armar_log_final(execution_id, usuario_rol, fecha_inicio, fecha_fin, total_registros, log_detalles, reanuda=None, metricas=None):
+    """Objeto JSON final de la auditoría (PUNTO 5)"""
+    log_final = {
+        "execution_id": execution_id,
+        "usuario": usuario_rol, # ### PUNTO 8: Registramos quién corrió el proceso ###
+        "inicio": str(fecha_inicio),
+        "fin": str(fecha_fin),
+        "total_registros_movidos": total_registros,
+        "detalles_por_tabla": log_detalles
+    }
+    if reanuda: # ### NUEVO: Ejecución que retomó una anterior interrumpida ###
+        log_final["reanuda_ejecucion"] = reanuda
+        log_final["filas_omitidas_reanudacion"] = sum(d.get("filas_omitidas_reanudacion", 0) for d in log_detalles)
+    if metricas: # ### NUEVO: Métricas de toda la ejecución (conexión, limpieza, reintentos) ###
+        log_final["metricas"] = metricas
+    if _PERFIL.get("modo"): # ### NUEVO: Dónde quedaron los reportes de --profile ###
+        log_final["perfil"] = {"modo": _PERFIL["modo"], "directorio": _PERFIL["directorio"]}
+    return log_final
+
+def metricas_ejecucion(modo, motor):
+    """Copia de METRICAS_EJECUCION para el log final"""
+    with _LOCK_METRICAS:
+        return {"modo": modo, "motor": motor,
+                "etapas": {k: round(v, 4) for k, v in METRICAS_EJECUCION["etapas"].items()},
+                "reintentos": dict(METRICAS_EJECUCION["reintentos"])}
+
+# ### NUEVO: HISTORIAL LOCAL APPEND-ONLY (JSONL) CON ROTACIÓN E ÍNDICE ###
+# Antes cada ejecución leía todo logs_historial.json y lo reescribía con indent=4 (O(n) por corrida),
+# y el dashboard lo volvía a parsear completo en cada rerun. Ahora cada ejecución agrega UNA línea
+# a logs_historial.jsonl; al pasar de cierto tamaño o antigüedad el archivo se rota (y se comprime
+# con gzip si se pide). logs_indice.json guarda los totales y las últimas N ejecuciones para los KPIs.
+ROTACION_LOGS_DEFAULT = {"max_mb": 10, "max_dias": 30, "gzip": True, "ultimas": 50}
+
+def _opciones_logs(opciones):
+    return {**ROTACION_LOGS_DEFAULT, **(opciones or {})}
+
+def _resumen_log(log_final):
+    """Lo que el índice guarda de cada ejecución (sin el detalle por tabla)"""
+    resumen = {k: log_final[k] for k in ("execution_id", "usuario", "inicio", "fin", "total_registros_movidos", "resultado")
+               if k in log_final}
+    resumen.setdefault("total_registros_movidos", 0)
+    resumen["tablas"] = len(log_final.get("detalles_por_tabla", []))
+    return resumen
+
+def _indice_vacio():
+    return {"ejecuciones": 0, "bloqueadas": 0, "total_registros_movidos": 0, "segmento_inicio": None, "ultimas": []}
+
+def _sumar_al_indice(indice, log_final, ultimas):
+    indice["ejecuciones"] += 1
+    indice["total_registros_movidos"] += log_final.get("total_registros_movidos", 0)
+    if log_final.get("resultado") == "BLOQUEADO": indice["bloqueadas"] += 1
+    indice["ultimas"] = (indice["ultimas"] + [_resumen_log(log_final)])[-ultimas:]
+
+def _escribir_indice(indice):
+    temporal = f"{ARCHIVO_LOG_INDICE}.tmp" # Atómico, como state.json
+    with open(temporal, "w") as f:
+        json.dump(indice, f, indent=4)
+    os.replace(temporal, ARCHIVO_LOG_INDICE)
+
+def archivos_logs():
+    """Archivos del historial del más viejo al más nuevo: rotados (.jsonl / .jsonl.gz) y el activo"""
+    base, _ = os.path.splitext(ARCHIVO_LOGS)
+    rotados = sorted(glob.glob(f"{base}-*.jsonl") + glob.glob(f"{base}-*.jsonl.gz"))
+    return rotados + ([ARCHIVO_LOGS] if os.path.exists(ARCHIVO_LOGS) else [])
+
+# ### NUEVO: Lock entre procesos (flock sobre logs_indice.json.lock) ###
+# La CLI, app.py y los benchmarks pueden guardar al mismo tiempo: sin él, dos procesos rotan el mismo
+# archivo o se pisan el índice. El RLock de hilos va primero; el flock se toma solo en el primer nivel.
+_LOCK_LOGS_ARCHIVO = {"f": None, "nivel": 0}
+
+@contextmanager
+def lock_logs():
+    with _LOCK_LOGS:
+        if _LOCK_LOGS_ARCHIVO["nivel"] == 0 and fcntl is not None:
+            f = open(f"{ARCHIVO_LOG_INDICE}.lock", "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            _LOCK_LOGS_ARCHIVO["f"] = f
+        _LOCK_LOGS_ARCHIVO["nivel"] += 1
+        try:
+            yield
+        finally:
+            _LOCK_LOGS_ARCHIVO["nivel"] -= 1
+            if _LOCK_LOGS_ARCHIVO["nivel"] == 0 and _LOCK_LOGS_ARCHIVO["f"] is not None:
+                _LOCK_LOGS_ARCHIVO["f"].close() # Cerrar el descriptor libera el flock
+                _LOCK_LOGS_ARCHIVO["f"] = None
+
+def _leer_archivo_logs(ruta):
+    if not os.path.exists(ruta): return []
+    historial = []
+    abrir = gzip.open if ruta.endswith(".gz") else open
+    with abrir(ruta, "rt", encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip(): continue
+            try: historial.append(json.loads(linea))
+            except ValueError: pass # Línea truncada por un corte: se ignora
+    return historial
+
+def leer_historial_logs(incluir_rotados=True):
+    """Lee el historial completo (solo para la vista detallada; los KPIs usan el índice)"""
+    historial = []
+    for ruta in (archivos_logs() if incluir_rotados else [ARCHIVO_LOGS]):
+        historial.extend(_leer_archivo_logs(ruta))
+    return historial
+
+def _migrar_logs_legado():
+    """Convierte una sola vez el logs_historial.json anterior a JSONL"""
+    if not os.path.exists(ARCHIVO_LOGS_LEGADO) or os.path.exists(ARCHIVO_LOGS): return
+    try:
+        with open(ARCHIVO_LOGS_LEGADO, "r") as f: historial = json.load(f)
+    except: historial = []
+    with open(ARCHIVO_LOGS, "a", encoding="utf-8") as f:
+        for log in historial:
+            f.write(json.dumps(log, ensure_ascii=False, default=str) + "\n")
+    os.replace(ARCHIVO_LOGS_LEGADO, f"{ARCHIVO_LOGS_LEGADO}.migrado")
+
+def cargar_indice_logs(opciones=None):
+    """Índice del historial. Si no existe (o está corrupto) se reconstruye leyendo el historial una vez"""
+    def leer():
+        if os.path.exists(ARCHIVO_LOG_INDICE):
+            try:
+                with open(ARCHIVO_LOG_INDICE, "r") as f: return json.load(f)
+            except: pass
+        return None
+
+    indice = leer() # Sin lock: el índice se reemplaza atómico, nunca se ve a medias
+    if indice is not None: return indice
+    with lock_logs():
+        indice = leer() # Otro proceso pudo reconstruirlo mientras esperábamos
+        if indice is not None: return indice
+        _migrar_logs_legado()
+        indice = _indice_vacio()
+        for ruta in archivos_logs():
+            logs = _leer_archivo_logs(ruta)
+            for log in logs:
+                _sumar_al_indice(indice, log, _opciones_logs(opciones)["ultimas"])
+            if ruta == ARCHIVO_LOGS and logs:
+                # El segmento activo empezó con su primera ejecución (el mtime cambia con cada línea nueva)
+                try:
+                    datetime.datetime.fromisoformat(logs[0].get("inicio"))
+                    indice["segmento_inicio"] = logs[0]["inicio"]
+                except (TypeError, ValueError): pass
+        _escribir_indice(indice)
+    return indice
+
+def _rotar_logs(indice, opciones):
+    """Renombra el archivo activo si pasó de `max_mb` o de `max_dias`, y lo comprime si `gzip`"""
+    if not os.path.exists(ARCHIVO_LOGS): return
+    muy_grande = os.path.getsize(ARCHIVO_LOGS) >= opciones["max_mb"] * 1024 * 1024
+    inicio = indice.get("segmento_inicio")
+    muy_viejo = bool(inicio) and datetime.datetime.now() - datetime.datetime.fromisoformat(inicio) >= datetime.timedelta(days=opciones["max_dias"])
+    if not (muy_grande or muy_viejo): return
+
+    base, _ = os.path.splitext(ARCHIVO_LOGS)
+    rotado = f"{base}-{datetime.datetime.now():%Y%m%d-%H%M%S-%f}.jsonl"
+    os.replace(ARCHIVO_LOGS, rotado)
+    if opciones["gzip"]:
+        with open(rotado, "rb") as origen, gzip.open(f"{rotado}.gz", "wb") as destino:
+            shutil.copyfileobj(origen, destino)
+        os.remove(rotado)
+    indice["segmento_inicio"] = None
+    print_log(f"   🗄  Historial rotado: {os.path.basename(rotado)}{'.gz' if opciones['gzip'] else ''}")
+
+def guardar_log_local(log_final, opciones=None):
+    """Agrega la ejecución como una línea del historial JSONL y actualiza el índice"""
+    opciones = _opciones_logs(opciones)
+    with lock_logs(): # Entre hilos y entre procesos: rotación, línea nueva e índice van juntos
+        indice = cargar_indice_logs(opciones) # Dentro del lock: leído fuera, dos hilos pisarían el total del otro
+        _rotar_logs(indice, opciones)
+        with open(ARCHIVO_LOGS, "a", encoding="utf-8") as f:
+            f.write(json.dumps(log_final, ensure_ascii=False, default=str) + "\n")
+        if not indice.get("segmento_inicio"):
+            indice["segmento_inicio"] = datetime.datetime.now().isoformat()
+        _sumar_al_indice(indice, log_final, opciones["ultimas"])
+        _escribir_indice(indice)
+
+# ### NUEVO: EXPORTACIÓN PROMETHEUS (node_exporter, textfile collector) ###
+# Al terminar cada ejecución se reescribe un archivo .prom con los valores de la ÚLTIMA corrida
+# (gauges + histograma de latencia por lote). node_exporter lo publica y Prometheus puede alertar
+# si, por ejemplo, etl_tabla_filas_por_segundo cae o etl_ultima_ejecucion_exito vale 0.
+def _etiquetas(**etiquetas):
+    partes = []
+    for k, v in etiquetas.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{k}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+def formatear_prometheus(log_final):
+    """Texto en formato de exposición de Prometheus a partir del log final de una ejecución"""
+    metricas = log_final.get("metricas", {})
+    base = {"modo": metricas.get("modo", ""), "motor": metricas.get("motor", "")}
+    detalles = log_final.get("detalles_por_tabla", [])
+    series = {} # nombre -> (tipo, ayuda, [líneas])
+
+    def agregar(nombre, clase, ayuda, valor, **etiquetas):
+        series.setdefault(nombre, (clase, ayuda, []))[2].append(f"{nombre}{_etiquetas(**base, **etiquetas)} {valor}")
+
+    fin = datetime.datetime.fromisoformat(log_final["fin"])
+    inicio = datetime.datetime.fromisoformat(log_final["inicio"])
+    exito = all(not d.get("error") and not d.get("errores") for d in detalles)
+    agregar("etl_ultima_ejecucion_fin_timestamp_segundos", "gauge", "Fin de la última ejecución (epoch)", round(fin.timestamp(), 3))
+    agregar("etl_ultima_ejecucion_duracion_segundos", "gauge", "Duración de la última ejecución", round((fin - inicio).total_seconds(), 3))
+    agregar("etl_ultima_ejecucion_exito", "gauge", "1 si ninguna tabla reportó errores", int(exito))
+    agregar("etl_ultima_ejecucion_filas", "gauge", "Filas leídas en la última ejecución", log_final.get("total_registros_movidos", 0))
+    for etapa, segundos in metricas.get("etapas", {}).items():
+        agregar("etl_ultima_ejecucion_etapa_segundos", "gauge", "Segundos por etapa global (conexión, limpieza, auditoría...)", segundos, etapa=etapa)
+    for operacion, veces in metricas.get("reintentos", {}).items():
+        agregar("etl_ultima_ejecucion_reintentos", "gauge", "Reintentos de los helpers *_con_reintentos", veces, operacion=operacion)
+
+    for d in detalles:
+        tabla = d["tabla"]
+        m = d.get("metricas") or {}
+        agregar("etl_tabla_exito", "gauge", "1 si la tabla terminó sin errores", int(not d.get("error") and not d.get("errores")), tabla=tabla)
+        if d.get("verificacion"): # ### NUEVO: Reconciliación en el servidor ###
+            agregar("etl_tabla_verificacion_ok", "gauge", "1 si los agregados de origen y QA coinciden", int(bool(d["verificacion"].get("ok"))), tabla=tabla)
+        agregar("etl_tabla_filas", "gauge", "Filas por tabla en la última ejecución", d.get("registros_leidos", 0), tabla=tabla, tipo="leidas")
+        agregar("etl_tabla_filas", "gauge", "Filas por tabla en la última ejecución", d.get("registros_insertados", 0), tabla=tabla, tipo="insertadas")
+        if m.get("duracion_segundos"):
+            agregar("etl_tabla_filas_por_segundo", "gauge", "Filas insertadas / duración de la tabla",
+                    round(d.get("registros_insertados", 0) / m["duracion_segundos"], 1), tabla=tabla)
+        for etapa, segundos in m.get("segundos", {}).items():
+            agregar("etl_tabla_etapa_segundos", "gauge", "Segundos por etapa de la tabla", segundos, tabla=tabla, etapa=etapa)
+        for regla, segundos in m.get("segundos_por_regla", {}).items():
+            agregar("etl_tabla_regla_segundos", "gauge", "Segundos por regla de enmascaramiento", segundos, tabla=tabla, regla=regla)
+        for direccion in ("leidos", "enviados"):
+            if f"bytes_{direccion}" in m:
+                agregar("etl_tabla_bytes", "gauge", "Bytes aproximados (texto) leídos del origen / enviados al destino",
+                        m[f"bytes_{direccion}"], tabla=tabla, direccion=direccion)
+        for operacion, veces in m.get("reintentos", {}).items():
+            agregar("etl_tabla_reintentos", "gauge", "Reintentos atribuidos a la tabla", veces, tabla=tabla, operacion=operacion)
+        hist = m.get("latencia_lote")
+        if hist and hist["n"]:
+            acumulado = 0
+            for limite, conteo in zip(hist["limites"] + ["+Inf"], hist["conteos"]):
+                acumulado += conteo
+                agregar("etl_tabla_latencia_lote_segundos_bucket", "histogram", "", acumulado, tabla=tabla, le=limite)
+            agregar("etl_tabla_latencia_lote_segundos_sum", "histogram", "", hist["suma"], tabla=tabla)
+            agregar("etl_tabla_latencia_lote_segundos_count", "histogram", "", hist["n"], tabla=tabla)
+
+    lineas = []
+    cabecera_hist = False
+    for nombre, (tipo, ayuda, valores) in series.items():
+        if tipo == "histogram": # Un solo HELP/TYPE para las tres series del histograma
+            if not cabecera_hist:
+                lineas += ["# HELP etl_tabla_latencia_lote_segundos Latencia por lote (carga + commit)",
+                           "# TYPE etl_tabla_latencia_lote_segundos histogram"]
+                cabecera_hist = True
+        else:
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+        lineas += valores
+    return "\n".join(lineas) + "\n"
+
+def exportar_prometheus(log_final, opciones):
+    """Escribe el .prom de forma atómica (el textfile collector nunca debe leer un archivo a medias)"""
+    ruta = (opciones or {}).get("prometheus_textfile")
+    if not ruta: return
+    try:
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            f.write(formatear_prometheus(log_final))
+        os.replace(temporal, ruta)
+        print_log(f"📈 Métricas Prometheus en: {ruta}")
+    except Exception as e:
+        print_log(f"⚠️ No se pudieron exportar las métricas Prometheus: {e}")
+
+# ### NUEVO: ENSAYO CON ESTADÍSTICAS DEL CATÁLOGO (OPCIÓN 3) ###
+# Antes el ensayo hacía SELECT COUNT(*) por tabla: un full scan, lo más lento de todo lo que corre el ETL.
+# Ahora cada tabla cuesta dos lecturas del catálogo: reltuples/tamaño en pg_class y EXPLAIN (FORMAT JSON)
+# de la misma consulta de extracción (filtro_sql, marca de agua, LIMIT). El planificador da filas y ancho
+# estimados, y las filas/seg de cargas anteriores (auditoria_logs) dan el tiempo proyectado.
+# El conteo exacto queda como opción (--exacto, `ensayo.conteo_exacto` o la casilla de app.py).
+ENSAYO_DEFAULT = {"conteo_exacto": False, "historial": 20} # historial: ejecuciones de auditoría a promediar
+
+SQL_ESTADISTICAS_TABLA = "SELECT reltuples::bigint, pg_total_relation_size(oid) FROM pg_class WHERE oid = %s::regclass"
+
+def estimar_consulta(cursor, consulta):
+    """(filas, bytes) que el planificador espera de la consulta, sin ejecutarla"""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + consulta)
+    plan = cursor.fetchone()[0]
+    raiz = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+    return int(raiz["Plan Rows"]), int(raiz["Plan Rows"] * raiz["Plan Width"])
+
+def detalles_auditoria(cursor_target, ultimas):
+    """detalle_json de las últimas ejecuciones en auditoria_logs (o del historial local si no se puede leer)"""
+    try:
+        cursor_target.execute("SELECT detalle_json FROM auditoria_logs ORDER BY fecha_fin DESC NULLS LAST LIMIT %s", (ultimas,))
+        ejecuciones = []
+        for (detalle,) in cursor_target.fetchall():
+            try: ejecuciones.append(json.loads(detalle))
+            except (TypeError, ValueError): pass
+        cursor_target.connection.commit()
+        return ejecuciones
+    except Exception:
+        cursor_target.connection.rollback()
+        return [log.get("detalles_por_tabla", []) for log in leer_historial_logs(incluir_rotados=False)[-ultimas:]]
+
+def rendimiento_historico(ejecuciones):
+    """Filas/seg de extremo a extremo por tabla (y global) en cargas completas e incrementales anteriores"""
+    filas, segundos = {}, {}
+    for detalles in ejecuciones:
+        for d in detalles if isinstance(detalles, list) else []:
+            duracion = (d.get("metricas") or {}).get("duracion_segundos")
+            if not d.get("registros_leidos") or not duracion: continue
+            if "consultas_hash" in d or "cambios_leidos" in d: continue # Diff y CDC no leen la tabla completa
+            filas[d["tabla"]] = filas.get(d["tabla"], 0) + d["registros_leidos"]
+            segundos[d["tabla"]] = segundos.get(d["tabla"], 0.0) + duracion
+    por_tabla = {t: filas[t] / segundos[t] for t in filas}
+    total = sum(segundos.values())
+    return por_tabla, (sum(filas.values()) / total if total else None)
+
+def formato_bytes(n):
+    for unidad in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unidad == "GB": break
+        n /= 1024
+    return f"{n:,.0f} {unidad}" if unidad == "B" else f"{n:,.1f} {unidad}"
+
+def ensayar_tabla(cursor_source, tabla_info, estado, velocidades, conteo_exacto=False):
+    """Estimación de una tabla para el ensayo. Devuelve {filas, bytes, segundos} de la extracción completa"""
+    nombre = tabla_info['nombre']
+    ejecutar_sql_con_reintentos(cursor_source, SQL_ESTADISTICAS_TABLA, (nombre,))
+    reltuples, tamano = cursor_source.fetchone()
+    catalogo = f"~{reltuples:,} filas en catálogo" if reltuples >= 0 else "sin estadísticas (falta ANALYZE)"
+    print_log(f"   ✅ Tabla '{nombre}': Conexión OK. {catalogo}, {formato_bytes(tamano)} en disco")
+
+    sql_completa, _ = construir_consulta(tabla_info, estado, False, cursor_source.connection)
+    filas, bytes_est = estimar_consulta(cursor_source, sql_completa)
+    linea = f"      Extracción completa: ~{filas:,} filas, ~{formato_bytes(bytes_est)}"
+    if estado.get(nombre): # Con marca de agua: lo que leería la siguiente incremental
+        sql_delta, marca = construir_consulta(tabla_info, estado, True, cursor_source.connection)
+        linea += f" | Incremental (> {marca}): ~{estimar_consulta(cursor_source, sql_delta)[0]:,} filas"
+    print_log(linea)
+
+    velocidad, origen = velocidades[0].get(nombre), "historial de la tabla"
+    if velocidad is None:
+        velocidad, origen = velocidades[1], "promedio de todas las tablas"
+    segundos = filas / velocidad if velocidad else None
+    if segundos is not None:
+        print_log(f"      Proyección: ~{segundos:,.1f}s a {velocidad:,.0f} filas/s ({origen})")
+    else:
+        print_log("      Proyección: sin cargas anteriores en la auditoría")
+
+    if conteo_exacto: # Opt-in: recorre la tabla completa
+        ejecutar_sql_con_reintentos(cursor_source, f"SELECT COUNT(*) FROM ({sql_completa}) AS etl_conteo")
+        print_log(f"      Conteo exacto (con filtro): {cursor_source.fetchone()[0]:,} filas")
+    cursor_source.connection.commit()
+    return {"filas": filas, "bytes": bytes_est, "segundos": segundos}
+
+def conteo_exacto_cli():
+    return "--exacto" in sys.argv[1:]
+
+def argumentos_cli():
+    """Argumentos posicionales de la línea de comandos (sin las banderas --xxx)"""
+    return [a for a in sys.argv[1:] if not a.startswith("--")]
+
+def perfil_cli():
+    """--profile -> "completo"; --profile=muestreo -> "muestreo" """
+    for a in sys.argv[1:]:
+        if a == "--profile": return "completo"
+        if a.startswith("--profile="): return a.split("=", 1)[1]
+    return None
+
 # Modificado para recibir argumentos de la Web
-def ejecutar_migracion(rol_web=None, opcion_web=None):
+def ejecutar_migracion(rol_web=None, opcion_web=None, motor_web=None, perfil_web=None, conteo_exacto_web=None):
+    try:
+        return _ejecutar_migracion(rol_web, opcion_web, motor_web, perfil_web, conteo_exacto_web)
+    finally:
+        directorio = terminar_perfilado() # ### NUEVO: --profile ###
+        if directorio:
+            print_log(f"🔬 Reportes de perfilado en: {directorio}")
+
+def _ejecutar_migracion(rol_web=None, opcion_web=None, motor_web=None, perfil_web=None, conteo_exacto_web=None):
     global LOG_BUFFER
     LOG_BUFFER = [] # Limpiar logs
+    reiniciar_metricas_ejecucion() # ### NUEVO: Métricas de esta ejecución ###
     
     # ### PUNTO 10: MODOS AUTOMÁTICO (SCHEDULER) Y MANUAL ###
     # Si recibimos argumentos desde la web, los usamos. Si no, revisamos sys.argv
@@ -154,9 +3231,9 @@ def ejecutar_migracion(rol_web=None, opcion_web=None):
         usuario_rol = rol_web
         opcion = str(opcion_web)
         print_log(f"\n🤖 MODO WEB: {usuario_rol} - Opción {opcion}")
-    elif len(sys.argv) > 2:
-        usuario_rol = sys.argv[1].lower()
-        opcion = sys.argv[2]
+    elif len(argumentos_cli()) > 1:
+        usuario_rol = argumentos_cli()[0].lower()
+        opcion = argumentos_cli()[1]
         print_log(f"\n🤖 MODO AUTOMÁTICO (Scheduler) DETECTADO")
         print_log(f"   Rol: {usuario_rol}")
         print_log(f"   Opción: {opcion}")
@@ -171,7 +3248,6 @@ def ejecutar_migracion(rol_web=None, opcion_web=None):
     execution_id = str(uuid.uuid4())   # Generamos un ID único para este reporte
     fecha_inicio = datetime.datetime.now()
     log_detalles = [] # Lista para guardar el reporte de cada tabla
-    total_registros_global = 0
     # -----------------------------------
 
     config = cargar_config()
@@ -181,7 +3257,10 @@ def ejecutar_migracion(rol_web=None, opcion_web=None):
     print_log(f"👤 Usuario: {usuario_rol.upper()}") # ### PUNTO 8: Mostramos quién está logueado ###
 
     # Interpretación de opciones
-    es_incremental = (opcion == "2")
+    es_cdc = (opcion == "4") # ### NUEVO: Captura de cambios (triggers en origen) ###
+    es_diff = (opcion == "5") # ### NUEVO: Sincronización por checksums (solo re-migra los rangos con diferencias) ###
+    es_verificacion = (opcion == "6") # ### NUEVO: Solo lectura: agregados en el servidor, origen vs QA ###
+    es_incremental = (opcion == "2") or es_cdc or es_diff or es_verificacion # Ninguno de estos vacía el destino
     es_dry_run = (opcion == "3") # ### PUNTO 10: Bandera para modo ensayo ###
 
     # ### PUNTO 8: VALIDACIÓN DE PERMISOS (RBAC) ###
@@ -203,277 +3282,246 @@ def ejecutar_migracion(rol_web=None, opcion_web=None):
             "resultado": "BLOQUEADO"
         }
         # Guardamos log local del intento fallido
-        historial = []
-        if os.path.exists(ARCHIVO_LOGS):
-            try:
-                with open(ARCHIVO_LOGS, "r") as f: historial = json.load(f)
-            except: pass
-        historial.append(log_final)
-        with open(ARCHIVO_LOGS, "w") as f: json.dump(historial, f, indent=4)
+        guardar_log_local(log_final, config.get('auditoria_local'))
         
         return "\n".join(LOG_BUFFER) # TERMINAMOS EL PROGRAMA AQUÍ POR SEGURIDAD
     # ---------------------------------------
 
     # 1. CONEXIÓN A LA BASE DE DATOS (CON REINTENTOS)
+    rendimiento = config.get('rendimiento', {}) or {} # ### NUEVO: Parámetros de rendimiento (opcionales) ###
+    configurar_reintentos(config.get('reintentos')) # ### NUEVO: Backoff exponencial (también lo usa el motor async) ###
+
+    # ### NUEVO: --profile / casilla de app.py / perfilado.modo en el YAML ###
+    perfilado = config.get('perfilado', {}) or {}
+    modo_perfil = perfil_web or (perfil_cli() if not rol_web else None) or perfilado.get('modo')
+    if modo_perfil and modo_perfil not in MODOS_PERFIL:
+        print_log(f"⚠️ Modo de perfilado desconocido '{modo_perfil}' (use completo o muestreo): se ignora")
+    iniciar_perfilado(modo_perfil, perfilado, execution_id)
+
+    # ### NUEVO: ¿Quedó a medias la ejecución anterior? (el ensayo no toca el estado) ###
+    reanuda = None
+    # Solo las cargas (opciones 1 y 2) ponen y quitan la marca; CDC, diff y verificación la dejan intacta
+    # para que una carga interrumpida se siga retomando después de ellas
+    usa_reanudacion = not (es_dry_run or es_cdc or es_diff or es_verificacion)
+    if usa_reanudacion:
+        es_incremental, reanuda = preparar_reanudacion(estado, es_incremental, execution_id, rendimiento)
+
+    # ### NUEVO: Motor asíncrono (asyncpg). El ensayo siempre usa el motor síncrono ###
+    motor_cli = argumentos_cli()[2] if (not rol_web and len(argumentos_cli()) > 2) else None
+    motor = (motor_web or motor_cli or rendimiento.get('motor', 'sync')).lower()
+    if motor == "async" and (es_cdc or es_diff or es_verificacion):
+        print_log("ℹ️ Los modos CDC, diff y verificación usan el motor síncrono (mueven pocas filas).")
+    elif motor == "async" and not es_dry_run:
+        import etl_async # Import perezoso: asyncpg es opcional
+        etl_async.ejecutar_migracion_async(config, estado, usuario_rol, es_incremental, execution_id, fecha_inicio, reanuda)
+        return "\n".join(LOG_BUFFER)
+    max_concurrencia = max(1, int(rendimiento.get('max_concurrencia', 1))) # ### NUEVO: Tablas en paralelo ###
+
     print_log("🔌 Conectando a Supabase (con soporte a fallos)...")
     try:
         # ### PUNTO 6: Usamos la función segura ###
-        conn_source = conectar_con_reintentos(config['database']['source_url'])
+        # ### NUEVO: Un pool por base; cada tabla en paralelo toma su propia conexión ###
+        t0 = time.perf_counter()
+        pool_source = crear_pool_con_reintentos(config['database']['source_url'], max_concurrencia)
+        pool_target = crear_pool_con_reintentos(config['database']['target_url'], max_concurrencia + 1) # +1: publicación/auditoría
+        sumar_etapa_ejecucion("conexion", time.perf_counter() - t0)
+
+        conn_source = pool_source.getconn()
         cursor_source = conn_source.cursor()
         
-        conn_target = conectar_con_reintentos(config['database']['target_url'])
+        conn_target = pool_target.getconn()
         cursor_target = conn_target.cursor()
         
     except Exception as e:
-        print_log(f"❌ Error crítico: No se pudo conectar tras {MAX_REINTENTOS} intentos.")
+        print_log(f"❌ Error crítico: No se pudo conectar tras {REINTENTOS['max_intentos']} intentos: {e}")
         return "\n".join(LOG_BUFFER)
 
     # ### PUNTO 10: LÓGICA DRY-RUN (ENSAYO) ###
     if es_dry_run:
         print_log("\n🧪 MODO ENSAYO ACTIVADO: No se modificarán datos.")
-        print_log("   Validando conexiones y conteos...")
-        
+        print_log("   Validando conexiones y estimando con estadísticas del catálogo (EXPLAIN)...")
+
+        # ### NUEVO: Estimaciones en vez de COUNT(*) (ver ensayar_tabla) ###
+        ensayo = {**ENSAYO_DEFAULT, **(config.get('ensayo') or {})}
+        exacto = bool(conteo_exacto_web) if conteo_exacto_web is not None else (conteo_exacto_cli() or ensayo["conteo_exacto"])
+        velocidades = rendimiento_historico(detalles_auditoria(cursor_target, int(ensayo["historial"])))
+        totales = {"filas": 0, "bytes": 0, "segundos": 0.0, "sin_proyeccion": 0}
         for tabla_info in config['tablas']:
             nombre = tabla_info['nombre']
             try:
-                # Solo contamos en origen
-                cursor_source.execute(f"SELECT COUNT(*) FROM {nombre}")
-                conteo = cursor_source.fetchone()[0]
-                print_log(f"   ✅ Tabla '{nombre}': Conexión OK. Registros disponibles: {conteo}")
+                estimado = ensayar_tabla(cursor_source, tabla_info, estado, velocidades, exacto)
+                totales["filas"] += estimado["filas"]
+                totales["bytes"] += estimado["bytes"]
+                if estimado["segundos"] is None: totales["sin_proyeccion"] += 1
+                else: totales["segundos"] += estimado["segundos"]
             except Exception as e:
+                conn_source.rollback()
                 print_log(f"   ❌ Error validando tabla '{nombre}': {e}")
-        
+        if totales["sin_proyeccion"] == len(config['tablas']):
+            proyeccion = "sin proyección (no hay cargas en la auditoría)"
+        else:
+            proyeccion = f"~{totales['segundos']:,.1f}s tabla por tabla" + (
+                f" ({totales['sin_proyeccion']} sin historial)" if totales["sin_proyeccion"] else "")
+        print_log(f"\n📐 Carga completa estimada: ~{totales['filas']:,} filas, ~{formato_bytes(totales['bytes'])}, {proyeccion}")
+
+        pool_source.closeall()
+        pool_target.closeall()
         print_log("\n🏁 Ensayo finalizado. Ningún dato fue alterado.")
         return "\n".join(LOG_BUFFER) # Terminamos aquí si es ensayo, no borramos ni insertamos nada.
     # ----------------------------------------
 
-    # ### PUNTO 7: CORRECCIÓN DE LIMPIEZA (Borrar Hijos -> Padres) ###
-    # Esto evita el error de Foreign Key Constraint al borrar
+    # ### NUEVO: GRAFO DE DEPENDENCIAS (YAML `depende_de` + FK de pg_constraint) ###
+    dependencias = obtener_dependencias(config['tablas'], cursor_source, rendimiento.get('dependencias_catalogo', True))
+    try:
+        orden = orden_topologico(config['tablas'], dependencias)
+    except Exception as e:
+        print_log(f"⚠️ {e}. Se ignoran las dependencias y se usa el orden del YAML.")
+        dependencias = {t['nombre']: set() for t in config['tablas']}
+        orden = [t['nombre'] for t in config['tablas']]
+    print_log(f"🧭 Orden de dependencias: {' -> '.join(orden)}")
+
+    # ### NUEVO: CDC. La carga completa instala los triggers ANTES de copiar: lo que cambie durante
+    # la copia queda en el log, y lo anotado antes del horizonte ya viene en la copia (se recorta al final) ###
+    cdc = opciones_cdc(config)
+    horizonte = None
+    if es_cdc or (cdc["activo"] and not es_incremental):
+        try:
+            if instalar_cdc(conn_source, config['tablas'], cdc) and es_cdc:
+                print_log("   ⚠️ Los cambios anteriores a hoy no están en el log: haga una carga completa una vez.")
+            horizonte = horizonte_cdc(conn_source)
+        except Exception as e:
+            conn_source.rollback()
+            print_log(f"❌ No se pudo instalar la captura de cambios: {e}")
+            if es_cdc: return "\n".join(LOG_BUFFER)
+
+    # ### NUEVO: Limpieza de la carga completa (delete / truncate / staging + intercambio) ###
+    staging = None
     if not es_incremental:
-        print_log("\n🧹 MODO COMPLETO: Ejecutando limpieza en orden inverso...")
-        tablas_borrar = ["detalle_ordenes_qa", "ordenes_qa", "clientes_qa"]
-        
-        for t in tablas_borrar:
-            print_log(f"   🗑  Limpiando tabla: {t}...")
-            try:
-                ejecutar_sql_con_reintentos(cursor_target, f"DELETE FROM {t};")
-                conn_target.commit()
-                # Reseteamos la memoria de esa tabla
-                nombre_base = t.replace("_qa", "")
-                estado[nombre_base] = 0 
-            except Exception as e:
-                print_log(f"   ⚠️ No se pudo limpiar {t}: {e}")
+        estrategia = rendimiento.get('estrategia_completa', 'delete')
+        try:
+            t0 = time.perf_counter()
+            staging = limpiar_destinos(cursor_target, config['tablas'], orden, estado, estrategia,
+                                       rendimiento.get('staging_unlogged', True))
+            sumar_etapa_ejecucion("limpieza", time.perf_counter() - t0)
+        except Exception as e:
+            conn_target.rollback()
+            print_log(f"❌ No se pudieron preparar las tablas staging: {e}")
+            return "\n".join(LOG_BUFFER)
     # ---------------------------------------------------------------
 
-    # 2. PROCESAR CADA TABLA DEFINIDA EN EL YAML
-    for tabla_info in config['tablas']:
-        nombre_tabla = tabla_info['nombre']
-        reglas = tabla_info['columnas_enmascarar']
-        col_inc = tabla_info.get('columna_incremental', 'id') # ### NUEVO: Leemos qué columna usar para incremental (default: id) ###
-        
-        # ### PUNTO 5: Crear diccionario de estadísticas para esta tabla ###
-        stats_tabla = {
-            "tabla": nombre_tabla,
-            "registros_leidos": 0,
-            "registros_insertados": 0,
-            "reglas_aplicadas": list(reglas.keys()),
-            "errores": [] # ### PUNTO 6: Agregamos lista de errores ###
-        }
-        # ----------------------------------------------------------------
-
-        print_log(f"\n🔄 Procesando tabla: {nombre_tabla.upper()}")
+    # ### NUEVO: Desde aquí state.json tiene la marca de esta ejecución (y los reseteos de la limpieza) ###
+    with _LOCK_ESTADO:
+        guardar_estado(estado)
 
-        # Extraer datos (Extract)
-        try:
-            # Leemos el filtro del YAML. Si está vacío, no pone nada.
-            filtro_base = tabla_info.get('filtro_sql', '') 
-            
-            # ### NUEVO: Modificar el SQL para carga incremental ###
-            sql_final = f"SELECT * FROM {nombre_tabla} {filtro_base}"
-            
-            if es_incremental:
-                ultimo_valor = estado.get(nombre_tabla, 0)
-                print_log(f"   ℹ  Modo INCREMENTAL: Buscando nuevos registros > {ultimo_valor}")
-                
-                # Inyectamos la condición WHERE id > ultimo_valor
-                if "WHERE" in sql_final.upper():
-                    # Si ya tiene WHERE, agregamos AND
-                    sql_final = sql_final.replace("WHERE", f"WHERE {col_inc} > {ultimo_valor} AND")
-                elif "LIMIT" in sql_final.upper():
-                     # Si tiene LIMIT pero no WHERE, insertamos el WHERE antes del LIMIT
-                     partes = sql_final.upper().split("LIMIT")
-                     sql_final = f"SELECT * FROM {nombre_tabla} WHERE {col_inc} > {ultimo_valor} LIMIT {partes[1]}"
-                else:
-                    # Si no tiene nada, agregamos WHERE
-                    sql_final += f" WHERE {col_inc} > {ultimo_valor}"
-            # ------------------------------------------------------
-            
-            # ### PUNTO 6: Lectura segura con reintentos ###
-            ejecutar_sql_con_reintentos(cursor_source, sql_final)
-            
-            columnas = [desc[0] for desc in cursor_source.description]
-            filas = cursor_source.fetchall()
+    # Las conexiones vuelven al pool mientras trabajan los hilos
+    cursor_source.close()
+    cursor_target.close()
+    pool_source.putconn(conn_source)
+    pool_target.putconn(conn_target)
 
-            # ### PUNTO 5: Registrar conteo de lectura ###
-            stats_tabla["registros_leidos"] = len(filas)
-            total_registros_global += len(filas)
-            # ------------------------------------------
+    # 2. PROCESAR CADA TABLA DEFINIDA EN EL YAML
+    configurar_cache_mascaras(config.get('cache_mascaras')) # ### NUEVO: Caché determinística de máscaras ###
+    configurar_pool_mascaras(config.get('pool_mascaras'))   # ### NUEVO: Pool precalculado de nombres/teléfonos ###
+    contexto = {
+        "execution_id": execution_id,
+        "es_incremental": es_incremental,
+        "rendimiento": rendimiento,
+        "source_url": config['database']['source_url'], # ### NUEVO: Los procesos de rangos abren sus propias conexiones ###
+        "target_url": config['database']['target_url'],
+        "version_esquema": config.get('version_esquema', 1), # ### NUEVO: Cambiarla invalida los planes de carga en caché ###
+        "cache_mascaras": config.get('cache_mascaras', {}) or {},
+        "pool_mascaras": config.get('pool_mascaras', {}) or {},
+        "reintentos": dict(REINTENTOS), # ### NUEVO: Los procesos de rangos arrancan con los defaults ###
+        "estado": estado, # ### NUEVO: Para los checkpoints por chunk ###
+        "diff_sync": opciones_diff(config), # ### NUEVO: Opción 5 ###
+    }
 
+    def procesar_con_pool(tabla_info):
+        """Toma conexiones del pool para una tabla y las devuelve al terminar"""
+        if max_concurrencia > 1:
+            _PREFIJO_LOG.set(tabla_info['nombre']) # Para distinguir logs intercalados
+        conn_s = pool_source.getconn()
+        conn_t = registrar_conexion(pool_target.getconn(), pool_target) # ### NUEVO: Se puede reemplazar si se cae ###
+        try:
+            procesar = sincronizar_tabla_diff if es_diff else verificar_tabla if es_verificacion else procesar_tabla
+            return procesar(tabla_info, conn_s, conn_t, estado, contexto)
         except Exception as e:
-            print_log(f"⚠️ Error leyendo tabla {nombre_tabla}: {e}")
-            stats_tabla["error"] = str(e) # ### PUNTO 5: Guardar error si ocurre ###
-            log_detalles.append(stats_tabla)
-            continue
-
-        print_log(f"   -> Se encontraron {len(filas)} registros.")
-
-        # Transformar datos (Transform)
-        filas_enmascaradas = []
-        max_id_lote = estado.get(nombre_tabla, 0) # ### NUEVO: Variable para rastrear el ID más alto de este lote ###
-
-        for fila in filas:
-            fila_dict = dict(zip(columnas, fila)) # Convertir tupla a diccionario para manipular fácil
-            
-            # ### NUEVO: Actualizar el "watermark" (marca de agua) ###
-            if col_inc in fila_dict and isinstance(fila_dict[col_inc], int):
-                if fila_dict[col_inc] > max_id_lote:
-                    max_id_lote = fila_dict[col_inc]
-            # -----------------------------------------------------
-
-            fila_nueva = fila_dict.copy()
-            
-            # Aplicar reglas de enmascaramiento
-            for columna, regla in reglas.items():
-                if regla in MAPPING_FUNCIONES and columna in fila_nueva:
-                    valor_original = fila_nueva[columna]
-                    fila_nueva[columna] = MAPPING_FUNCIONES[regla](valor_original)
-            
-            filas_enmascaradas.append(fila_nueva)
-
-        # Cargar datos (Load) - SIMULACIÓN E INSERCIÓN
-        conteo_inserts = 0 # ### PUNTO 5: Contador temporal ###
-
-        # ### PUNTO 9: INSERCIÓN POR LOTES (BATCH) ###
-        # Sustituimos el bucle 'for' uno a uno por una inserción masiva
+            print_log(f"   ❌ Error inesperado en {tabla_info['nombre']}: {e}")
+            return {"tabla": tabla_info['nombre'], "registros_leidos": 0, "registros_insertados": 0, "errores": [], "error": str(e)}
+        finally:
+            pool_source.putconn(conn_s)
+            devolver_conexion(pool_target, conn_t)
+            _PREFIJO_LOG.set("")
+
+    if max_concurrencia > 1:
+        print_log(f"\n🧵 Ejecutando hasta {max_concurrencia} tablas en paralelo")
+    if es_verificacion:
+        print_log("\n🧮 Verificando en el servidor (agregados de origen filtrado vs QA)...")
+    tablas_carga = config['tablas']
+    if staging: # Las tablas se cargan en su *_staging
+        tablas_carga = [dict(t, tabla_destino=staging[t['nombre']]["staging"]) for t in config['tablas']]
+    if es_cdc:
+        conn_s, conn_t = pool_source.getconn(), registrar_conexion(pool_target.getconn(), pool_target)
         try:
-            if nombre_tabla == "clientes":
-                print_log(f"   -> Preparando lote de {len(filas_enmascaradas)} registros para clientes_qa... (Batch)")
-                
-                # 1. Lista de tuplas para batch
-                datos_batch = [
-                    (f['id'], f['nombre_completo'], f['email'], f['telefono'], f['tarjeta_credito'], execution_id)
-                    for f in filas_enmascaradas
-                ]
-                
-                # 2. SQL genérico
-                sql = """
-                    INSERT INTO clientes_qa (id, nombre_completo, email, telefono, tarjeta_credito, etl_batch_id)
-                    VALUES %s
-                    ON CONFLICT (id) DO UPDATE SET 
-                        nombre_completo = EXCLUDED.nombre_completo,
-                        email = EXCLUDED.email,
-                        telefono = EXCLUDED.telefono,
-                        tarjeta_credito = EXCLUDED.tarjeta_credito,
-                        etl_batch_id = EXCLUDED.etl_batch_id;
-                """
-                
-                if datos_batch:
-                    # Usamos execute_values para máxima velocidad en Postgres
-                    ejecutar_batch_con_reintentos(cursor_target, sql, datos_batch)
-                    conteo_inserts = len(datos_batch)
-                
-                conn_target.commit()
-
-            elif nombre_tabla == "ordenes":
-                print_log(f"   -> Preparando lote de {len(filas_enmascaradas)} registros para ordenes_qa... (Batch)")
-                
-                datos_batch = [
-                    (f['id'], f['cliente_id'], f['fecha_orden'], f['total'], execution_id)
-                    for f in filas_enmascaradas
-                ]
-
-                sql = """
-                    INSERT INTO ordenes_qa (id, cliente_id, fecha_orden, total, etl_batch_id)
-                    VALUES %s
-                    ON CONFLICT (id) DO NOTHING;
-                """
-                
-                if datos_batch:
-                    ejecutar_batch_con_reintentos(cursor_target, sql, datos_batch)
-                    conteo_inserts = len(datos_batch)
-
-                conn_target.commit()
-
-            elif nombre_tabla == "detalle_ordenes":
-                 print_log(f"   -> Preparando lote de {len(filas_enmascaradas)} registros para detalle_ordenes_qa... (Batch)")
-                 
-                 datos_batch = [
-                    (f['id'], f['orden_id'], f['producto'], f['cantidad'], execution_id)
-                    for f in filas_enmascaradas
-                 ]
-
-                 sql = """
-                    INSERT INTO detalle_ordenes_qa (id, orden_id, producto, cantidad, etl_batch_id)
-                    VALUES %s
-                    ON CONFLICT (id) DO NOTHING;
-                 """
-                 
-                 if datos_batch:
-                    ejecutar_batch_con_reintentos(cursor_target, sql, datos_batch)
-                    conteo_inserts = len(datos_batch)
-
-                 conn_target.commit()
+            log_detalles = ejecutar_cdc(conn_s, conn_t, config['tablas'], orden, contexto, cdc)
+        finally:
+            pool_source.putconn(conn_s)
+            devolver_conexion(pool_target, conn_t)
+    else:
+        log_detalles = ejecutar_planificador(tablas_carga, dependencias, procesar_con_pool, max_concurrencia)
+    total_registros_global = sum(d.get("registros_leidos", 0) for d in log_detalles)
 
+    conn_target = pool_target.getconn()
+    cursor_target = conn_target.cursor()
+    publicada = True
+    if staging:
+        t0 = time.perf_counter()
+        publicada = publicar_staging(cursor_target, staging, log_detalles, estado)
+        sumar_etapa_ejecucion("publicacion", time.perf_counter() - t0)
+    if horizonte is not None and not es_cdc and publicada and not any(d.get("error") or d.get("errores") for d in log_detalles):
+        # Carga completa con CDC activo: lo anotado antes de empezar ya quedó copiado
+        conn_s = pool_source.getconn()
+        try:
+            recortados = recortar_cdc(conn_s, cdc, {t['nombre']: None for t in config['tablas']}, horizonte)
+            print_log(f"🧹 Log CDC recortado tras la carga completa: {recortados} entradas")
         except Exception as e:
-            print_log(f"   ❌ Error insertando lote (Batch): {e}")
-            stats_tabla["errores"].append(str(e))
-        # ---------------------------------------------
-
-        # ### PUNTO 5: Guardar conteo final de esta tabla en el log ###
-        stats_tabla["registros_insertados"] = conteo_inserts
-        log_detalles.append(stats_tabla)
-        # ------------------------------------------------------------
+            print_log(f"⚠️ No se pudo recortar el log CDC: {e}")
+        finally:
+            pool_source.putconn(conn_s)
 
-        # ### NUEVO: Guardar el estado si hubo éxito ###
-        if filas:
-            estado[nombre_tabla] = max_id_lote
-            guardar_estado(estado)
-            print_log(f"   💾 Estado actualizado: {nombre_tabla} -> {max_id_lote}")
+    # ### NUEVO: Verificación al terminar (queda en la entrada de auditoría de esta misma ejecución) ###
+    verificaciones = None
+    if es_verificacion:
+        verificaciones = {d['tabla']: d.get("verificacion") or {"ok": False, "error": d.get("error")} for d in log_detalles}
+    elif (config.get('verificacion') or {}).get('al_terminar'):
+        t0 = time.perf_counter()
+        verificaciones = verificar_migracion(pool_source, pool_target, config['tablas'], contexto, max_concurrencia)
+        for d in log_detalles:
+            d["verificacion"] = verificaciones.get(d['tabla'])
+        sumar_etapa_ejecucion("verificacion", time.perf_counter() - t0)
 
     # ### PUNTO 5: CIERRE DE AUDITORÍA Y GUARDADO EN BD ###
     fecha_fin = datetime.datetime.now()
+    t_auditoria = time.perf_counter()
     
     # 1. Preparamos el objeto JSON final
-    log_final = {
-        "execution_id": execution_id,
-        "usuario": usuario_rol, # ### PUNTO 8: Registramos quién corrió el proceso ###
-        "inicio": str(fecha_inicio),
-        "fin": str(fecha_fin),
-        "total_registros_movidos": total_registros_global,
-        "detalles_por_tabla": log_detalles
-    }
+    log_final = armar_log_final(execution_id, usuario_rol, fecha_inicio, fecha_fin, total_registros_global, log_detalles, reanuda,
+                                metricas_ejecucion("cdc" if es_cdc else "diff" if es_diff else "verificacion" if es_verificacion else
+                                                   "incremental" if es_incremental else "completa", "sync"))
+    if verificaciones is not None:
+        log_final["verificacion"] = resumen_verificacion(verificaciones)
+    if usa_reanudacion:
+        terminar_reanudacion(estado) # ### NUEVO: Ejecución completa: la próxima no retoma nada ###
 
     # 2. Guardar en Archivo Local JSON (Requisito)
-    historial = []
-    if os.path.exists(ARCHIVO_LOGS):
-        try:
-            with open(ARCHIVO_LOGS, "r") as f: historial = json.load(f)
-        except: pass # Si falla al leer, empezamos uno nuevo
-    
-    historial.append(log_final)
-    with open(ARCHIVO_LOGS, "w") as f:
-        json.dump(historial, f, indent=4)
+    guardar_log_local(log_final, config.get('auditoria_local'))
     print_log(f"\n📄 Log guardado localmente en: {ARCHIVO_LOGS}")
 
     # 3. Guardar en Base de Datos Supabase (Requisito Histórica en QA)
     try:
         nombres_tablas_str = ", ".join([d['tabla'] for d in log_detalles])
-        sql_audit = """
-            INSERT INTO auditoria_logs (execution_id, fecha_inicio, fecha_fin, tablas_procesadas, total_registros, detalle_json)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
         # ### PUNTO 6: Guardado seguro con reintentos ###
-        ejecutar_sql_con_reintentos(cursor_target, sql_audit, (
+        ejecutar_sql_con_reintentos(cursor_target, SQL_AUDITORIA, (
             execution_id, 
             fecha_inicio, 
             fecha_fin, 
@@ -487,12 +3535,16 @@ def ejecutar_migracion(rol_web=None, opcion_web=None):
         print_log(f"⚠️ Error guardando en auditoria_logs: {e}")
     # -------------------------------------------------------------------
 
+    # ### NUEVO: La auditoría ya no alcanza a quedar en su propio log; sí en el archivo de Prometheus ###
+    log_final["metricas"]["etapas"]["auditoria"] = round(time.perf_counter() - t_auditoria, 4)
+    exportar_prometheus(log_final, config.get('metricas'))
+
     # Cerrar conexiones
     try:
-        cursor_source.close()
-        conn_source.close()
         cursor_target.close()
-        conn_target.close()
+        pool_target.putconn(conn_target)
+        pool_source.closeall()
+        pool_target.closeall()
     except: pass
     print_log("\n🏁 Proceso finalizado exitosamente.")
     
@@ -500,4 +3552,5 @@ def ejecutar_migracion(rol_web=None, opcion_web=None):
     return "\n".join(LOG_BUFFER)
 
 if __name__ == "__main__":
+    sys.modules.setdefault("main", sys.modules["__main__"]) # etl_async hace `import main`: que comparta este módulo
     ejecutar_migracion()
\ No newline at end of file
@@ -53,5 +53,1120 @@ class TestEnmascaramiento(unittest.TestCase):
         self.assertIn("3456", resultado) # Los ultimos 4 sí deben estar
         print(f"✅ Test Sin Fuga: {tarjeta_real} -> {resultado}")
 
+
+# --- ENMASCARAMIENTO POR COLUMNA (API por lotes de main.py) ---
+import main as etl
+import os, tempfile, contextlib, threading, time
+import psycopg2
+etl.ARCHIVO_POOL_MASCARAS = os.path.join(tempfile.mkdtemp(), "pool_mascaras.bin") # Las pruebas no escriben el pool en el repo
+
+class TestEnmascaramientoColumnas(unittest.TestCase):
+
+    # La versión por columna debe dar lo mismo que la función valor por valor
+    def test_hash_columna_igual_a_valor(self):
+        columna = ["ernesto@unam.mx", None, "", "otro@fes.mx"]
+        esperado = [etl.mascara_hash_email(v) for v in columna]
+        self.assertEqual(etl.enmascarar_columna("hash_email", columna), esperado)
+        print("✅ Test Hash por Columna: APROBADO")
+
+    def test_redaccion_columna(self):
+        columna = ["1234-5678-9012-3456", "123", None]
+        self.assertEqual(etl.enmascarar_columna("redact_last4", columna), ["---3456", "", None])
+        print("✅ Test Redacción por Columna: APROBADO")
+
+    # Teléfonos generados en bloque: mismo formato y nulos preservados
+    def test_formato_telefono_columna(self):
+        resultado = etl.enmascarar_columna("preserve_format", ["5512345678", None, "5587654321"])
+        patron = r"^\+52 \(\d{3}\) \d{3}-\d{4}$"
+        self.assertTrue(re.match(patron, resultado[0]))
+        self.assertIsNone(resultado[1])
+        self.assertTrue(re.match(patron, resultado[2]))
+        print(f"✅ Test Formato por Columna: {resultado}")
+
+    # El chunk transformado conserva el orden de columnas y calcula la marca de agua
+    def test_transformar_lote(self):
+        columnas = ["id", "email"]
+        filas = [(7, "a@b.mx"), (3, None)]
+        enmascaradas, max_id = etl.transformar_lote(columnas, filas, {"email": "hash_email"}, "id", 5)
+        self.assertEqual(max_id, 7)
+        self.assertEqual(enmascaradas[0], (7, etl.mascara_hash_email("a@b.mx")))
+        self.assertEqual(enmascaradas[1], (3, None))
+        print("✅ Test Transformación por Columnas: APROBADO")
+
+    # Plan de fila: sale en el orden del destino, con etl_batch_id, igual que la proyección de cargar_lote
+    def test_plan_fila(self):
+        columnas = ["email", "id", "sobrante"]
+        filas = [("a@b.mx", 7, "x"), (None, 3, "y")]
+        plan_carga = etl.armar_plan_carga({"columnas": ["id", "email", "etl_batch_id"], "llave": ["id"]},
+                                          {"nombre": "t"}, "t_qa", columnas, "lote-1")
+        plan_fila = etl.compilar_plan_fila(columnas, {"email": "hash_email"}, "id", plan_carga)
+        salida, max_id = etl.aplicar_plan_fila(plan_fila, filas, 0)
+        self.assertEqual(max_id, 7)
+        self.assertEqual(salida, [(7, etl.mascara_hash_email("a@b.mx"), "lote-1"), (3, None, "lote-1")])
+        # Sin máscaras ni reordenamiento solo se agrega el lote
+        plan_fila = etl.compilar_plan_fila(["id", "email"], {}, "id", dict(plan_carga, indices=[0, 1]))
+        self.assertEqual(etl.aplicar_plan_fila(plan_fila, [(1, "z")], 0)[0], [(1, "z", "lote-1")])
+        print("✅ Test Plan de Fila: APROBADO")
+
+    # Caché de máscaras: el mismo nombre original siempre da el mismo nombre falso
+    def test_cache_nombres_estables(self):
+        import tempfile, os
+        ruta = os.path.join(tempfile.mkdtemp(), "cache.sqlite")
+        original = (etl.ARCHIVO_CACHE_MASCARAS, dict(etl.CACHE_MASCARAS))
+        etl.ARCHIVO_CACHE_MASCARAS = ruta
+        etl.configurar_cache_mascaras({"activo": True, "disco": True})
+        try:
+            contadores = etl.nuevos_contadores_cache()
+            primera = etl.enmascarar_columna("faker_name", ["Ana", "Luis", "Ana"], contadores)
+            etl._CACHE_LRU.clear() # Simula una corrida nueva: solo queda el disco
+            segunda = etl.enmascarar_columna("faker_name", ["Luis", "Ana"], contadores)
+            self.assertEqual(primera[0], primera[2])
+            self.assertEqual(segunda, [primera[1], primera[0]])
+            self.assertEqual(contadores, {"hits_memoria": 1, "hits_disco": 2, "misses": 2})
+            print(f"✅ Test Caché de Máscaras: {contadores}")
+        finally:
+            etl._CACHE_DB.close()
+            etl._CACHE_DB = None
+            etl._CACHE_LRU.clear()
+            etl.ARCHIVO_CACHE_MASCARAS = original[0]
+            etl.CACHE_MASCARAS.clear()
+            etl.CACHE_MASCARAS.update(original[1])
+
+class TestPlanCarga(unittest.TestCase):
+
+    # Introspección una vez por versión de esquema; después sale de planes_carga.json sin tocar la BD
+    def test_cache_en_disco(self):
+        import json
+        from unittest import mock
+
+        class Cursor:
+            def __init__(self): self.consultas, self.resultado, self.connection = [], [], self
+            def fetchall(self): return self.resultado
+            def commit(self): pass
+        def ejecutar(cursor, consulta, params=None):
+            cursor.consultas.append(params)
+            cursor.resultado = [("id",)] if consulta is etl.SQL_LLAVE_DESTINO else [("id",), ("email",), ("etl_batch_id",)]
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(etl, "ARCHIVO_PLANES", os.path.join(tmp, "planes.json")), \
+             mock.patch.object(etl, "ejecutar_sql_con_reintentos", ejecutar), mock.patch.dict(etl._PLANES_CARGA, clear=True):
+            cursor = Cursor()
+            plan = etl.obtener_plan_carga(cursor, "qa.clientes_qa", 1)
+            self.assertEqual(plan, {"columnas": ["id", "email", "etl_batch_id"], "llave": ["id"]})
+            self.assertEqual(cursor.consultas, [("qa", "clientes_qa")] * 2)
+            etl._PLANES_CARGA.clear() # Corrida nueva: solo queda el disco
+            self.assertEqual(etl.obtener_plan_carga(cursor, "qa.clientes_qa", 1), plan)
+            self.assertEqual(len(cursor.consultas), 2)
+            etl.obtener_plan_carga(cursor, "qa.clientes_qa", 2) # Versión nueva: se vuelve a leer
+            self.assertEqual(len(cursor.consultas), 4)
+            self.assertEqual(os.listdir(tmp), ["planes.json"]) # Sin temporales olvidados
+            with open(etl.ARCHIVO_PLANES) as f:
+                self.assertEqual(set(json.load(f)), {"qa.clientes_qa@1", "qa.clientes_qa@2"})
+        print("✅ Test Caché de Planes: APROBADO")
+
+    # Proyección en el orden del destino, lote de la ejecución y ON CONFLICT según la tabla
+    def test_armar_plan(self):
+        plan = {"columnas": ["id", "email", "nombre", "etl_batch_id"], "llave": ["id"]}
+        upsert = etl.armar_plan_carga(plan, {"conflicto": "actualizar"}, "clientes_qa", ["nombre", "id", "email", "extra"], "lote-9")
+        self.assertEqual((upsert["columnas"], upsert["indices"], upsert["extra"]), (["id", "email", "nombre", "etl_batch_id"], [1, 2, 0], ("lote-9",)))
+        self.assertEqual(upsert["conflicto"], "ON CONFLICT (id) DO UPDATE SET email = EXCLUDED.email, nombre = EXCLUDED.nombre, "
+                                              "etl_batch_id = EXCLUDED.etl_batch_id")
+        ignorar = etl.armar_plan_carga(plan, {}, "clientes_qa", ["id", "email"], "lote-9")
+        self.assertEqual(ignorar["conflicto"], "ON CONFLICT (id) DO NOTHING")
+        self.assertEqual(ignorar["sql_values"], "INSERT INTO clientes_qa (id, email, etl_batch_id) VALUES %s ON CONFLICT (id) DO NOTHING;")
+        sin_llave = etl.armar_plan_carga({"columnas": ["id"], "llave": []}, {}, "t_qa", ["id"], "lote-9")
+        self.assertEqual((sin_llave["conflicto"], sin_llave["extra"]), ("", ()))
+        print("✅ Test Armado del Plan: APROBADO")
+
+class TestBufferCopy(unittest.TestCase):
+
+    # Formato text: tabuladores, saltos de línea y diagonales escapados; NULL = \N
+    def test_formato_texto(self):
+        buffer = etl.construir_buffer_copy([(1, "a\tb", "x\ny\\z", None, "fin\r"), (2, "", "ñandú", None, 3.5)])
+        self.assertEqual(buffer.read(), "1\ta\\tb\tx\\ny\\\\z\t\\N\tfin\\r\n"
+                                        "2\t\tñandú\t\\N\t3.5\n")
+        print("✅ Test COPY text: APROBADO")
+
+    # Formato binary: cabecera PGCOPY, enteros, NUMERIC base 10000, fechas desde 2000-01-01 y NULL = -1
+    def test_formato_binario(self):
+        import struct, decimal, datetime
+        tipos = ["integer", "numeric", "numeric", "date", "timestamp without time zone", "text"]
+        fila = (7, decimal.Decimal("12345.678"), decimal.Decimal("-0.5"), datetime.date(2000, 1, 2),
+                datetime.datetime(2000, 1, 1, 0, 0, 1), None)
+        datos = etl.construir_buffer_copy([fila], "binary", tipos).read()
+        self.assertTrue(datos.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertTrue(datos.endswith(struct.pack(">h", -1)))
+        cuerpo = datos[len(etl.CABECERA_COPY_BINARIO):-2]
+        self.assertEqual(struct.unpack(">h", cuerpo[:2])[0], len(tipos))
+        campos, posicion = [], 2
+        while posicion < len(cuerpo):
+            largo = struct.unpack(">i", cuerpo[posicion:posicion + 4])[0]
+            posicion += 4
+            campos.append(None if largo == -1 else cuerpo[posicion:posicion + largo])
+            posicion += max(largo, 0)
+        self.assertEqual(campos, [
+            struct.pack(">i", 7),
+            struct.pack(">hhhh3h", 3, 1, 0, 3, 1, 2345, 6780), # 1|2345.6780, peso 1, escala 3
+            struct.pack(">hhhh1h", 1, -1, 0x4000, 1, 5000),    # -0.5000
+            struct.pack(">i", 1),
+            struct.pack(">q", 1000000),
+            None,
+        ])
+        print("✅ Test COPY binary: APROBADO")
+
+class TestReanudacion(unittest.TestCase):
+
+    # Una carga completa interrumpida se retoma desde el último chunk confirmado (sin limpieza)
+    def test_retoma_carga_completa(self):
+        import tempfile, os, json
+        original = etl.ARCHIVO_ESTADO
+        etl.ARCHIVO_ESTADO = os.path.join(tempfile.mkdtemp(), "state.json")
+        try:
+            estado = {}
+            etl.preparar_reanudacion(estado, False, "ejec-1", {})
+            etl.guardar_avance_tabla(estado, {"tabla": "clientes", "registros_insertados": 2000}, 2099)
+            # ... aquí "muere" el proceso; la siguiente ejecución lee state.json
+            with open(etl.ARCHIVO_ESTADO) as f: estado = json.load(f)
+            es_incremental, reanuda = etl.preparar_reanudacion(estado, False, "ejec-2", {})
+            self.assertTrue(es_incremental)
+            self.assertEqual(reanuda, "ejec-1")
+            stats = etl.nuevas_stats_tabla({"nombre": "clientes", "columnas_enmascarar": {}},
+                                           {"motor_carga": "values", "formato_copy": "text"}, estado)
+            self.assertEqual(stats["filas_omitidas_reanudacion"], 2000)
+            etl.terminar_reanudacion(estado)
+            with open(etl.ARCHIVO_ESTADO) as f: self.assertEqual(json.load(f), {"clientes": 2099})
+            print("✅ Test Reanudación por Chunks: APROBADO")
+        finally:
+            etl.ARCHIVO_ESTADO = original
+
+    # Una verificación (opción 6) a mitad de una carga interrumpida no le quita la marca de reanudación
+    def test_verificacion_conserva_marca(self):
+        import tempfile, os, json
+        class Cursor:
+            rowcount, description = 0, []
+            def __init__(self, conn): self.connection = conn
+            def execute(self, *args): pass
+            def fetchall(self): return []
+            def close(self): pass
+        class Conexion:
+            closed = 0
+            def cursor(self): return Cursor(self)
+            def commit(self): pass
+            def rollback(self): pass
+        class Pool:
+            def getconn(self): return Conexion()
+            def putconn(self, conn, close=False): pass
+            def closeall(self): pass
+
+        directorio = tempfile.mkdtemp()
+        estado = {"clientes": 2099, etl.CLAVE_REANUDACION: {"execution_id": "ejec-1", "filas": {"clientes": 2000}}}
+        config = {"database": {"source_url": "", "target_url": ""}, "rendimiento": {"dependencias_catalogo": False},
+                  "tablas": [{"nombre": "clientes", "columnas_enmascarar": {}}]}
+        original = (etl.ARCHIVO_ESTADO, etl.ARCHIVO_LOGS, etl.ARCHIVO_LOGS_LEGADO, etl.ARCHIVO_LOG_INDICE, etl.cargar_config,
+                    etl.crear_pool_con_reintentos, etl.verificar_tabla)
+        etl.ARCHIVO_ESTADO = os.path.join(directorio, "state.json")
+        etl.ARCHIVO_LOGS = os.path.join(directorio, "logs.jsonl")
+        etl.ARCHIVO_LOGS_LEGADO = os.path.join(directorio, "logs.json")
+        etl.ARCHIVO_LOG_INDICE = os.path.join(directorio, "indice.json")
+        etl.guardar_estado(estado)
+        etl.cargar_config = lambda: config
+        etl.crear_pool_con_reintentos = lambda url, maximo: Pool()
+        etl.verificar_tabla = lambda tabla_info, *args: {"tabla": tabla_info['nombre'], "verificacion": {"ok": True}}
+        try:
+            etl.ejecutar_migracion("dev", "6")
+            with open(etl.ARCHIVO_ESTADO) as f: self.assertEqual(json.load(f), estado)
+            print("✅ Test Verificación Conserva Reanudación: APROBADO")
+        finally:
+            (etl.ARCHIVO_ESTADO, etl.ARCHIVO_LOGS, etl.ARCHIVO_LOGS_LEGADO, etl.ARCHIVO_LOG_INDICE, etl.cargar_config,
+             etl.crear_pool_con_reintentos, etl.verificar_tabla) = original
+
+    # Marca de agua compuesta (updated_at, id): la mayor tupla del chunk, guardada como lista JSON
+    def test_marca_compuesta(self):
+        import datetime
+        t1, t2 = datetime.datetime(2024, 5, 1, 10, 0), datetime.datetime(2024, 5, 2, 9, 30)
+        filas = [(1, t2, "x"), (9, t1, "y"), (4, None, "z"), (3, t2, "w")]
+        _, marca = etl.transformar_lote(["id", "updated_at", "nota"], filas, {}, ["updated_at", "id"], 0)
+        self.assertEqual(marca, (t2, 3))
+        self.assertEqual(etl.marca_json(marca), ["2024-05-02T09:30:00", 3])
+        _, marca = etl.transformar_lote(["id", "updated_at", "nota"], filas[1:2], {}, ["updated_at", "id"], ["2024-05-02T09:30:00", 3])
+        self.assertEqual(marca, (t2, 3)) # La guardada en state.json no retrocede (y vuelve como valor nativo)
+        print("✅ Test Marca de Agua Compuesta: APROBADO")
+
+    # Las marcas se comparan como valores nativos, no como su texto en state.json
+    def test_marca_nativa(self):
+        import datetime, decimal
+        self.assertEqual(etl.mayor_marca("9.50", decimal.Decimal("10.25")), decimal.Decimal("10.25"))
+        self.assertEqual(etl.marca_json(decimal.Decimal("10.25")), "10.25")
+        tarde = datetime.datetime.fromisoformat("2024-05-01T23:00:00-06:00") # = 05:00Z del día 2
+        temprano = datetime.datetime.fromisoformat("2024-05-02T03:00:00+00:00")
+        self.assertEqual(etl.mayor_marca(temprano.isoformat(), tarde), tarde)
+        self.assertEqual(etl.mayor_marca(tarde.isoformat(), temprano), tarde)
+        # Estado viejo entero + columna_incremental compuesta nueva: se reinicia en vez de fallar
+        self.assertEqual(etl.mayor_marca(2099, (tarde, 5)), (tarde, 5))
+        estado = {"clientes": 2099}
+        tabla = {"nombre": "clientes", "columna_incremental": ["updated_at", "id"]}
+        self.assertEqual(etl.validar_marca_guardada(estado, tabla), 0)
+        self.assertEqual(estado["clientes"], 0)
+        self.assertEqual(etl.validar_marca_guardada({"clientes": ["2024-05-02", 3]}, tabla), ["2024-05-02", 3])
+        print("✅ Test Marca de Agua Nativa: APROBADO")
+
+def sql_texto(compuesto):
+    """Texto de un psycopg2.sql.Composed sin conexión (quote_ident/adapt exigen una conexión real)"""
+    from psycopg2 import sql
+    if isinstance(compuesto, sql.Composed): return "".join(sql_texto(p) for p in compuesto.seq)
+    if isinstance(compuesto, sql.SQL): return compuesto.string
+    if isinstance(compuesto, sql.Identifier): return ".".join('"%s"' % s.replace('"', '""') for s in compuesto.strings)
+    if isinstance(compuesto, sql.Literal):
+        valor = compuesto.wrapped
+        return str(valor) if isinstance(valor, int) else "'%s'" % str(valor).replace("'", "''")
+    raise TypeError(compuesto)
+
+class TestConsultaExtraccion(unittest.TestCase):
+
+    def consulta(self, filtro, estado=None, incremental=True, columna="id"):
+        tabla = {"nombre": "detalle_ordenes", "columna_incremental": columna, "filtro_sql": filtro}
+        compuesto, _ = etl.componer_consulta(tabla, estado or {}, incremental)
+        return sql_texto(compuesto)
+
+    # WHERE simple + marca de agua, WHERE anidado (detalle_ordenes), LIMIT al final
+    def test_filtro_y_marca(self):
+        self.assertEqual(self.consulta("WHERE total > 12000", {"detalle_ordenes": 2099}),
+                         'SELECT * FROM "detalle_ordenes" WHERE (total > 12000) AND ("id") > (2099) ORDER BY "id"')
+        self.assertEqual(self.consulta("WHERE orden_id IN (SELECT id FROM ordenes WHERE total > 12000)", {"detalle_ordenes": 7}),
+                         'SELECT * FROM "detalle_ordenes" WHERE (orden_id IN (SELECT id FROM ordenes WHERE total > 12000))'
+                         ' AND ("id") > (7) ORDER BY "id"')
+        self.assertEqual(self.consulta("LIMIT 12000", incremental=False),
+                         'SELECT * FROM "detalle_ordenes" ORDER BY "id" LIMIT 12000')
+        self.assertEqual(self.consulta("WHERE total > 5 LIMIT 10;", {"detalle_ordenes": 3}),
+                         'SELECT * FROM "detalle_ordenes" WHERE (total > 5) AND ("id") > (3) ORDER BY "id" LIMIT 10')
+        print("✅ Test Consulta con Filtro y Marca: APROBADO")
+
+    # Marca compuesta como literales; un WHERE con ORDER BY propio va como subconsulta
+    def test_compuesta_y_subconsulta(self):
+        self.assertEqual(self.consulta("", {"detalle_ordenes": ["2024-05-02T09:30:00", 3]}, columna=["updated_at", "id"]),
+                         'SELECT * FROM "detalle_ordenes" WHERE ("updated_at", "id") > (\'2024-05-02T09:30:00\', 3)'
+                         ' ORDER BY "updated_at", "id"')
+        self.assertEqual(self.consulta("WHERE x > 1 ORDER BY y", {"detalle_ordenes": 5}),
+                         'SELECT * FROM (SELECT * FROM "detalle_ordenes" WHERE x > 1 ORDER BY y) AS etl_origen'
+                         ' WHERE ("id") > (5) ORDER BY "id"')
+        print("✅ Test Consulta Compuesta y Subconsulta: APROBADO")
+
+class TestStreaming(unittest.TestCase):
+
+    class Conexion:
+        """Conexión falsa: un cursor con nombre entrega `filas` de a fetchmany"""
+        def __init__(self, filas, eventos):
+            self.filas, self.eventos, self.nombres = list(filas), eventos, []
+        def cursor(self, name=None):
+            conexion = self
+            self.nombres.append(name)
+            class Cursor:
+                description = [("id",), ("email",)]
+                itersize = None
+                def execute(self, sql, params=None): conexion.eventos.append("execute")
+                def fetchmany(self, n):
+                    bloque, conexion.filas = conexion.filas[:n], conexion.filas[n:]
+                    conexion.eventos.append(f"fetch {len(bloque)}")
+                    return bloque
+                def fetchall(self):
+                    conexion.eventos.append("fetchall")
+                    bloque, conexion.filas = conexion.filas, []
+                    return bloque
+                def close(self): conexion.eventos.append("close")
+            return Cursor()
+        def rollback(self): self.eventos.append("rollback")
+
+    # Cursor con nombre (DECLARE en el servidor) y chunks de chunk_size; se cierra aunque el consumidor corte a medias
+    def test_cursor_del_servidor(self):
+        eventos = []
+        conn = self.Conexion([(i, f"u{i}@x.mx") for i in range(25)], eventos)
+        chunks = list(etl.extraer_en_chunks(conn, "SELECT 1", "clientes", chunk_size=10))
+        self.assertTrue(conn.nombres[0].startswith("etl_clientes_"))
+        self.assertEqual([len(filas) for _, filas in chunks], [10, 10, 5])
+        self.assertEqual(chunks[0][0], ["id", "email"])
+        self.assertEqual(eventos[-2:], ["close", "rollback"])
+
+        eventos.clear()
+        generador = etl.extraer_en_chunks(self.Conexion(range(100), eventos), "SELECT 1", "clientes", chunk_size=10)
+        next(generador)
+        generador.close()
+        self.assertEqual(eventos, ["execute", "fetch 10", "close", "rollback"])
+
+        eventos.clear()
+        chunks = list(etl.extraer_en_chunks(self.Conexion([(1, "a")] * 25, eventos), "SELECT 1", "clientes", streaming=False))
+        self.assertEqual([len(filas) for _, filas in chunks], [25])
+        print("✅ Test Streaming (Cursor del Servidor): APROBADO")
+
+    # Cada chunk se enmascara y se confirma antes de pedir el siguiente: nunca hay más de un chunk en memoria
+    def test_carga_por_chunk(self):
+        from unittest import mock
+        eventos, estado = [], {}
+        conn = self.Conexion([(i, f"u{i}@x.mx") for i in range(1, 26)], eventos)
+        tabla = {"nombre": "clientes", "columnas_enmascarar": {"email": "hash_email"}, "columna_incremental": "id"}
+        rendimiento = {"chunk_size": 10, "pipeline": False}
+        contexto = {"rendimiento": rendimiento, "execution_id": "x", "version_esquema": 1, "estado": estado}
+        stats = etl.nuevas_stats_tabla(tabla, etl.opciones_tabla(tabla, rendimiento))
+        plan = {"tabla_qa": "clientes_qa", "indices": [0, 1], "extra": (), "columnas": ["id", "email"]}
+
+        def cargar(conn_target, plan_carga, filas, *args, **kwargs):
+            eventos.append(f"carga {len(filas)}")
+            self.assertNotIn("@x.mx", filas[0][1])  # ya enmascarado
+            return len(filas)
+        with mock.patch.object(etl, "conexion_vigente", lambda c: c), \
+             mock.patch.object(etl, "compilar_plan_carga", lambda *args: plan), \
+             mock.patch.object(etl, "cargar_lote", cargar), \
+             mock.patch.object(etl, "guardar_estado", lambda estado: None), mock.patch.object(etl, "print_log"):
+            marca = etl.migrar_consulta(conn, mock.Mock(), tabla, "SELECT 1", contexto, stats, 0)
+        self.assertEqual(eventos, ["execute", "fetch 10", "carga 10", "fetch 10", "carga 10", "fetch 5", "carga 5",
+                                   "fetch 0", "close", "rollback"])
+        self.assertEqual((marca, estado["clientes"], stats["registros_insertados"]), (25, 25, 25))
+        print("✅ Test Streaming (Carga por Chunk): APROBADO")
+
+class TestPlanificador(unittest.TestCase):
+
+    # Un hijo arranca solo cuando terminaron sus padres; las tablas independientes corren a la vez
+    def test_dependencias_y_concurrencia(self):
+        import threading
+        tablas = [{"nombre": n} for n in ("a", "b", "c", "d")]
+        dependencias = {"a": set(), "b": set(), "c": {"a"}, "d": {"b", "c"}}
+        juntas = threading.Barrier(2, timeout=5)  # a y b deben estar en curso al mismo tiempo
+        eventos, candado = [], threading.Lock()
+
+        def procesar(tabla_info):
+            nombre = tabla_info["nombre"]
+            with candado: eventos.append(("inicio", nombre))
+            if nombre in ("a", "b"): juntas.wait()
+            with candado: eventos.append(("fin", nombre))
+            return nombre.upper()
+
+        resultados = etl.ejecutar_planificador(tablas, dependencias, procesar, max_concurrencia=3)
+        self.assertEqual(resultados, ["A", "B", "C", "D"])  # orden del YAML, no de término
+        for hija, padres in dependencias.items():
+            for padre in padres:
+                self.assertLess(eventos.index(("fin", padre)), eventos.index(("inicio", hija)))
+        self.assertEqual(etl.orden_topologico(tablas, dependencias), ["a", "b", "c", "d"])
+        print("✅ Test Planificador (Dependencias): APROBADO")
+
+    # Las FK del catálogo se suman al YAML y un ciclo se detecta antes de cargar; si un padre falla, su hijo no corre
+    def test_ciclo_y_fallo(self):
+        class Cursor:
+            connection = type("Conexion", (), {"commit": lambda self: None})()
+            def execute(self, consulta): pass
+            def fetchall(self): return [("clientes", "ordenes"), ("ordenes", "ordenes"), ("ordenes", "externa")]
+        tablas = [{"nombre": "clientes"}, {"nombre": "ordenes", "depende_de": ["clientes", "no_esta"]}]
+        dependencias = etl.obtener_dependencias(tablas, Cursor())
+        self.assertEqual(dependencias, {"clientes": {"ordenes"}, "ordenes": {"clientes"}})
+        with self.assertRaisesRegex(Exception, "circular"):
+            etl.orden_topologico(tablas, dependencias)
+        self.assertEqual(etl.obtener_dependencias(tablas, Cursor(), usar_catalogo=False),
+                         {"clientes": set(), "ordenes": {"clientes"}})
+
+        procesadas = []
+        def procesar(tabla_info):
+            procesadas.append(tabla_info["nombre"])
+            if tabla_info["nombre"] == "clientes": raise RuntimeError("falla clientes")
+        with self.assertRaisesRegex(RuntimeError, "falla clientes"):
+            etl.ejecutar_planificador(tablas, {"clientes": set(), "ordenes": {"clientes"}}, procesar, 2)
+        self.assertEqual(procesadas, ["clientes"])
+        print("✅ Test Planificador (Ciclos y Fallos): APROBADO")
+
+class TestPipeline(unittest.TestCase):
+
+    def correr(self, chunks, cargar, trabajadores=3, estado=None):
+        """migrar_consulta en modo pipeline con extracción, plan y carga simulados"""
+        from unittest import mock
+        tabla = {"nombre": "clientes", "columnas_enmascarar": {}, "columna_incremental": "id"}
+        rendimiento = {"pipeline": True, "trabajadores_mascara": trabajadores, "profundidad_cola": 2}
+        contexto = {"rendimiento": rendimiento, "execution_id": "x", "version_esquema": 1, "estado": estado}
+        stats = etl.nuevas_stats_tabla(tabla, etl.opciones_tabla(tabla, rendimiento))
+        conn_target = mock.Mock()
+
+        def aplicar(plan_fila, filas, max_id_lote, contadores, segundos_por_regla):
+            time.sleep(0.002 * (filas[0][0] % 3))  # Chunks que terminan de enmascararse fuera de orden
+            return filas, filas[-1][0]
+        with mock.patch.object(etl, "extraer_en_chunks", lambda *args: chunks), \
+             mock.patch.object(etl, "conexion_vigente", lambda conn: conn), \
+             mock.patch.object(etl, "obtener_plan_carga", lambda *args: {}), \
+             mock.patch.object(etl, "armar_plan_carga", lambda *args: None), \
+             mock.patch.object(etl, "aplicar_plan_fila", aplicar), \
+             mock.patch.object(etl, "cargar_lote", lambda conn, plan, filas, *args, **kwargs: cargar(filas)), \
+             mock.patch.object(etl, "guardar_estado", lambda estado: None), mock.patch.object(etl, "print_log"):
+            marca = etl.migrar_consulta(None, conn_target, tabla, "SELECT 1", contexto, stats, 0)
+        return marca, stats
+
+    def hilos_vivos(self):
+        return [h.name for h in threading.enumerate() if h.name.startswith(("etl-lector-", "etl-mascara-"))]
+
+    # Varios enmascaradores, pero el escritor confirma en orden y la marca de agua nunca se adelanta
+    def test_orden_y_marca(self):
+        cargados, estado = [], {}
+        chunks = ((["id"], [(i * 10 + k,) for k in range(1, 11)]) for i in range(12))
+        marca, stats = self.correr(chunks, lambda filas: cargados.append(filas[0][0]) or len(filas), estado=estado)
+        self.assertEqual(cargados, [i * 10 + 1 for i in range(12)])
+        self.assertEqual((marca, estado["clientes"]), (120, 120))
+        self.assertEqual((stats["registros_leidos"], stats["registros_insertados"]), (120, 120))
+        self.assertIn(stats["pipeline"]["cuello_de_botella"], ("lector", "enmascarado", "escritor"))
+        self.assertEqual(self.hilos_vivos(), [])
+        print("✅ Test Pipeline (Orden y Marca): APROBADO")
+
+    # Si la carga falla, lector y enmascaradores se detienen (backpressure: no se lee toda la tabla)
+    # y la marca queda en el último chunk confirmado; un error del lector se propaga
+    def test_apagado_por_error(self):
+        leidos = [0]
+        def sin_fin():
+            i = 0
+            while True:
+                leidos[0] += 1
+                yield ["id"], [(i * 10 + k,) for k in range(1, 11)]
+                i += 1
+        def cargar(filas):
+            if filas[0][0] > 10: raise RuntimeError("destino caído")
+            return len(filas)
+        marca, stats = self.correr(sin_fin(), cargar)
+        self.assertEqual(marca, 10)
+        self.assertEqual(stats["errores"], ["destino caído"])
+        self.assertLessEqual(leidos[0], 2 + 2 * 2 + 3)  # confirmados + colas + enmascaradores
+        self.assertEqual(self.hilos_vivos(), [])
+
+        def falla_lectura():
+            yield ["id"], [(1,)]
+            raise RuntimeError("origen caído")
+        with self.assertRaisesRegex(RuntimeError, "origen caído"):
+            self.correr(falla_lectura(), len)
+        self.assertEqual(self.hilos_vivos(), [])
+        print("✅ Test Pipeline (Apagado por Error): APROBADO")
+
+class TestMotorAsync(unittest.TestCase):
+
+    class Transaccion:
+        async def __aenter__(self): return self
+        async def __aexit__(self, *exc): return False
+
+    def destino(self, eventos, fallas=()):
+        """Conexión asyncpg falsa del destino: executemany anota la página (o falla una vez si está en `fallas`)"""
+        pendientes = list(fallas)
+        prueba = self
+        class Conexion:
+            def __init__(self, numero): self.numero, self.cerrada = numero, False
+            def transaction(self, **kwargs): return prueba.Transaccion()
+            def is_closed(self): return self.cerrada
+            async def executemany(self, sql, pagina):
+                if pagina[0][0] in pendientes:
+                    pendientes.remove(pagina[0][0])
+                    self.cerrada = True
+                    raise ConnectionError("connection reset")
+                eventos.append((f"carga {len(pagina)}", self.numero, [f[1] for f in pagina]))
+        class Pool:
+            def __init__(self): self.prestadas = 0
+            async def acquire(self):
+                self.prestadas += 1
+                return Conexion(self.prestadas)
+            async def release(self, conn): eventos.append(("devuelta", conn.numero))
+        return Pool()
+
+    # Una tabla completa: prefetch del siguiente chunk mientras se carga el actual y checkpoints fuera del loop
+    def test_migrar_tabla(self):
+        import asyncio
+        from unittest import mock
+        import etl_async
+        eventos, hilos_estado, estado = [], [], {}
+        filas_origen = [(i, f"u{i}@x.mx") for i in range(1, 26)]
+        prueba = self
+
+        class Cursor:
+            async def fetch(self, n):
+                bloque = filas_origen[:n]
+                del filas_origen[:n]
+                eventos.append(f"fetch {len(bloque)}")
+                return bloque
+        class Sentencia:
+            def get_attributes(self): return [type("Atributo", (), {"name": c})() for c in ("id", "email")]
+            async def cursor(self): return Cursor()
+        class Origen:
+            def transaction(self, **kwargs): return prueba.Transaccion()
+            async def prepare(self, sql): return Sentencia()
+        class PoolOrigen:
+            @contextlib.asynccontextmanager
+            async def acquire(self): yield Origen()
+
+        tabla = {"nombre": "clientes", "columnas_enmascarar": {"email": "hash_email"}, "columna_incremental": "id"}
+        contexto = {"rendimiento": {"chunk_size": 10}, "execution_id": "x", "version_esquema": 1,
+                    "es_incremental": True, "conn_consultas": None}
+
+        async def plan(conn, tabla_qa, version): return {"columnas": ["id", "email"], "llave": ["id"]}
+        with mock.patch.object(etl, "construir_consulta", lambda *args: ("SELECT 1", None)), \
+             mock.patch.object(etl_async, "obtener_plan_carga_async", plan), \
+             mock.patch.object(etl, "guardar_estado", lambda e: hilos_estado.append(threading.current_thread())), \
+             mock.patch.object(etl, "print_log"):
+            stats = asyncio.run(etl_async.migrar_tabla_async(tabla, PoolOrigen(), self.destino(eventos), estado, contexto))
+
+        cargas = [ev for ev in eventos if isinstance(ev, tuple) and ev[0].startswith("carga")]
+        self.assertEqual(eventos[:3], ["fetch 10", "fetch 10", cargas[0]])  # el chunk 2 se pidió antes de cargar el 1
+        self.assertEqual([ev[0] for ev in cargas], ["carga 10", "carga 10", "carga 5"])
+        self.assertTrue(all("@x.mx" not in email for ev in cargas for email in ev[2]))
+        self.assertEqual((estado["clientes"], stats["registros_insertados"]), (25, 25))
+        self.assertEqual(len(hilos_estado), 4)  # 3 checkpoints + cierre de la tabla
+        self.assertTrue(all(h is not threading.main_thread() for h in hilos_estado))
+        print("✅ Test Motor Async (Tabla): APROBADO")
+
+    # Con llave se carga por páginas; un error transitorio reintenta solo esa página en otra conexión del pool
+    def test_pagina_reintento_y_opciones(self):
+        import asyncio
+        from unittest import mock
+        import etl_async
+        eventos = []
+        pool = self.destino(eventos, fallas=[3])
+        plan = {"tabla_qa": "clientes_qa", "columnas": ["id", "email"], "conflicto": "ON CONFLICT (id) DO NOTHING"}
+        filas = [(i, f"e{i}") for i in range(1, 6)]
+
+        async def cargar():
+            async with etl_async._destino_reemplazable(pool) as destino:
+                return await etl_async.cargar_lote_async(destino, plan, filas, proyectadas=True, filas_por_pagina=2)
+        with mock.patch.object(etl, "espera_reintento", lambda intento: 0), mock.patch.object(etl, "print_log"):
+            self.assertEqual(asyncio.run(cargar()), 5)
+        self.assertEqual(eventos, [("carga 2", 1, ["e1", "e2"]), ("devuelta", 1),
+                                   ("carga 2", 2, ["e3", "e4"]), ("carga 1", 2, ["e5"]), ("devuelta", 2)])
+
+        self.assertEqual(etl_async._posicional("SELECT %s, %s"), "SELECT $1, $2")
+        tablas = [{"nombre": "a", "particiones": 4}, {"nombre": "b", "pipeline": True}, {"nombre": "c"}]
+        self.assertEqual(etl_async.opciones_sin_soporte(tablas, {}), [("a", "particiones"), ("b", "pipeline")])
+        self.assertEqual(len(etl_async.opciones_sin_soporte(tablas, {"pipeline": True})), 4)
+        print("✅ Test Motor Async (Páginas y Reintentos): APROBADO")
+
+class TestParticiones(unittest.TestCase):
+
+    # Con LIMIT en el filtro no se calculan rangos: la tabla se extrae en un solo flujo
+    def test_limit_sin_particiones(self):
+        from unittest import mock
+        tabla = {"nombre": "detalle_ordenes", "columna_incremental": "id", "particiones": 4, "filtro_sql": "LIMIT 12000"}
+        llamadas = []
+        with mock.patch.object(etl, "migrar_consulta", lambda *args: llamadas.append(args[3]) or 0), \
+             mock.patch.object(etl, "calcular_rangos", side_effect=AssertionError("no debe particionar")):
+            etl.migrar_particionado(None, None, tabla, "SELECT 1", {}, {}, 0)
+        self.assertEqual(llamadas, ["SELECT 1"])
+        print("✅ Test Particiones con LIMIT: APROBADO")
+
+class TestCDC(unittest.TestCase):
+
+    # Upserts en orden de dependencias, borrados en orden inverso; el log de una tabla con error no se recorta
+    def test_orden_y_recorte(self):
+        from unittest import mock
+        tablas = [{"nombre": n, "columnas_enmascarar": {}} for n in ("clientes", "ordenes", "detalle_ordenes")]
+        aplicadas, borradas, recorte = [], [], {}
+
+        def aplicar(conn_s, conn_t, tabla_info, contexto, stats, opciones, horizonte, cambios_padres):
+            aplicadas.append(tabla_info["nombre"])
+            if tabla_info["nombre"] == "clientes":
+                stats["errores"].append("falló un lote")
+            return 10, ["id"], {}, [{"id": 1}]
+
+        def borrar(conn_t, tabla_info, llave, llaves, lote):
+            borradas.append(tabla_info["nombre"])
+            return len(llaves)
+
+        with mock.patch.object(etl, "aplicar_cdc_tabla", aplicar), mock.patch.object(etl, "borrar_llaves_qa", borrar), \
+             mock.patch.object(etl, "horizonte_cdc", lambda conn: 500), \
+             mock.patch.object(etl, "recortar_cdc", lambda conn, opciones, hasta, horizonte: recorte.update(hasta) or 0):
+            detalles = etl.ejecutar_cdc(None, None, tablas, ["clientes", "ordenes", "detalle_ordenes"],
+                                        {"rendimiento": {}}, etl.opciones_cdc({}))
+        self.assertEqual(aplicadas, ["clientes", "ordenes", "detalle_ordenes"])
+        self.assertEqual(borradas, ["detalle_ordenes", "ordenes"])
+        self.assertEqual(recorte, {"ordenes": 10, "detalle_ordenes": 10})
+        self.assertEqual([d["registros_eliminados"] for d in detalles], [0, 1, 1])
+        print("✅ Test CDC: APROBADO")
+
+class TestDiffSync(unittest.TestCase):
+
+    # Rangos contiguos que cubren (inferior, superior] y columnas que entran al hash
+    def test_rangos_y_columnas(self):
+        limites = etl.limites_rango(99, 3099, 16)
+        self.assertEqual((limites[0], limites[-1]), (99, 3099))
+        self.assertEqual(len(limites) - 1, 16)
+        self.assertTrue(all(a < b for a, b in zip(limites, limites[1:])))
+        self.assertEqual(etl.limites_rango(10, 13, 16), [10, 11, 12, 13]) # Nunca rangos vacíos
+
+        tabla = {"columnas_enmascarar": {"nombre_completo": "faker_name", "email": "hash_email", "telefono": "preserve_format"}}
+        columnas, excluidas = etl.columnas_diff(tabla, ["id", "nombre_completo", "email", "telefono"],
+                                                ["id", "nombre_completo", "email", "telefono", "etl_batch_id"])
+        self.assertEqual(columnas, ["id", "email"])
+        self.assertEqual(excluidas, ["nombre_completo", "telefono"])
+        print("✅ Test Diff por Checksums: APROBADO")
+
+    # filtro_sql con LIMIT: las llaves que QA tiene más allá del LIMIT del origen no se borran
+    def test_limit_no_borra_qa(self):
+        from unittest import mock
+
+        class Cursor:
+            def __init__(self, conn): self.conn, self.connection, self.description, self.rowcount = conn, conn, [("id",)], 0
+            def fetchone(self): return (min(self.conn.llaves), max(self.conn.llaves))
+            def close(self): pass
+            def __enter__(self): return self
+            def __exit__(self, *exc): pass
+        class Conexion:
+            def __init__(self, llaves): self.llaves = set(llaves)
+            def cursor(self): return Cursor(self)
+            def commit(self): pass
+            def rollback(self): pass
+
+        origen, qa = Conexion(range(1, 11)), Conexion(set(range(1, 16)) - {4}) # LIMIT 10; QA ya cargó hasta 15
+        borrados = []
+
+        def ejecutar(cursor, consulta, params=None):
+            if params: # DELETE del rango
+                borrados.append(params)
+                cursor.rowcount = len({k for k in cursor.conn.llaves if params[0] < k <= params[1]})
+                cursor.conn.llaves -= {k for k in cursor.conn.llaves if params[0] < k <= params[1]}
+
+        def hashes(cursor, fuente, col, valores, limites):
+            tramos = {}
+            for k in cursor.conn.llaves:
+                for i in range(len(limites) - 1):
+                    if limites[i] < k <= limites[i + 1]:
+                        filas, suma = tramos.get(i, (0, 0))
+                        tramos[i] = (filas + 1, suma + k)
+            return tramos
+
+        def migrar(conn_s, conn_t, tabla_info, rango, contexto, stats, max_id):
+            conn_t.llaves |= {k for k in conn_s.llaves if rango[0] < k <= rango[1]}
+
+        tabla = {"nombre": "clientes", "columna_incremental": "id", "filtro_sql": "LIMIT 10", "columnas_enmascarar": {}}
+        contexto = {"diff_sync": etl.opciones_diff({}), "rendimiento": {}, "version_esquema": 1}
+        with mock.patch.object(etl, "construir_consulta", lambda *a: ("SELECT", None)), \
+             mock.patch.object(etl, "obtener_plan_carga", lambda *a: {"columnas": ["id"]}), \
+             mock.patch.object(etl, "ejecutar_sql_con_reintentos", ejecutar), \
+             mock.patch.object(etl, "hashes_tramos", hashes), \
+             mock.patch.object(etl, "_sql_rango", lambda conn, sql_final, col, a, b: (a, b)), \
+             mock.patch.object(etl, "migrar_consulta", migrar):
+            stats = etl.sincronizar_tabla_diff(tabla, origen, qa, None, contexto)
+        self.assertNotIn("error", stats)
+        self.assertEqual(borrados, [(3, 4)])
+        self.assertEqual(qa.llaves, set(range(1, 16)))
+        print("✅ Test Diff con LIMIT: APROBADO")
+
+class TestStaging(unittest.TestCase):
+
+    # Índices y llaves de QA recreados en la staging con nombre temporal
+    def test_ddl_indices(self):
+        self.assertEqual(sql_texto(etl.ddl_indice("qa.clientes_qa_staging", "clientes_qa_pkey",
+                                                  "CREATE UNIQUE INDEX clientes_qa_pkey ON qa.clientes_qa USING btree (id)",
+                                                  "clientes_qa_pkey", "PRIMARY KEY (id)")),
+                         'ALTER TABLE "qa"."clientes_qa_staging" ADD CONSTRAINT "clientes_qa_pkey_stg" PRIMARY KEY (id)')
+        self.assertEqual(sql_texto(etl.ddl_indice("clientes_qa_staging", "idx_email",
+                                                  "CREATE INDEX idx_email ON ONLY public.clientes_qa USING btree (lower(email))", None, None)),
+                         'CREATE INDEX "idx_email_stg" ON "clientes_qa_staging" USING btree (lower(email))')
+        print("✅ Test DDL de Índices: APROBADO")
+
+    # Triggers, RLS y políticas de la tabla QA apuntando a la staging
+    def test_ddl_triggers_rls_politicas(self):
+        self.assertEqual(sql_texto(etl.ddl_trigger("qa.clientes_qa_staging",
+                                                   "CREATE TRIGGER auditar AFTER INSERT OR UPDATE ON qa.clientes_qa "
+                                                   "FOR EACH ROW EXECUTE FUNCTION qa.auditar()")),
+                         'CREATE TRIGGER auditar AFTER INSERT OR UPDATE ON "qa"."clientes_qa_staging" '
+                         'FOR EACH ROW EXECUTE FUNCTION qa.auditar()')
+        self.assertIsNone(etl.ddl_rls("t_staging", False, False))
+        self.assertEqual(sql_texto(etl.ddl_rls("t_staging", True, False)), 'ALTER TABLE "t_staging" ENABLE ROW LEVEL SECURITY')
+        self.assertEqual(sql_texto(etl.ddl_rls("t_staging", True, True)),
+                         'ALTER TABLE "t_staging" ENABLE ROW LEVEL SECURITY, FORCE ROW LEVEL SECURITY')
+        self.assertEqual(sql_texto(etl.ddl_politica("t_staging", "lectura", "PERMISSIVE", ["authenticated", "public"],
+                                                    "SELECT", "(auth.uid() IS NOT NULL)", None)),
+                         'CREATE POLICY "lectura" ON "t_staging" AS PERMISSIVE FOR SELECT TO "authenticated", PUBLIC'
+                         ' USING ((auth.uid() IS NOT NULL))')
+        self.assertEqual(sql_texto(etl.ddl_politica("t_staging", "alta", "RESTRICTIVE", ["public"], "INSERT", None, "(total > 0)")),
+                         'CREATE POLICY "alta" ON "t_staging" AS RESTRICTIVE FOR INSERT TO PUBLIC WITH CHECK ((total > 0))')
+        print("✅ Test DDL de Triggers/RLS/Políticas: APROBADO")
+
+class TestVerificacion(unittest.TestCase):
+
+    # Un renglón de agregados por lado: nombres estables, valores para JSON y hash de 64 bits en hex
+    def test_agregados_y_resumen(self):
+        import decimal
+        from unittest import mock
+        cursor = mock.MagicMock()
+        cursor.fetchone.return_value = (1211, 101, 3095, decimal.Decimal("19429009.70"), decimal.Decimal(2 ** 64 + 255))
+        agregados = etl.agregados_tabla(cursor, etl.sql.SQL("t"), ["id"], ["total"], etl.sql.SQL("id, total"))
+        self.assertEqual(agregados, {"filas": 1211, "min(id)": 101, "max(id)": 3095, "sum(total)": "19429009.70",
+                                     "hash": "00000000000000ff"})
+        self.assertEqual(etl.resumen_verificacion({"clientes": {"ok": True}, "ordenes": {"ok": False}}),
+                         {"ok": False, "tablas_con_diferencias": ["ordenes"]})
+        print("✅ Test Verificación en Servidor: APROBADO")
+
+class TestHistorialLogs(unittest.TestCase):
+
+    # Historial JSONL: migración del JSON anterior, índice para KPIs y rotación con gzip
+    def test_historial_jsonl_con_rotacion(self):
+        import tempfile, os, json, glob
+        carpeta = tempfile.mkdtemp()
+        originales = (etl.ARCHIVO_LOGS, etl.ARCHIVO_LOGS_LEGADO, etl.ARCHIVO_LOG_INDICE)
+        etl.ARCHIVO_LOGS = os.path.join(carpeta, "logs_historial.jsonl")
+        etl.ARCHIVO_LOGS_LEGADO = os.path.join(carpeta, "logs_historial.json")
+        etl.ARCHIVO_LOG_INDICE = os.path.join(carpeta, "logs_indice.json")
+        try:
+            with open(etl.ARCHIVO_LOGS_LEGADO, "w") as f:
+                json.dump([{"execution_id": "a", "total_registros_movidos": 10}], f)
+            opciones = {"max_mb": 0, "ultimas": 2} # max_mb 0: rota antes de cada escritura
+            etl.guardar_log_local({"execution_id": "b", "total_registros_movidos": 5}, opciones)
+            etl.guardar_log_local({"execution_id": "c", "resultado": "BLOQUEADO"}, opciones)
+
+            indice = etl.cargar_indice_logs()
+            self.assertEqual((indice["ejecuciones"], indice["total_registros_movidos"], indice["bloqueadas"]), (3, 15, 1))
+            self.assertEqual([r["execution_id"] for r in indice["ultimas"]], ["b", "c"])
+            self.assertEqual(len(glob.glob(os.path.join(carpeta, "*.jsonl.gz"))), 2) # [a] y [b]
+            self.assertEqual([l["execution_id"] for l in etl.leer_historial_logs()], ["a", "b", "c"])
+            print(f"✅ Test Historial JSONL: {indice['ejecuciones']} ejecuciones")
+        finally:
+            etl.ARCHIVO_LOGS, etl.ARCHIVO_LOGS_LEGADO, etl.ARCHIVO_LOG_INDICE = originales
+
+    # Hilos guardando a la vez: el índice no pierde ejecuciones
+    def test_indice_con_hilos(self):
+        import tempfile, os, threading
+        from unittest import mock
+        with tempfile.TemporaryDirectory() as carpeta, \
+             mock.patch.object(etl, "ARCHIVO_LOGS", os.path.join(carpeta, "logs_historial.jsonl")), \
+             mock.patch.object(etl, "ARCHIVO_LOGS_LEGADO", os.path.join(carpeta, "logs_historial.json")), \
+             mock.patch.object(etl, "ARCHIVO_LOG_INDICE", os.path.join(carpeta, "logs_indice.json")):
+            etl.guardar_log_local({"execution_id": "inicial", "total_registros_movidos": 1})
+            hilos = [threading.Thread(target=etl.guardar_log_local, args=({"execution_id": str(i), "total_registros_movidos": 1},))
+                     for i in range(16)]
+            for hilo in hilos: hilo.start()
+            for hilo in hilos: hilo.join()
+            indice = etl.cargar_indice_logs()
+        self.assertEqual((indice["ejecuciones"], indice["total_registros_movidos"]), (17, 17))
+        print("✅ Test Índice con Hilos: APROBADO")
+
+    # Varios procesos guardando a la vez (flock): ninguna línea ni ejecución se pierde, aun rotando;
+    # al reconstruir el índice, el segmento activo empieza en su primera ejecución (no en el mtime)
+    def test_procesos_y_segmento(self):
+        import subprocess, sys, json
+        from unittest import mock
+        codigo = ("import main\n"
+                  "for i in range(10): main.guardar_log_local({'execution_id': f'{main.os.getpid()}-{i}', "
+                  "'inicio': '2026-01-01 00:00:00', 'total_registros_movidos': 1}, {'max_mb': 0.002, 'gzip': False})")
+        with tempfile.TemporaryDirectory() as carpeta:
+            entorno = dict(os.environ, ETL_DIR_DATOS=carpeta)
+            procesos = [subprocess.Popen([sys.executable, "-c", codigo], env=entorno,
+                                         cwd=os.path.dirname(os.path.abspath(etl.__file__))) for _ in range(4)]
+            self.assertEqual([p.wait() for p in procesos], [0] * 4)
+            with mock.patch.object(etl, "ARCHIVO_LOGS", os.path.join(carpeta, "logs_historial.jsonl")), \
+                 mock.patch.object(etl, "ARCHIVO_LOGS_LEGADO", os.path.join(carpeta, "logs_historial.json")), \
+                 mock.patch.object(etl, "ARCHIVO_LOG_INDICE", os.path.join(carpeta, "logs_indice.json")):
+                self.assertEqual(etl.cargar_indice_logs()["ejecuciones"], 40)
+                self.assertEqual(len({l["execution_id"] for l in etl.leer_historial_logs()}), 40)
+                self.assertGreater(len(etl.archivos_logs()), 1)  # hubo rotaciones
+
+                os.remove(etl.ARCHIVO_LOG_INDICE)
+                with open(etl.ARCHIVO_LOGS, "w") as f:
+                    for inicio in ("2026-03-01 10:00:00", "2026-03-05 10:00:00"):
+                        f.write(json.dumps({"execution_id": inicio, "inicio": inicio}) + "\n")
+                indice = etl.cargar_indice_logs()
+        self.assertEqual(indice["segmento_inicio"], "2026-03-01 10:00:00")
+        print("✅ Test Historial entre Procesos: APROBADO")
+
+class TestMetricas(unittest.TestCase):
+
+    # Histograma acumulado en el .prom y reintentos atribuidos a la tabla en curso
+    def test_exportacion_prometheus(self):
+        etl.reiniciar_metricas_ejecucion()
+        metricas = etl.nuevas_metricas_tabla()
+        token = etl._METRICAS_TABLA.set(metricas)
+        try:
+            etl.contar_reintento("batch")
+        finally:
+            etl._METRICAS_TABLA.reset(token)
+        for latencia in (0.005, 0.2, 50):
+            etl.observar(metricas["latencia_lote"], latencia)
+        metricas["duracion_segundos"] = 2.0
+
+        log_final = etl.armar_log_final("x", "dev", "2024-01-01 00:00:00", "2024-01-01 00:00:05", 10,
+                                        [{"tabla": "clientes", "registros_leidos": 10, "registros_insertados": 10,
+                                          "errores": [], "metricas": metricas}],
+                                        metricas=etl.metricas_ejecucion("completa", "sync"))
+        texto = etl.formatear_prometheus(log_final)
+        self.assertEqual(log_final["metricas"]["reintentos"], {"batch": 1})
+        self.assertIn('etl_tabla_reintentos{modo="completa",motor="sync",tabla="clientes",operacion="batch"} 1', texto)
+        self.assertIn('etl_tabla_latencia_lote_segundos_bucket{modo="completa",motor="sync",tabla="clientes",le="0.25"} 2', texto)
+        self.assertIn('etl_tabla_latencia_lote_segundos_bucket{modo="completa",motor="sync",tabla="clientes",le="+Inf"} 3', texto)
+        self.assertIn('etl_tabla_filas_por_segundo{modo="completa",motor="sync",tabla="clientes"} 5.0', texto)
+        self.assertEqual(texto.count("# TYPE etl_tabla_latencia_lote_segundos histogram"), 1)
+        print("✅ Test Métricas Prometheus: APROBADO")
+
+class TestPerfilado(unittest.TestCase):
+
+    # --profile completo deja un reporte por tabla con la función caliente y el índice de la ejecución
+    def test_reporte_por_tabla(self):
+        import os, json, tempfile
+        from unittest import mock
+
+        def funcion_caliente():
+            return sum(len(str(i)) for i in range(20000))
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(etl, "DIR_PERFILES", tmp):
+            etl.iniciar_perfilado("completo", {"top": 5}, "ejec")
+            try:
+                with etl.perfilar_tabla("clientes") as resumen:
+                    funcion_caliente()
+            finally:
+                directorio = etl.terminar_perfilado()
+            with open(os.path.join(directorio, "clientes.txt"), encoding="utf-8") as f:
+                reporte = f.read()
+            self.assertIn("funcion_caliente", reporte)
+            self.assertIn("Mayores sitios de asignación", reporte)
+            self.assertTrue(os.path.exists(os.path.join(directorio, "clientes.prof")))
+            self.assertTrue(os.path.exists(os.path.join(directorio, "_ejecucion.txt")))
+            with open(os.path.join(directorio, "indice.json"), encoding="utf-8") as f:
+                self.assertEqual(set(json.load(f)["tablas"]), {"clientes", "_ejecucion"})
+        self.assertTrue(resumen["top"])
+        self.assertIsNone(etl.info_perfilado())
+        print("✅ Test Perfilado: APROBADO")
+
+    # "_ejecucion" se pausa durante la tabla y sigue después; con un solo perfilador (3.12+) la tabla sale del muestreo
+    def test_perfil_principal_y_un_solo_perfilador(self):
+        import os, time, tempfile
+        from unittest import mock
+
+        def funcion_caliente():
+            fin = time.perf_counter() + 0.15
+            while time.perf_counter() < fin:
+                sum(len(str(i)) for i in range(500))
+
+        def fase_principal():
+            return sum(range(1000))
+
+        def reportes(un_solo):
+            with tempfile.TemporaryDirectory() as tmp, mock.patch.object(etl, "DIR_PERFILES", tmp), \
+                 mock.patch.object(etl, "UN_SOLO_PERFILADOR", un_solo):
+                etl.iniciar_perfilado("completo", {"top": 50, "intervalo_ms": 2}, "ejec")
+                try:
+                    with etl.perfilar_tabla("clientes"):
+                        funcion_caliente()
+                    fase_principal()
+                finally:
+                    directorio = etl.terminar_perfilado()
+                leidos = {}
+                for tabla in ("clientes", "_ejecucion"):
+                    with open(os.path.join(directorio, f"{tabla}.txt"), encoding="utf-8") as f:
+                        leidos[tabla] = f.read()
+                return leidos
+
+        leidos = reportes(False)
+        self.assertIn("funcion_caliente", leidos["clientes"])
+        self.assertIn("fase_principal", leidos["_ejecucion"])
+        self.assertNotIn("funcion_caliente", leidos["_ejecucion"])
+        leidos = reportes(True)
+        self.assertIn("Perfil por muestreo", leidos["clientes"])
+        self.assertIn("funcion_caliente", leidos["clientes"])
+        self.assertIn("fase_principal", leidos["_ejecucion"])
+        print("✅ Test Perfil Principal: APROBADO")
+
+class TestGeneradorMasivo(unittest.TestCase):
+
+    # La misma semilla produce las mismas filas sin importar lote_clientes, y las FK cierran
+    def test_semilla_reproducible(self):
+        from unittest import mock
+        import csv
+        import generar_datos as gen
+        pools = gen.crear_pools(7, 50)
+
+        def generar(lote):
+            copiado = {tabla: [] for tabla in gen.COLUMNAS_GENERADOR}
+            class Cursor:
+                def execute(self, consulta, params=None): pass
+                def fetchone(self): return (0,)
+                def copy_expert(self, consulta, buffer):
+                    copiado[consulta.split()[1]].extend(map(tuple, csv.reader(buffer)))
+            class Conexion:
+                def cursor(self): return Cursor()
+                def commit(self): pass
+                def close(self): pass
+            with mock.patch.object(gen.psycopg2, "connect", lambda url: Conexion()), \
+                 mock.patch.object(gen, "crear_pools", lambda semilla, tamano: pools):
+                gen.generar_datos_masivos(log=lambda texto: None, config={"database": {"source_url": ""}},
+                                          clientes=300, semilla=7, clientes_por_pagina=40, lote_clientes=lote)
+            return copiado["clientes"], copiado["ordenes"], copiado["detalle_ordenes"]
+
+        clientes, ordenes, detalles = generar(1000)
+        self.assertEqual((clientes, ordenes, detalles), generar(70))
+        self.assertEqual(len(clientes), 300)
+        self.assertTrue({o[1] for o in ordenes} <= {c[0] for c in clientes})
+        self.assertTrue({d[1] for d in detalles} <= {o[0] for o in ordenes})
+        self.assertEqual(len({c[2] for c in clientes}), 300)  # emails únicos
+
+        def luhn(numero):
+            suma = sum(int(d) if i % 2 == 0 else (2 * int(d) - 9 if int(d) > 4 else 2 * int(d))
+                       for i, d in enumerate(reversed(numero)))
+            return suma % 10 == 0
+        self.assertTrue(all(len(c[4]) == 16 and luhn(c[4]) for c in clientes))
+        altos = sum(float(o[3]) > 12000 for o in ordenes) / len(ordenes)
+        self.assertAlmostEqual(altos, 0.3, delta=0.08)
+        print("✅ Test Generador Reproducible: APROBADO")
+
+    # Generador en línea después del masivo: cada tabla sigue desde su propio MAX(id)
+    def test_generador_en_linea_ids_por_tabla(self):
+        from unittest import mock
+        import generar_datos as gen
+        insertados = {}
+
+        class Cursor:
+            def execute(self, consulta, params=None):
+                if params: insertados.setdefault(consulta.split()[2], []).append(params)
+            def fetchone(self): return (100, 5000, 20000)
+            def close(self): pass
+        class Conexion:
+            def cursor(self): return Cursor()
+            def commit(self): pass
+            def close(self): pass
+        persona = {"name": {"first": "Ana", "last": "Pérez"}, "email": "ana@x.mx", "phone": "55 1234 5678"}
+        respuesta = mock.Mock(**{"json.return_value": {"results": [persona] * gen.NUM_REGISTROS}})
+        with mock.patch.object(gen, "cargar_config", lambda: {"database": {"source_url": ""}}), \
+             mock.patch.object(gen.psycopg2, "connect", lambda url: Conexion()), \
+             mock.patch("requests.get", lambda url: respuesta), mock.patch("builtins.print"):
+            gen.generar_datos_inteligentes()
+        self.assertEqual([c[0] for c in insertados["clientes"]][:2], [101, 102])
+        self.assertEqual([(o[0], o[1]) for o in insertados["ordenes"]][:2], [(5001, 101), (5002, 102)])
+        self.assertEqual([(d[0], d[1]) for d in insertados["detalle_ordenes"]][:2], [(20001, 5001), (20002, 5002)])
+        print("✅ Test Generador en Línea: APROBADO")
+
+class TestPoolMascaras(unittest.TestCase):
+
+    # Importar main.py no carga Faker, NumPy ni psycopg2.extras (llegan al primer uso)
+    def test_importacion_perezosa(self):
+        import subprocess, sys
+        codigo = "import sys, main; print([m for m in ('faker', 'numpy', 'psycopg2.extras') if m in sys.modules])"
+        salida = subprocess.run([sys.executable, "-c", codigo], cwd=os.path.dirname(os.path.abspath(etl.__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(salida.strip(), "[]")
+        print("✅ Test Importación Perezosa: APROBADO")
+
+    # Misma semilla = mismo pool; el archivo se relee tal cual y las reglas muestrean de él
+    def test_pool_con_semilla(self):
+        original = (etl.ARCHIVO_POOL_MASCARAS, dict(etl.POOL_MASCARAS))
+        etl.ARCHIVO_POOL_MASCARAS = os.path.join(tempfile.mkdtemp(), "pool.bin")
+        etl.configurar_pool_mascaras({"activo": True, "semilla": 7, "nombres": 50, "apellidos": 60, "telefonos": 100})
+        try:
+            pool_mascaras = etl.obtener_pool_mascaras()
+            leido = etl.leer_pool_mascaras(etl.ARCHIVO_POOL_MASCARAS)
+            self.assertEqual(leido["nombres"], pool_mascaras["nombres"])
+            self.assertEqual(len(leido["apellidos"]), 60)
+            self.assertEqual(len(leido["telefonos"]), 100)
+            self.assertEqual(etl.generar_pool_mascaras(7, 50, 60, 100)["nombres"], pool_mascaras["nombres"])
+
+            nombres = etl.enmascarar_columna("faker_name", ["Ana", "Luis"])
+            self.assertTrue(all(any(n.startswith(p + " ") for p in pool_mascaras["nombres"]) for n in nombres))
+            telefonos = etl.enmascarar_columna("preserve_format", ["5512345678", None])
+            self.assertIn(telefonos[0], pool_mascaras["telefonos"])
+            self.assertIsNone(telefonos[1])
+        finally:
+            etl.ARCHIVO_POOL_MASCARAS = original[0]
+            etl.configurar_pool_mascaras(original[1])
+        print("✅ Test Pool de Máscaras: APROBADO")
+
+class TestReintentos(unittest.TestCase):
+
+    # Solo lo transitorio se reintenta; la espera crece y respeta el tope
+    def test_clasificacion_y_backoff(self):
+        class ErrorPg(Exception):
+            def __init__(self, pgcode): self.pgcode = pgcode
+        self.assertTrue(etl.es_error_transitorio(ErrorPg("40001")))  # serialization_failure
+        self.assertTrue(etl.es_error_transitorio(ErrorPg("08006")))  # clase 08: conexión
+        self.assertFalse(etl.es_error_transitorio(ErrorPg("23505"))) # unique_violation
+        self.assertTrue(etl.es_error_transitorio(Exception("SSL SYSCALL error: EOF detected")))
+        self.assertFalse(etl.es_error_transitorio(ValueError("columna inválida")))
+
+        original = dict(etl.REINTENTOS)
+        etl.configurar_reintentos({"espera_base": 1, "espera_max": 5, "jitter": False})
+        try:
+            self.assertEqual([etl.espera_reintento(i) for i in (1, 2, 3, 4)], [1, 2, 4, 5])
+            llamadas = []
+            def falla():
+                llamadas.append(1)
+                raise ErrorPg("23505")
+            with self.assertRaises(ErrorPg):
+                etl.reintentar("sql", falla)
+            self.assertEqual(len(llamadas), 1) # Permanente: sin reintento
+        finally:
+            etl.configurar_reintentos(original)
+        print("✅ Test Clasificación de Errores: APROBADO")
+
+    # Se cae la conexión en la segunda página: se reconecta del pool y solo esa página se repite
+    def test_reintenta_solo_la_pagina(self):
+        from unittest import mock
+        class Conexion:
+            def __init__(self): self.closed, self.confirmadas, self.pendiente = 0, [], None
+            def cursor(self): return contextlib.nullcontext(self)
+            def commit(self): self.confirmadas.append(self.pendiente)
+            def rollback(self): self.pendiente = None
+        class Pool:
+            def __init__(self): self.prestadas = []
+            def getconn(self):
+                self.prestadas.append(Conexion())
+                return self.prestadas[-1]
+            def putconn(self, conn, close=False): conn.closed = 1 if close else conn.closed
+
+        enviadas = []
+        def enviar_values(cursor, sql, pagina):
+            enviadas.append(pagina[0][0])
+            if pagina[0][0] == 2 and enviadas.count(2) == 1:
+                cursor.closed = 2
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+            cursor.pendiente = pagina[0][0]
+
+        original = (dict(etl.REINTENTOS), etl.enviar_values)
+        etl.configurar_reintentos({"espera_base": 0, "jitter": False})
+        etl.enviar_values = enviar_values
+        pool_destino = Pool()
+        try:
+            conn = etl.registrar_conexion(pool_destino.getconn(), pool_destino)
+            plan = {"tabla_qa": "t_qa", "conflicto": "ON CONFLICT (id) DO NOTHING", "sql_values": "", "indices": [0], "extra": ()}
+            enviadas_total = etl.cargar_lote(conn, plan, [(i,) for i in range(6)], proyectadas=True, filas_por_pagina=2)
+            self.assertEqual(enviadas_total, 6)
+            self.assertEqual(enviadas, [0, 2, 2, 4])
+            nueva = etl.conexion_vigente(conn)
+            self.assertIsNot(nueva, conn)
+            self.assertEqual((conn.confirmadas, nueva.confirmadas), ([0], [2, 4]))
+            etl.devolver_conexion(pool_destino, conn)
+            self.assertIs(etl.conexion_vigente(conn), conn)
+            self.assertFalse({id(conn), id(nueva)} & set(etl._CONEXIONES)) # Sin entradas huérfanas (los id() se reciclan)
+
+            # Conexión propia de un proceso de rango (origen = URL): al cerrarla también sale del registro
+            with mock.patch.object(etl, "conectar_con_reintentos", lambda url: Conexion()):
+                conn = etl.registrar_conexion(Conexion(), "postgresql://qa")
+                nueva = etl.reconectar(conn)
+                self.assertIs(etl.olvidar_conexion(conn), nueva)
+            self.assertFalse({id(conn), id(nueva)} & set(etl._CONEXIONES))
+            self.assertNotIn(id(conn), etl._REEMPLAZOS)
+        finally:
+            etl.configurar_reintentos(original[0])
+            etl.enviar_values = original[1]
+        print("✅ Test Reintento por Página: APROBADO")
+
+class TestEnsayo(unittest.TestCase):
+
+    # Filas/seg por tabla desde la auditoría: diff, CDC y cargas vacías no cuentan
+    def test_rendimiento_historico(self):
+        carga = lambda tabla, filas, segundos: {"tabla": tabla, "registros_leidos": filas, "metricas": {"duracion_segundos": segundos}}
+        ejecuciones = [
+            [carga("clientes", 1000, 2.0), carga("ordenes", 500, 1.0)],
+            [carga("clientes", 3000, 2.0), dict(carga("ordenes", 10, 5.0), consultas_hash=4)],
+            [dict(carga("ordenes", 10, 5.0), cambios_leidos=10), carga("clientes", 0, 0.1)],
+            "no es una lista",
+        ]
+        por_tabla, global_ = etl.rendimiento_historico(ejecuciones)
+        self.assertEqual(por_tabla, {"clientes": 1000.0, "ordenes": 500.0})
+        self.assertEqual(global_, 4500 / 5.0)
+        self.assertEqual(etl.rendimiento_historico([]), ({}, None))
+        self.assertEqual(etl.formato_bytes(1536), "1.5 KB")
+        print("✅ Test Proyección del Ensayo: APROBADO")
+
+class TestBenchmark(unittest.TestCase):
+
+    # Solo empeorar más allá de la tolerancia es regresión (filas/seg: bajar es peor)
+    def test_comparar_contra_baseline(self):
+        import benchmark
+        caso = {"tamano": "10k", "modo": "completa", "motor": "sync",
+                "segundos": 10.0, "filas_por_segundo": 1000.0, "rss_pico_mb": 100.0, "viajes_total": 50}
+        baseline = {"casos": [caso]}
+        actual = {"casos": [dict(caso, segundos=10.5, filas_por_segundo=800.0, viajes_total=40)]}
+        regresiones = {fila[1] for fila in benchmark.comparar_resultados(baseline, actual, 0.10) if fila[-1]}
+        self.assertEqual(regresiones, {"filas_por_segundo"})
+        print("✅ Test Comparación Benchmark: APROBADO")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file